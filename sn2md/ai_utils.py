@@ -1,35 +1,368 @@
+import re
+import threading
+from functools import lru_cache
 from io import BytesIO
+from typing import Any, Callable
+from PIL import Image as PILImage
 from PIL.Image import Image
 
 import llm
 
-def convert_image(
-    text: str, attachment: llm.Attachment, api_key: str | None, model: str
-) -> str:
+from sn2md.deadlines import Deadline, daemon_map
+from sn2md.hedging import DEFAULT_KIND, RequestPolicy
+from sn2md.images import crop_to_content, png_bytes
+
+# Appended to the prompt when several pages are sent in one request.
+MULTI_PAGE_INSTRUCTIONS = """
+The {count} images are consecutive pages. Convert each page separately, and
+start the markdown of each page with a line containing only "<!-- page N -->",
+where N is the number of the image (1 to {count}).
+"""
+
+PAGE_DELIMITER = re.compile(r"^<!-- page (\d+) -->[ \t]*$", re.MULTILINE)
+
+# Appended to the prompt when a page is sent in bands (see `bands_to_markdown`).
+BAND_INSTRUCTIONS = """
+The image is band {number} of the {count} horizontal bands of a page, from top
+to bottom. Bands overlap slightly: convert all of this band, including text
+cut off at its top or bottom edge.
+"""
+
+
+@lru_cache(maxsize=None)
+def get_model(model: str, api_key: str | None) -> llm.Model:
+    """Return the model (with its key set), reusing it on subsequent calls.
+
+    Looking up a model runs every llm plugin's model registration, so this is
+    done once per model rather than once per page.
+    """
     # TODO handle no such model
     llm_model = llm.get_model(model)
     if api_key:
         llm_model.key = api_key
-    response = llm_model.prompt(text, attachments=[attachment])
-    return response.text()
+    return llm_model
+
+
+@lru_cache(maxsize=None)
+def get_policy(
+    hedge_percentile: float | None,
+    hedge_models: tuple[str, ...],
+    fallback_models: tuple[str, ...],
+) -> RequestPolicy:
+    """Return the request policy for these settings, shared by all requests
+    (so hedge delays are computed from the latencies of every request of the
+    same kind)."""
+    return RequestPolicy(hedge_percentile, list(hedge_models), list(fallback_models))
+
+
+def _cache_options(llm_model: llm.Model) -> dict[str, Any]:
+    """Ask the model's provider to cache the prompt, if its plugin has an
+    option for it (providers like OpenAI cache long prompt prefixes without
+    one)."""
+    options = getattr(llm_model, "Options", None)
+    if options is not None and "cache" in getattr(options, "model_fields", {}):
+        return {"cache": True}
+    return {}
+
+
+def _prompt(
+    text: str,
+    attachments: list[llm.Attachment],
+    api_key: str | None,
+    model: str,
+    on_chunk: Callable[[str], None] | None = None,
+    cancel: threading.Event | None = None,
+    system: str | None = None,
+) -> tuple[str, llm.Usage | None]:
+    """Prompt the model, returning its response and its token usage (None when
+    the response was cancelled)."""
+    llm_model = get_model(model, api_key)
+    response = llm_model.prompt(
+        text,
+        attachments=attachments,
+        system=system or None,
+        **_cache_options(llm_model),
+    )
+    if on_chunk is None and cancel is None:
+        return response.text(), response.usage()
+
+    chunks = []
+    for chunk in response:
+        if cancel is not None and cancel.is_set():
+            # Another request answered first: stop reading this response.
+            return "".join(chunks), None
+        if on_chunk is not None:
+            on_chunk(chunk)
+        chunks.append(chunk)
+    return "".join(chunks), response.usage()
+
+
+def convert_images(
+    text: str,
+    attachments: list[llm.Attachment],
+    api_key: str | None,
+    model: str,
+    on_chunk: Callable[[str], None] | None = None,
+    policy: RequestPolicy | None = None,
+    *,
+    system: str | None = None,
+    on_usage: Callable[[llm.Usage], None] | None = None,
+    timeout: float | None = None,
+    deadline: Deadline | None = None,
+    kind: str = DEFAULT_KIND,
+) -> str:
+    """Prompt the model, returning its response.
+
+    With `on_chunk`, the response is streamed: each chunk of text is passed to
+    `on_chunk` as it arrives. With a `policy`, the request is hedged and/or
+    failed over to other models (hedged responses aren't streamed: the
+    response that is used is passed to `on_chunk` in one chunk).
+
+    `system` is sent as the system prompt, ahead of `text` and the images, so
+    that requests with the same system prompt share a cacheable prefix. The
+    token usage of the response that is used is passed to `on_usage`.
+
+    Requests that take longer than `timeout` seconds, or go past the
+    `deadline`, raise a TimeoutError (see `RequestPolicy.run`). The request
+    can't be interrupted: it is abandoned, and stops reading its response.
+    The hedge delay is computed from the latencies of the same `kind` of
+    request.
+    """
+    if policy is None and (timeout is not None or deadline is not None):
+        policy = RequestPolicy()
+
+    if policy is None:
+        response, usage = _prompt(text, attachments, api_key, model, on_chunk, system=system)
+    else:
+        hedged = policy.hedge_percentile is not None
+
+        def request(request_model: str, cancel: threading.Event) -> tuple[str, llm.Usage | None]:
+            return _prompt(
+                text,
+                attachments,
+                api_key,
+                request_model,
+                None if hedged else on_chunk,
+                cancel,
+                system,
+            )
+
+        response, usage = policy.run(request, model, timeout, deadline, kind)
+        if hedged and on_chunk is not None:
+            on_chunk(response)
+
+    if on_usage is not None and usage is not None:
+        on_usage(usage)
+    return response
+
+
+def convert_image(
+    text: str,
+    attachment: llm.Attachment,
+    api_key: str | None,
+    model: str,
+    on_chunk: Callable[[str], None] | None = None,
+    policy: RequestPolicy | None = None,
+    *,
+    system: str | None = None,
+    on_usage: Callable[[llm.Usage], None] | None = None,
+    timeout: float | None = None,
+    deadline: Deadline | None = None,
+    kind: str = DEFAULT_KIND,
+) -> str:
+    return convert_images(
+        text,
+        [attachment],
+        api_key,
+        model,
+        on_chunk,
+        policy,
+        system=system,
+        on_usage=on_usage,
+        timeout=timeout,
+        deadline=deadline,
+        kind=kind,
+    )
+
+
+def _page_attachment(page: str | bytes, crop_padding: int | None) -> llm.Attachment:
+    """The attachment of a page image: a path, or a PNG held in memory."""
+    if crop_padding is None:
+        if isinstance(page, bytes):
+            return llm.Attachment(content=page)
+        return llm.Attachment(path=page)
+
+    # Only the image sent to the model is cropped; the page image is unchanged.
+    with PILImage.open(BytesIO(page) if isinstance(page, bytes) else page) as image:
+        return llm.Attachment(
+            content=_image_to_bytes(crop_to_content(image, crop_padding))
+        )
 
 
 def image_to_markdown(
-    path: str, context: str, api_key: str | None, model: str, prompt: str
+    path: str | bytes,
+    context: str,
+    api_key: str | None,
+    model: str,
+    prompt: str,
+    crop_padding: int | None = None,
+    on_chunk: Callable[[str], None] | None = None,
+    policy: RequestPolicy | None = None,
+    *,
+    system: str | None = None,
+    on_usage: Callable[[llm.Usage], None] | None = None,
+    timeout: float | None = None,
+    deadline: Deadline | None = None,
 ) -> str:
+    """Convert a page. The keyword arguments are passed to `convert_images`."""
     return convert_image(
-        prompt.format(context=context), llm.Attachment(path=path), api_key, model
+        prompt.format(context=context),
+        _page_attachment(path, crop_padding),
+        api_key,
+        model,
+        on_chunk,
+        policy,
+        system=system,
+        on_usage=on_usage,
+        timeout=timeout,
+        deadline=deadline,
     )
 
 
+def bands_to_markdown(
+    path: str | bytes,
+    context: str,
+    api_key: str | None,
+    model: str,
+    prompt: str,
+    bands: int,
+    overlap: float,
+    crop_padding: int | None = None,
+    on_chunk: Callable[[str], None] | None = None,
+    policy: RequestPolicy | None = None,
+    *,
+    system: str | None = None,
+    on_usage: Callable[[llm.Usage], None] | None = None,
+    timeout: float | None = None,
+    deadline: Deadline | None = None,
+) -> str:
+    """Convert a page in overlapping horizontal bands (see `tiles.split_bands`),
+    sent in concurrent requests, and merge their markdown.
+
+    Shorter responses arrive sooner, so a dense page converts faster in bands.
+    The merged markdown is passed to `on_chunk` once it is complete, and the
+    token usage of every band to `on_usage`. The other keyword arguments are
+    passed to `convert_images`.
+    """
+    from sn2md.tiles import merge_bands, split_bands
+
+    usages: list[llm.Usage] = []
+
+    def band_to_markdown(band: tuple[int, bytes]) -> str:
+        number, image = band
+        return convert_image(
+            # Only the first band follows the previous page:
+            prompt.format(context=context if number == 1 else "")
+            + BAND_INSTRUCTIONS.format(number=number, count=bands),
+            llm.Attachment(content=image),
+            api_key,
+            model,
+            policy=policy,
+            system=system,
+            on_usage=usages.append,
+            timeout=timeout,
+            deadline=deadline,
+            kind="band",
+        )
+
+    markdowns = daemon_map(
+        band_to_markdown,
+        enumerate(split_bands(path, bands, overlap, crop_padding), start=1),
+        bands,
+    )
+
+    if on_usage is not None:
+        for usage in usages:
+            on_usage(usage)
+    markdown = merge_bands(markdowns)
+    if on_chunk is not None:
+        on_chunk(markdown)
+    return markdown
+
+
+def split_pages(text: str, count: int) -> list[str] | None:
+    """Split a multi-page response into the markdown of each page.
+
+    Returns None unless the response has exactly the delimiters of pages 1 to
+    `count`, in order.
+    """
+    parts = PAGE_DELIMITER.split(text)
+    # parts: [preamble, "1", page 1, "2", page 2, ...]
+    numbers = [int(number) for number in parts[1::2]]
+    if numbers != list(range(1, count + 1)) or parts[0].strip():
+        return None
+    return [page.strip("\n") for page in parts[2::2]]
+
+
+def images_to_markdown(
+    paths: list[str | bytes],
+    context: str,
+    api_key: str | None,
+    model: str,
+    prompt: str,
+    crop_padding: int | None = None,
+    on_chunk: Callable[[str], None] | None = None,
+    policy: RequestPolicy | None = None,
+    *,
+    system: str | None = None,
+    on_usage: Callable[[llm.Usage], None] | None = None,
+    timeout: float | None = None,
+    deadline: Deadline | None = None,
+) -> list[str] | None:
+    """Convert several consecutive pages in one request.
+
+    Returns the markdown of each page, or None if the response couldn't be
+    split into pages. The keyword arguments are passed to `convert_images`.
+    """
+    text = convert_images(
+        prompt.format(context=context)
+        + MULTI_PAGE_INSTRUCTIONS.format(count=len(paths)),
+        [_page_attachment(path, crop_padding) for path in paths],
+        api_key,
+        model,
+        on_chunk,
+        policy,
+        system=system,
+        on_usage=on_usage,
+        timeout=timeout,
+        deadline=deadline,
+        # Responses grow with the number of pages:
+        kind=f"{len(paths)} pages",
+    )
+    return split_pages(text, len(paths))
+
+
 def _image_to_bytes(image: Image) -> bytes:
-    # Convert PIL Image to bytes
-    img_byte_arr = BytesIO()
-    image.save(img_byte_arr, format="PNG")
-    return img_byte_arr.getvalue()
+    return png_bytes(image)
 
 
-def image_to_text(image: Image, api_key: str | None, model: str, prompt: str) -> str:
+def image_to_text(
+    image: Image,
+    api_key: str | None,
+    model: str,
+    prompt: str,
+    policy: RequestPolicy | None = None,
+    *,
+    timeout: float | None = None,
+    deadline: Deadline | None = None,
+) -> str:
     return convert_image(
-        prompt, llm.Attachment(content=_image_to_bytes(image)), api_key, model
+        prompt,
+        llm.Attachment(content=_image_to_bytes(image)),
+        api_key,
+        model,
+        policy=policy,
+        timeout=timeout,
+        deadline=deadline,
+        kind="title",
     )
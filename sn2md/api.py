@@ -0,0 +1,164 @@
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Iterator
+
+from sn2md.importer import convert_pages, create_notebook_context
+from sn2md.importers.registry import get_extractor
+from sn2md.stats import RunStats
+from sn2md.types import Config, ImageExtractor
+
+# A file to convert: a path, its content, or a binary file object.
+Source = str | os.PathLike[str] | bytes | BinaryIO
+
+
+@dataclass
+class Page:
+    # The (zero based) page number.
+    number: int
+    markdown: str
+    # The PNG of the page.
+    image: bytes
+    # The model whose output was used.
+    model: str
+    # The seconds from the start of the conversion to when the page completed.
+    elapsed: float
+
+
+@dataclass
+class Result:
+    pages: list[Page]
+    # The links, keywords and titles of a notebook (empty for other files), as
+    # in the context of output templates.
+    links: list[dict[str, Any]] = field(default_factory=list)
+    keywords: list[dict[str, Any]] = field(default_factory=list)
+    titles: list[dict[str, Any]] = field(default_factory=list)
+    stats: RunStats = field(default_factory=RunStats)
+    # The seconds the conversion took.
+    duration: float = 0.0
+
+    @property
+    def markdown(self) -> str:
+        """The markdown of the whole document (as `llm_output` in templates)."""
+        return "".join("\n" + page.markdown for page in self.pages)
+
+
+def _open(
+    source: Source, file_type: str | None, config: Config
+) -> tuple[bytes, ImageExtractor]:
+    """Read a source, returning its content and extractor."""
+    name = None
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+    elif isinstance(source, (str, os.PathLike)):
+        name = os.fspath(source)
+        with open(name, "rb") as f:
+            data = f.read()
+    else:
+        data = source.read()
+        name = getattr(source, "name", None)
+
+    if file_type is None:
+        if not isinstance(name, str):
+            raise ValueError("file_type is required to convert content without a file name")
+        file_type = os.path.splitext(name)[1]
+    extension = "." + file_type.lower().lstrip(".")
+    image_extractor = get_extractor("source" + extension, config)
+    if image_extractor is None:
+        raise ValueError(f"Unsupported file type: {extension}")
+    return data, image_extractor
+
+
+def _iter_pages(
+    data: bytes,
+    image_extractor: ImageExtractor,
+    config: Config,
+    model: str,
+    pages: list[int] | None,
+    stats: RunStats,
+    start: float,
+) -> Iterator[Page]:
+    # Pages are rendered as they are converted, and their images are held until
+    # they are yielded.
+    images = {}
+    ink_images = {}
+
+    def render() -> Iterator[tuple[int, bytes]]:
+        for number, image, llm_image, ink_image in image_extractor.render_pages(data, pages):
+            images[number] = image
+            ink_images[number] = ink_image
+            yield number, llm_image
+
+    for number, markdown in convert_pages(
+        render(), {}, config, model, stats=stats, ink_pages=ink_images
+    ):
+        del ink_images[number]
+        yield Page(
+            number,
+            markdown,
+            images.pop(number),
+            stats.page_models[number],
+            time.monotonic() - start,
+        )
+
+
+def iter_pages(
+    source: Source,
+    config: Config | None = None,
+    *,
+    file_type: str | None = None,
+    model: str | None = None,
+    pages: list[int] | None = None,
+    stats: RunStats | None = None,
+) -> Iterator[Page]:
+    """Convert a file, yielding each page as it completes.
+
+    `file_type` is the extension of the file (e.g. ".note"), required when the
+    source has no file name. `pages` selects (zero based, sorted) page numbers
+    to convert. The models and token usage of the requests are recorded in
+    `stats`.
+    """
+    config = config if config else Config()
+    data, image_extractor = _open(source, file_type, config)
+    yield from _iter_pages(
+        data,
+        image_extractor,
+        config,
+        model if model else config.model,
+        pages,
+        stats if stats is not None else RunStats(),
+        time.monotonic(),
+    )
+
+
+def convert(
+    source: Source,
+    config: Config | None = None,
+    *,
+    file_type: str | None = None,
+    model: str | None = None,
+    pages: list[int] | None = None,
+) -> Result:
+    """Convert a file, returning its pages, notebook metadata and statistics.
+
+    See `iter_pages` for the arguments.
+    """
+    start = time.monotonic()
+    config = config if config else Config()
+    model = model if model else config.model
+    data, image_extractor = _open(source, file_type, config)
+    stats = RunStats()
+    converted = list(
+        _iter_pages(data, image_extractor, config, model, pages, stats, start)
+    )
+
+    notebook = image_extractor.read_notebook(data)
+    context = create_notebook_context(notebook, config, model) if notebook else {}
+    return Result(
+        converted,
+        context.get("links", []),
+        context.get("keywords", []),
+        context.get("titles", []),
+        stats,
+        time.monotonic() - start,
+    )
@@ -0,0 +1,182 @@
+import hashlib
+import os
+import tarfile
+import time
+import zipfile
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import TYPE_CHECKING, Callable, Iterator
+
+from sn2md.importers.registry import EXTRACTORS
+from sn2md.scheduler import matches
+from sn2md.types import ImageExtractor
+
+if TYPE_CHECKING:
+    from supernotelib import Notebook
+
+# Archives that directory conversions can read files from, without extracting
+# them.
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+def is_archive(path: str) -> bool:
+    return os.path.isfile(path) and path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+@dataclass
+class ArchiveMember:
+    archive: str
+    # The path of the member in the archive, with "/" separators.
+    name: str
+    size: int
+    mtime_ns: int
+    read: Callable[[], bytes] = field(repr=False, compare=False)
+
+    @property
+    def path(self) -> str:
+        """The path the member is known by: the archive path plus its name."""
+        return os.path.join(self.archive, *self.name.split("/"))
+
+    @cached_property
+    def data(self) -> bytes:
+        return self.read()
+
+    @cached_property
+    def hash(self) -> str:
+        """The sha1 hex digest of the member's contents (as `compute_hash`)."""
+        return hashlib.sha1(self.data).hexdigest()
+
+
+def selected(name: str, include: list[str], exclude: list[str]) -> bool:
+    """Whether a member is a supported file selected by the globs (see
+    `scheduler.scan_directory`)."""
+    if os.path.splitext(name)[1].lower() not in EXTRACTORS:
+        return False
+    parts = name.split("/")
+    for i in range(1, len(parts)):
+        if any(matches("/".join(parts[:i]), True, glob) for glob in exclude):
+            return False
+    if any(matches(name, False, glob) for glob in exclude):
+        return False
+    return not include or any(matches(name, False, glob) for glob in include)
+
+
+def _read_tar_member(archive: tarfile.TarFile, info: tarfile.TarInfo) -> bytes:
+    f = archive.extractfile(info)
+    # Only regular files are read, and they always have content:
+    assert f is not None
+    return f.read()
+
+
+def iter_members(
+    path: str, include: list[str] | None = None, exclude: list[str] | None = None
+) -> Iterator[ArchiveMember]:
+    """Yield the supported files of an archive, in the order they are stored.
+
+    Members are only read (and decompressed) when their `data` is used. Tar
+    archives are read as a stream, so the data of a member must be used before
+    the next member is yielded.
+    """
+    include = include or []
+    exclude = exclude or []
+    if path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                name = info.filename.removeprefix("./")
+                if info.is_dir() or not selected(name, include, exclude):
+                    continue
+                mtime = time.mktime((*info.date_time, 0, 0, -1))
+                yield ArchiveMember(
+                    path,
+                    name,
+                    info.file_size,
+                    int(mtime * 1_000_000_000),
+                    lambda info=info: archive.read(info),
+                )
+    else:
+        with tarfile.open(path, "r|*") as archive:
+            for info in archive:
+                name = info.name.removeprefix("./")
+                if not info.isfile() or not selected(name, include, exclude):
+                    continue
+                yield ArchiveMember(
+                    path,
+                    name,
+                    info.size,
+                    int(info.mtime * 1_000_000_000),
+                    lambda info=info: _read_tar_member(archive, info),
+                )
+
+
+class MemberExtractor(ImageExtractor):
+    """Extract the pages of an archive member, from memory.
+
+    Pages are rendered by the extractor of the member's file type (with
+    `render_pages`), and saved as PNGs like other extractors save them.
+    """
+
+    def __init__(self, extractor: ImageExtractor, member: ArchiveMember):
+        super().__init__(extractor.config)
+        self.extractor = extractor
+        self.member = member
+        self.llm_images: dict[str, str] = {}
+        self.ink_images: dict[str, str] = {}
+
+    @property
+    def errors(self) -> tuple[type[Exception], ...]:
+        return self.extractor.errors
+
+    def extract_images(
+        self, filename: str, output_path: str, pages: list[int] | None = None
+    ) -> list[str]:
+        basename = os.path.join(output_path, os.path.basename(output_path))
+        # Pad page numbers like the other extractors (by the number of pages):
+        digits = len(str(self.extractor.count_pages(self.member.data)))
+        files = []
+        for number, image, llm_image, ink_image in self.extractor.render_pages(
+            self.member.data, pages
+        ):
+            file_name = f"{basename}_{str(number).zfill(digits)}.png"
+            with open(file_name, "wb") as f:
+                f.write(image)
+            llm_file_name = self._save_other(output_path, "llm", file_name, image, llm_image)
+            self.llm_images[file_name] = llm_file_name
+            self.ink_images[file_name] = (
+                llm_file_name
+                if ink_image == llm_image
+                else self._save_other(output_path, "ink", file_name, image, ink_image)
+            )
+            files.append(file_name)
+        return files
+
+    @staticmethod
+    def _save_other(
+        output_path: str, directory: str, file_name: str, image: bytes, other: bytes
+    ) -> str:
+        """Save another image of a page (for the LLM, or to measure ink on) in a
+        directory of `output_path`, unless it is the page image itself.
+        Returns the file name of the image."""
+        if other == image:
+            return file_name
+        other_file_name = os.path.join(output_path, directory, os.path.basename(file_name))
+        os.makedirs(os.path.dirname(other_file_name), exist_ok=True)
+        with open(other_file_name, "wb") as f:
+            f.write(other)
+        return other_file_name
+
+    def get_llm_image(self, image_path: str) -> str:
+        return self.llm_images.get(image_path, image_path)
+
+    def get_ink_image(self, image_path: str) -> str:
+        return self.ink_images.get(image_path, image_path)
+
+    def render_pages(
+        self, data: bytes, pages: list[int] | None = None
+    ) -> Iterator[tuple[int, bytes, bytes, bytes]]:
+        return self.extractor.render_pages(data, pages)
+
+    def count_pages(self, data: bytes) -> int:
+        return self.extractor.count_pages(data)
+
+    def get_notebook(self, filename: str) -> "Notebook | None":
+        return self.extractor.read_notebook(self.member.data)
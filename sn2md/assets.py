@@ -0,0 +1,57 @@
+import errno
+import os
+import shutil
+
+from sn2md.metadata import compute_hash
+
+
+def _replace_with_copy(src: str, dst: str) -> None:
+    shutil.copyfile(src, dst + ".tmp")
+    os.replace(dst + ".tmp", dst)
+
+
+def move_file(src: str, dst: str) -> None:
+    """Move a file, replacing `dst`. Falls back to copying the file when `dst`
+    is on another filesystem."""
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        _replace_with_copy(src, dst)
+        os.remove(src)
+
+
+def link_file(src: str, dst: str) -> None:
+    """Make `dst` a hard link to `src`, replacing `dst`. Falls back to copying
+    the file where hard links aren't possible (e.g. across filesystems)."""
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return
+    try:
+        os.link(src, dst + ".tmp")
+    except OSError:
+        _replace_with_copy(src, dst)
+    else:
+        os.replace(dst + ".tmp", dst)
+
+
+def asset_path(store: str, digest: str, extension: str) -> str:
+    """The path of a file in a content-addressed store."""
+    return os.path.join(store, digest[:2], digest + extension)
+
+
+def store_asset(path: str, store: str, digest: str | None = None) -> str:
+    """Move a file into a content-addressed store, returning its path in the store.
+
+    A file already in the store (one with the same content) is kept, and the
+    new copy is removed. `digest` is the hash of the file, when it is known.
+    """
+    digest = digest if digest else compute_hash(path)
+    stored = asset_path(store, digest, os.path.splitext(path)[1])
+    if os.path.exists(stored):
+        if not os.path.samefile(path, stored):
+            os.remove(path)
+    else:
+        os.makedirs(os.path.dirname(stored), exist_ok=True)
+        move_file(path, stored)
+    return stored
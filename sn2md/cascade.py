@@ -0,0 +1,101 @@
+import re
+from io import BytesIO
+
+from PIL import Image
+
+from sn2md.images import ink_percent
+
+# The start of a response that declines to transcribe the page.
+REFUSAL = re.compile(
+    r"^\W*(I'm sorry|I am sorry|Sorry,|I can't|I cannot|I'm unable|I am unable|I apologi[sz]e)",
+    re.IGNORECASE,
+)
+
+# The diagram types a mermaid block can start with.
+MERMAID_DIAGRAMS = (
+    "graph",
+    "flowchart",
+    "sequenceDiagram",
+    "classDiagram",
+    "stateDiagram",
+    "erDiagram",
+    "journey",
+    "gantt",
+    "pie",
+    "quadrantChart",
+    "requirementDiagram",
+    "gitGraph",
+    "mindmap",
+    "timeline",
+    "sankey",
+    "xychart",
+    "block",
+)
+
+FENCE = re.compile(r"^\s*```", re.MULTILINE)
+MERMAID_BLOCK = re.compile(r"^\s*```mermaid[ \t]*\n(.*?)^\s*```", re.MULTILINE | re.DOTALL)
+LATEX_ENVIRONMENT = re.compile(r"\\(begin|end)\{([^}]*)\}")
+
+
+def malformed_mermaid(markdown: str) -> bool:
+    """Whether the markdown has an unclosed code block, or a mermaid block that
+    doesn't start with a diagram type."""
+    if len(FENCE.findall(markdown)) % 2:
+        return True
+    for block in MERMAID_BLOCK.findall(markdown):
+        lines = [line.strip() for line in block.splitlines() if line.strip()]
+        # Skip mermaid comments:
+        lines = [line for line in lines if not line.startswith("%%")]
+        if not lines or not lines[0].startswith(MERMAID_DIAGRAMS):
+            return True
+    return False
+
+
+def malformed_latex(markdown: str) -> bool:
+    """Whether the markdown has unbalanced math delimiters or environments."""
+    # Code blocks and escaped dollars aren't math:
+    text = re.sub(r"```.*?```", "", markdown, flags=re.DOTALL).replace("\\$", "")
+    if text.count("$$") % 2:
+        return True
+    if text.replace("$$", "").count("$") % 2:
+        return True
+
+    environments = []
+    for kind, name in LATEX_ENVIRONMENT.findall(text):
+        if kind == "begin":
+            environments.append(name)
+        elif not environments or environments.pop() != name:
+            return True
+    return bool(environments)
+
+
+def text_per_ink(markdown: str, image: str | bytes) -> float | None:
+    """The characters of markdown per percent of the page (a path, or a PNG
+    held in memory) covered in ink, or None for a blank page."""
+    with Image.open(BytesIO(image) if isinstance(image, bytes) else image) as page:
+        ink = ink_percent(page)
+    if ink == 0:
+        return None
+    return len(markdown.strip()) / ink
+
+
+def escalation_reason(
+    markdown: str, image: str | bytes, min_text_per_ink: float
+) -> str | None:
+    """Return why the markdown of a page should be converted again by a
+    stronger model, or None if it looks fine."""
+    ratio = text_per_ink(markdown, image)
+    if ratio is None:
+        # Nothing to transcribe on a blank page.
+        return None
+    if not markdown.strip():
+        return "empty"
+    if REFUSAL.match(markdown):
+        return "refusal"
+    if malformed_latex(markdown):
+        return "latex"
+    if malformed_mermaid(markdown):
+        return "mermaid"
+    if ratio < min_text_per_ink:
+        return "text per ink"
+    return None
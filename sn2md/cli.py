@@ -1,23 +1,30 @@
+import dataclasses
 import logging
+import os
 import sys
 import tomllib
 
 import click
 from platformdirs import user_config_dir
 
-from sn2md.importers.pdf import PDFExtractor
-from sn2md.importers.png import PNGExtractor
-
+from .archives import is_archive
 from .importer import (
     logger as importer_logger,
+    get_extractor,
     import_supernote_directory_core,
     import_supernote_file_core,
+    import_supernote_queue_core,
 )
-from .importers.note import NotebookExtractor
 from .types import Config
 
 logger = logging.getLogger(__name__)
 
+# The address `sn2md serve` listens on by default.
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# The file `sn2md serve` writes its token to, and clients read it from.
+DEFAULT_TOKEN_FILE = os.path.join(user_config_dir(), "sn2md-server.token")
+
 
 def setup_logging(level):
     logging.basicConfig(level=level)
@@ -38,6 +45,34 @@ def get_config(config_file: str) -> Config:
     return Config()
 
 
+def parse_pages(ctx, param, value: str | None) -> list[int] | None:
+    """Parse a page selection like "10-20,42" (one based) into sorted, zero
+    based page numbers."""
+    if value is None:
+        return None
+
+    pages = set()
+    try:
+        for part in value.split(","):
+            start, _, end = part.strip().partition("-")
+            first, last = int(start), int(end or start)
+            if first < 1 or last < first:
+                raise ValueError(part)
+            pages.update(range(first - 1, last))
+    except ValueError:
+        raise click.BadParameter(f"Invalid page selection: {value}")
+    return sorted(pages)
+
+
+pages_option = click.option(
+    "--pages",
+    "-p",
+    callback=parse_pages,
+    default=None,
+    help="Only convert these pages (e.g. 10-20,42), merging them into the existing output.",
+)
+
+
 @click.group()
 @click.option(
     "--config",
@@ -59,6 +94,12 @@ def get_config(config_file: str) -> Config:
     is_flag=True,
     help="Force reprocessing even if the notebook hasn't changed.",
 )
+@click.option(
+    "--resume/--no-resume",
+    is_flag=True,
+    default=True,
+    help="Resume an interrupted conversion from the first page not yet converted.",
+)
 @click.option(
     "--progress/--no-progress",
     is_flag=True,
@@ -77,41 +118,108 @@ def get_config(config_file: str) -> Config:
     default=None,
     help="Set the LLM model (default: gpt-4o-mini)",
 )
+@click.option(
+    "--server",
+    envvar="SN2MD_SERVER",
+    default=None,
+    help="Submit conversions to a running `sn2md serve` (e.g. http://127.0.0.1:8765).",
+)
+@click.option(
+    "--server-token",
+    envvar="SN2MD_SERVER_TOKEN",
+    default=None,
+    help=f"The token of the `--server` (default: read from {DEFAULT_TOKEN_FILE}).",
+)
 @click.pass_context
-def cli(ctx, config, output, force, progress, level, model):
+def cli(ctx, config, output, force, resume, progress, level, model, server, server_token):
     ctx.obj = {}
     ctx.obj["config"] = get_config(config)
     ctx.obj["output"] = output
     ctx.obj["force"] = force
+    ctx.obj["resume"] = resume
     ctx.obj["level"] = level
     ctx.obj["model"] = model
     ctx.obj["progress"] = progress
+    ctx.obj["server"] = server
+    ctx.obj["server_token"] = server_token
     setup_logging(level)
 
 
+def run_server_job(
+    ctx,
+    path: str,
+    directory: bool,
+    pages: list[int] | None,
+    include: list[str] | None = None,
+    exclude: list[str] | None = None,
+) -> None:
+    """Run a conversion on the `--server`, and exit with an error if it fails.
+
+    The server converts with its own configuration: only the `include` and
+    `exclude` globs (of the config and the command line) are sent with the job.
+    """
+    import urllib.error
+
+    from .server import Job, read_token, submit_job
+
+    if ctx.find_root().get_parameter_source("config") != click.core.ParameterSource.DEFAULT:
+        print(
+            "Warning: the server converts with its own configuration: only the include and exclude globs of --config are used",
+            file=sys.stderr,
+        )
+    job = Job(
+        path=os.path.abspath(path),
+        output=os.path.abspath(ctx.obj["output"]),
+        directory=directory,
+        force=ctx.obj["force"],
+        resume=ctx.obj["resume"],
+        model=ctx.obj["model"],
+        pages=pages,
+        include=include or [],
+        exclude=exclude or [],
+    )
+    try:
+        token = ctx.obj["server_token"] or read_token(DEFAULT_TOKEN_FILE)
+        job = submit_job(ctx.obj["server"], job, token=token)
+    except (urllib.error.URLError, OSError) as e:
+        print(f"Could not reach sn2md server at {ctx.obj['server']}: {e}")
+        sys.exit(1)
+
+    if job.status == "failed":
+        print(job.error)
+        sys.exit(1)
+    if job.output_file:
+        print(job.output_file)
+
+
 @cli.command(name="file", help="""
 Convert a file to markdown.
 
 Supports Supernote .note and PDF and PNG files.
 """)
 @click.argument("filename", type=click.Path(readable=True, dir_okay=False))
+@pages_option
 @click.pass_context
-def import_supernote_file(ctx, filename: str) -> None:
+def import_supernote_file(ctx, filename: str, pages: list[int] | None) -> None:
     config = ctx.obj["config"]
     output = ctx.obj["output"]
     force = ctx.obj["force"]
+    resume = ctx.obj["resume"]
     progress = ctx.obj["progress"]
     model = ctx.obj["model"]
+    if ctx.obj["server"]:
+        run_server_job(ctx, filename, False, pages)
+        return
+
     try:
-        if filename.lower().endswith(".note"):
-            import_supernote_file_core(NotebookExtractor(), filename, output, config, force, progress, model)
-        elif filename.lower().endswith(".pdf"):
-            import_supernote_file_core(PDFExtractor(), filename, output, config, force, progress, model)
-        elif filename.lower().endswith(".png"):
-            import_supernote_file_core(PNGExtractor(), filename, output, config, force, progress, model)
-        else:
+        image_extractor = get_extractor(filename, config)
+        if image_extractor is None:
             print("Unsupported file format")
             sys.exit(1)
+        import_supernote_file_core(image_extractor, filename, output, config, force, progress, model, resume=resume, pages=pages)
+    except TimeoutError as e:
+        print(f"Stopped converting {filename} ({e}): the converted pages are kept for the next run")
+        sys.exit(1)
     except ValueError as e:
         print(e)
         sys.exit(1)
@@ -120,17 +228,97 @@ def import_supernote_file(ctx, filename: str) -> None:
 @cli.command(name="directory", help="""
 Convert a directory of files to markdown (unsupported file types are ignored).
 
-Equivalent to running `sn2md file` on each file in the directory.
+Equivalent to running `sn2md file` on each file in the directory. DIRECTORY
+can also be a zip or tar archive (e.g. a backup): its files are read from the
+archive without extracting it.
 """)
-@click.argument("directory", type=click.Path(readable=True, file_okay=False))
+@click.argument("directory", type=click.Path(readable=True))
+@pages_option
+@click.option(
+    "--queue",
+    "queue_path",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Share the conversion with other workers (on this or other hosts) through a queue database at this path.",
+)
+@click.option(
+    "--include",
+    "-i",
+    multiple=True,
+    help="Only convert files that match this glob (e.g. '*.note' or 'journal/*'). Can be repeated.",
+)
+@click.option(
+    "--exclude",
+    "-x",
+    multiple=True,
+    help="Leave out files and directories that match this glob (e.g. '.git/' or 'archive/'). Can be repeated.",
+)
 @click.pass_context
-def import_supernote_directory(ctx, directory: str) -> None:
+def import_supernote_directory(
+    ctx,
+    directory: str,
+    pages: list[int] | None,
+    queue_path: str | None,
+    include: tuple[str, ...],
+    exclude: tuple[str, ...],
+) -> None:
     config = ctx.obj["config"]
+    if include or exclude:
+        config = dataclasses.replace(
+            config,
+            include=config.include + list(include),
+            exclude=config.exclude + list(exclude),
+        )
     output = ctx.obj["output"]
     force = ctx.obj["force"]
+    resume = ctx.obj["resume"]
     progress = ctx.obj["progress"]
     model = ctx.obj["model"]
-    import_supernote_directory_core(directory, output, config, force, progress, model)
+    if ctx.obj["server"]:
+        run_server_job(ctx, directory, True, pages, config.include, config.exclude)
+        return
+
+    if not os.path.isdir(directory) and not is_archive(directory):
+        raise click.BadParameter(
+            f"{directory} is not a directory or a zip or tar archive", param_hint="DIRECTORY"
+        )
+
+    if queue_path:
+        if is_archive(directory):
+            raise click.BadParameter("can't be used with an archive", param_hint="--queue")
+
+        from .workqueue import WorkQueue
+
+        queue = WorkQueue(queue_path)
+        import_supernote_queue_core(directory, output, config, queue, force, progress, model, resume=resume, pages=pages)
+        return
+
+    import_supernote_directory_core(directory, output, config, force, progress, model, resume=resume, pages=pages)
+
+
+@cli.command(name="serve", help="""
+Run a conversion server, that keeps models loaded between conversions.
+
+Submit conversions to it with `sn2md --server URL file|directory ...`.
+""")
+@click.option("--host", default=DEFAULT_HOST, help=f"Address to listen on (default: {DEFAULT_HOST})")
+@click.option("--port", default=DEFAULT_PORT, type=int, help=f"Port to listen on (default: {DEFAULT_PORT})")
+@click.option("--workers", "-w", default=4, type=click.IntRange(min=1), help="Number of conversions to run at once (default: 4)")
+@click.option("--token-file", default=DEFAULT_TOKEN_FILE, help=f"File to write the token clients must send to (default: {DEFAULT_TOKEN_FILE})")
+@click.pass_context
+def serve(ctx, host: str, port: int, workers: int, token_file: str) -> None:
+    from .server import ConversionServer, ConversionService, write_token
+
+    service = ConversionService(ctx.obj["config"], workers)
+    server = ConversionServer(service, host, port, write_token(token_file))
+    print(f"sn2md server listening on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
 
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,174 @@
+import json
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import Any
+
+from sn2md.metadata import compute_hash
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    source TEXT PRIMARY KEY,
+    source_hash TEXT NOT NULL,
+    output_file TEXT NOT NULL,
+    model TEXT NOT NULL,
+    converted_at TEXT NOT NULL,
+    markdown TEXT NOT NULL,
+    -- JSON lists, as in the context of output templates.
+    keywords TEXT NOT NULL,
+    titles TEXT NOT NULL,
+    links TEXT NOT NULL,
+    images TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    source TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    markdown TEXT NOT NULL,
+    model TEXT,
+    image TEXT,
+    image_hash TEXT,
+    PRIMARY KEY (source, page)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(
+    source UNINDEXED, page UNINDEXED, markdown
+);
+"""
+
+
+def _json(value) -> str:
+    # The device paths of notebook links are bytes.
+    return json.dumps(
+        value,
+        ensure_ascii=False,
+        default=lambda o: o.decode("utf-8", "replace") if isinstance(o, bytes) else str(o),
+    )
+
+
+def build_records(
+    source: str,
+    source_hash: str,
+    output_file: str,
+    model: str,
+    context: dict[str, Any],
+    pages: dict[int, str],
+    page_models: dict[int, str],
+) -> tuple[dict[str, Any], list[dict[str, Any]]]:
+    """The corpus records of a converted file: one for the file (with the
+    context of its output template), and one for each (zero based) page.
+
+    Images are referenced by their path in the output directory, and hash.
+    """
+    output_path = os.path.dirname(output_file)
+    images = []
+    for image in context["images"]:
+        path = os.path.join(output_path, image["name"])
+        images.append(
+            {
+                "name": image["name"],
+                "path": path,
+                "hash": image.get("hash") or (compute_hash(path) if os.path.exists(path) else None),
+            }
+        )
+
+    file_record = {
+        "type": "file",
+        "source": source,
+        "source_hash": source_hash,
+        "output_file": output_file,
+        "model": model,
+        "converted_at": datetime.now(timezone.utc).isoformat(),
+        "markdown": context["llm_output"],
+        "keywords": context["keywords"],
+        "titles": context["titles"],
+        "links": context["links"],
+        "images": images,
+    }
+    # Page images are in page order, when every page has one:
+    page_images = images if len(images) == len(pages) else [None] * len(pages)
+    page_records = [
+        {
+            "type": "page",
+            "source": source,
+            "source_hash": source_hash,
+            "page": number,
+            "markdown": pages[number],
+            # Pages resumed from the journal were converted by an earlier run.
+            "model": page_models.get(number),
+            "image": image["path"] if image else None,
+            "image_hash": image["hash"] if image else None,
+        }
+        for number, image in zip(sorted(pages), page_images)
+    ]
+    return file_record, page_records
+
+
+def _append_jsonl(path: str, records: list[dict[str, Any]]) -> None:
+    # One write, so the records of concurrent workers don't interleave.
+    with open(path, "a", encoding="utf-8") as f:
+        _ = f.write("".join(_json(record) + "\n" for record in records))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _write_sqlite(path: str, file_record: dict[str, Any], page_records: list[dict[str, Any]]) -> None:
+    source = file_record["source"]
+    with closing(sqlite3.connect(path, timeout=60, isolation_level=None)) as db:
+        db.executescript(SCHEMA)
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for table in ("files", "pages", "pages_fts"):
+                db.execute(f"DELETE FROM {table} WHERE source = ?", (source,))
+            db.execute(
+                "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    source,
+                    file_record["source_hash"],
+                    file_record["output_file"],
+                    file_record["model"],
+                    file_record["converted_at"],
+                    file_record["markdown"],
+                    _json(file_record["keywords"]),
+                    _json(file_record["titles"]),
+                    _json(file_record["links"]),
+                    _json(file_record["images"]),
+                ),
+            )
+            db.executemany(
+                "INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        source,
+                        record["page"],
+                        record["markdown"],
+                        record["model"],
+                        record["image"],
+                        record["image_hash"],
+                    )
+                    for record in page_records
+                ],
+            )
+            db.executemany(
+                "INSERT INTO pages_fts VALUES (?, ?, ?)",
+                [(source, record["page"], record["markdown"]) for record in page_records],
+            )
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+
+def add_to_corpus(path: str, file_record: dict[str, Any], page_records: list[dict[str, Any]]) -> None:
+    """Add the records of a converted file to a corpus: a JSONL file (`.jsonl`)
+    or a SQLite database (any other extension).
+
+    JSONL records are appended: the latest records of a source replace the
+    earlier ones. In SQLite, the records of a source are replaced in one
+    transaction, and page markdown is indexed for full-text search
+    (`pages_fts`).
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if path.lower().endswith(".jsonl"):
+        _append_jsonl(path, [file_record, *page_records])
+    else:
+        _write_sqlite(path, file_record, page_records)
@@ -0,0 +1,120 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Iterable, TypeVar
+
+A = TypeVar("A")
+T = TypeVar("T")
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Deadline:
+    """A time by which work has to be done (or None: no deadline).
+
+    A deadline of `seconds` from now is capped by its `parent`'s: a file's
+    deadline doesn't extend past the deadline of the run it is part of.
+    Deadlines are cooperative: work checks them between steps, and bounds the
+    time it waits for requests by them.
+
+    A deadline also passes as soon as its `cancel` event (or its parent's) is
+    set: e.g. when a worker loses the file it is converting to another worker.
+    """
+
+    def __init__(
+        self,
+        seconds: float | None = None,
+        parent: "Deadline | None" = None,
+        cancel: threading.Event | None = None,
+    ):
+        expires = None if seconds is None else time.monotonic() + seconds
+        if parent is not None and parent.expires is not None:
+            expires = parent.expires if expires is None else min(expires, parent.expires)
+        self.expires = expires
+        if cancel is None and parent is not None:
+            cancel = parent.cancel
+        self.cancel = cancel
+
+    def cancelled(self) -> bool:
+        return self.cancel is not None and self.cancel.is_set()
+
+    def remaining(self) -> float | None:
+        """The seconds left before the deadline."""
+        if self.cancelled():
+            return 0.0
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() == 0.0
+
+    def check(self) -> None:
+        """Raise DeadlineExceeded if the deadline has passed."""
+        if self.expired():
+            raise DeadlineExceeded("Cancelled" if self.cancelled() else "Deadline exceeded")
+
+    def timeout(self, timeout: float | None) -> float | None:
+        """The time to wait for something that should take at most `timeout`
+        seconds, without passing the deadline."""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        return remaining if timeout is None else min(timeout, remaining)
+
+
+def submit_daemon(fn: Callable[..., T], *args) -> "Future[T]":
+    """Call `fn` in a daemon thread, returning the future of its result.
+
+    Work that is abandoned (e.g. a request that timed out) must not keep the
+    process from exiting: the threads of a ThreadPoolExecutor are joined at
+    exit, daemon threads aren't.
+    """
+    future: Future[T] = Future()
+
+    def run() -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def daemon_map(fn: Callable[[A], T], items: Iterable[A], workers: int) -> list[T]:
+    """Call `fn` on each item, in up to `workers` daemon threads (see
+    `submit_daemon`), returning the results in order.
+
+    The first exception is raised: items that haven't started by then aren't
+    started, and the running ones are abandoned.
+    """
+    items = list(items)
+    futures: list[Future[T]] = [Future() for _ in items]
+    next_index = iter(range(len(items)))
+    lock = threading.Lock()
+    failed = threading.Event()
+
+    def work() -> None:
+        while not failed.is_set():
+            with lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            try:
+                futures[i].set_result(fn(items[i]))
+            except BaseException as e:
+                futures[i].set_exception(e)
+                failed.set()
+
+    for _ in range(min(workers, len(items))):
+        threading.Thread(target=work, daemon=True).start()
+    # Items are started in order, so an item that never starts comes after one
+    # that failed:
+    return [future.result() for future in futures]
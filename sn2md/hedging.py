@@ -0,0 +1,144 @@
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Callable, TypeVar
+
+from sn2md.deadlines import Deadline, submit_daemon
+
+logger = logging.getLogger(__name__)
+
+# The number of recent request latencies (of each kind of request) the hedge
+# delay is computed from.
+LATENCY_WINDOW = 100
+
+# The kind of request a latency is recorded for when none is given.
+DEFAULT_KIND = "page"
+
+# Until this many latencies are known, requests are hedged after
+# INITIAL_HEDGE_DELAY seconds.
+MIN_LATENCY_SAMPLES = 5
+INITIAL_HEDGE_DELAY = 30.0
+
+# A request: called with a model and an event that is set when the request is
+# cancelled (its result is no longer needed), it returns the response.
+T = TypeVar("T")
+Request = Callable[[str, threading.Event], T]
+
+
+class RequestPolicy:
+    """Hedging and failover for LLM requests.
+
+    With `hedge_percentile`, a request that takes longer than that percentile
+    of recent request latencies (but at least `min_hedge_delay` seconds) is
+    sent again, to the first of `hedge_models` (or the same model). The first
+    response is used, and the other request is cancelled. Latencies are kept
+    for each kind of request (e.g. a page, a band of a page or a title), so
+    short requests aren't hedged late, nor long ones early.
+
+    When a request fails (e.g. the provider is down), it is sent to each of
+    the `fallback_models` in turn.
+    """
+
+    def __init__(
+        self,
+        hedge_percentile: float | None = None,
+        hedge_models: list[str] | None = None,
+        fallback_models: list[str] | None = None,
+        min_hedge_delay: float = 1.0,
+    ):
+        self.hedge_percentile = hedge_percentile
+        self.hedge_models = hedge_models or []
+        self.fallback_models = fallback_models or []
+        self.min_hedge_delay = min_hedge_delay
+        self.latencies: defaultdict[str, deque[float]] = defaultdict(
+            lambda: deque(maxlen=LATENCY_WINDOW)
+        )
+        self.lock = threading.Lock()
+
+    def hedge_delay(self, kind: str = DEFAULT_KIND) -> float | None:
+        """How long to wait for a response to a `kind` of request before
+        hedging (None: don't hedge)."""
+        if self.hedge_percentile is None:
+            return None
+        with self.lock:
+            latencies = sorted(self.latencies[kind])
+        if len(latencies) < MIN_LATENCY_SAMPLES:
+            return max(INITIAL_HEDGE_DELAY, self.min_hedge_delay)
+        index = min(len(latencies) - 1, int(len(latencies) * self.hedge_percentile / 100))
+        return max(latencies[index], self.min_hedge_delay)
+
+    def _timed(
+        self, request: Request[T], model: str, cancel: threading.Event, kind: str
+    ) -> T:
+        start = time.monotonic()
+        response = request(model, cancel)
+        if not cancel.is_set():
+            with self.lock:
+                self.latencies[kind].append(time.monotonic() - start)
+        return response
+
+    def _hedged(
+        self, request: Request[T], model: str, timeout: float | None, kind: str
+    ) -> T:
+        delay = self.hedge_delay(kind)
+        cancel = threading.Event()
+        if delay is None and timeout is None:
+            return self._timed(request, model, cancel, kind)
+
+        start = time.monotonic()
+        try:
+            pending = {submit_daemon(self._timed, request, model, cancel, kind)}
+            if delay is not None and (timeout is None or delay < timeout):
+                done, _ = wait(pending, timeout=delay)
+                if not done:
+                    hedge_model = self.hedge_models[0] if self.hedge_models else model
+                    logger.info(
+                        "No response from %s after %.1fs, hedging with %s", model, delay, hedge_model
+                    )
+                    pending.add(submit_daemon(self._timed, request, hedge_model, cancel, kind))
+
+            error: BaseException | None = None
+            while pending:
+                remaining = None if timeout is None else timeout - (time.monotonic() - start)
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                if not done:
+                    raise TimeoutError(f"No response from {model} after {timeout:.1f}s")
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+                    error = future.exception()
+            assert error is not None
+            raise error
+        finally:
+            # Stop the request that lost (or timed out), without waiting for it:
+            cancel.set()
+
+    def run(
+        self,
+        request: Request[T],
+        model: str,
+        timeout: float | None = None,
+        deadline: Deadline | None = None,
+        kind: str = DEFAULT_KIND,
+    ) -> T:
+        """Run a `kind` of request with `model`, hedging it and failing over
+        to the fallback models, returning the first response.
+
+        Requests that take longer than `timeout` seconds, or go past the
+        `deadline`, are abandoned with a TimeoutError (and fail over, like
+        failed requests, while the deadline allows).
+        """
+        deadline = deadline if deadline is not None else Deadline()
+        models = [model, *self.fallback_models]
+        for request_model, next_model in zip(models, models[1:]):
+            deadline.check()
+            try:
+                return self._hedged(request, request_model, deadline.timeout(timeout), kind)
+            except Exception as e:
+                logger.warning(
+                    "Request to %s failed (%s), failing over to %s", request_model, e, next_model
+                )
+        deadline.check()
+        return self._hedged(request, models[-1], deadline.timeout(timeout), kind)
@@ -0,0 +1,60 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image as PILImage
+from PIL.Image import Image
+
+# Pixels darker than this (0-255 grayscale) are considered ink: anything
+# clearly off-white, so that the gray pens of the Supernote (0x9D and 0xC9)
+# count as ink.
+INK_THRESHOLD = 0xF0
+
+
+def ink_mask(image: Image) -> np.ndarray:
+    """Return a boolean array that is True for the inked pixels of an image."""
+    if "A" in image.getbands():
+        # Transparent pixels are blank paper, not ink:
+        background = PILImage.new("RGBA", image.size, "white")
+        image = PILImage.alpha_composite(background, image.convert("RGBA"))
+    return np.asarray(image.convert("L")) < INK_THRESHOLD
+
+
+def ink_percent(image: Image) -> float:
+    """Return the percent of an image covered in ink."""
+    return float(ink_mask(image).mean()) * 100
+
+
+def ink_bbox(image: Image) -> tuple[int, int, int, int] | None:
+    """Return the (left, upper, right, lower) box around all the ink in an
+    image, or None for a blank image."""
+    mask = ink_mask(image)
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def crop_to_content(image: Image, padding: int) -> Image:
+    """Crop the blank margins of an image, keeping `padding` pixels around its content."""
+    bbox = ink_bbox(image)
+    if bbox is None:
+        return image
+
+    left, upper, right, lower = bbox
+    width, height = image.size
+    return image.crop(
+        (
+            max(0, left - padding),
+            max(0, upper - padding),
+            min(width, right + padding),
+            min(height, lower + padding),
+        )
+    )
+
+
+def png_bytes(image: Image) -> bytes:
+    """Encode an image as PNG, in memory."""
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
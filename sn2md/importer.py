@@ -1,5 +1,5 @@
 import base64
-from typing import Generator
+from typing import TYPE_CHECKING, Any, Callable, Generator, Iterable, Mapping, Sized, TextIO
 import uuid
 import shutil
 import logging
@@ -7,71 +7,374 @@ import os
 from contextlib import contextmanager
 from datetime import datetime
 
-from jinja2 import Template
-from supernotelib import Notebook
-from supernotelib.exceptions import DecoderException
-
-from sn2md.ai_utils import image_to_markdown, image_to_text
-from sn2md.importers.pdf import PDFExtractor
-from sn2md.importers.png import PNGExtractor
+from sn2md.archives import ArchiveMember, MemberExtractor, is_archive, iter_members
+from sn2md.assets import asset_path, link_file, move_file, store_asset
+from sn2md.deadlines import Deadline, daemon_map
 from sn2md.types import Config, ImageExtractor
-from sn2md.importers.note import NotebookExtractor, convert_binary_to_image
-from sn2md.metadata import check_metadata_file, write_metadata_file
-
-from tqdm import tqdm
+from sn2md.importers.registry import get_extractor
+from sn2md.journal import JOURNAL_FILE, PageJournal
+from sn2md.metadata import check_metadata_file, compute_hash, write_metadata_file
+from sn2md.scheduler import SourceFile, order_files, scan_directory
+from sn2md.stats import RunStats
+from sn2md.templates import get_templates
+
+# The LLM (llm and its plugins), progress bar, and .note (supernotelib)
+# libraries are imported where they are used, so that runs that skip every
+# file start quickly.
+if TYPE_CHECKING:
+    from supernotelib import Notebook
+
+    from sn2md.hedging import RequestPolicy
+    from sn2md.workqueue import WorkQueue
 
 logger = logging.getLogger(__name__)
 
+# The number of titles that are decoded and transcribed at the same time.
+TITLE_WORKERS = 4
+
 
 @contextmanager
 def generate_images(
-    image_extractor: ImageExtractor, file_name: str, output: str
+    image_extractor: ImageExtractor,
+    file_name: str,
+    output: str,
+    pages: list[int] | None = None,
 ) -> Generator[list[str], None, None]:
-    image_output_path = os.path.join(output, uuid.uuid4().hex)
+    """Render the pages of a file in a temporary directory of `output`.
+
+    Extractors name page images after the directory they are rendered in, so
+    the images are rendered in a directory named after the file: page images
+    keep the same names from run to run (and the journal can refer to them).
+    """
+    temporary_path = os.path.join(output, uuid.uuid4().hex)
+    file_basename = os.path.splitext(os.path.basename(file_name))[0]
+    image_output_path = os.path.join(temporary_path, file_basename)
     os.makedirs(image_output_path, exist_ok=True)
 
     logger.debug("Storing images in %s", image_output_path)
 
     try:
-        yield image_extractor.extract_images(file_name, image_output_path)
+        yield image_extractor.extract_images(file_name, image_output_path, pages)
     finally:
-        shutil.rmtree(image_output_path)
-
-
-def process_pages(pngs: list[str], config: Config, model: str, progress: bool) -> str:
-    page_list = tqdm(pngs, desc="Processing pages", unit="page") if progress else pngs
-    template_output = ""
-    for i, page in enumerate(page_list):
-        context = ""
-        if i > 0 and len(template_output) > 0:
-            # include the last 50 characters...for continuity of the transcription:
-            context = template_output[-50:]
-        template_output = (
-            template_output
-            + "\n"
-            + image_to_markdown(
-                page,
+        shutil.rmtree(temporary_path)
+
+
+def _page_context(markdown_pages: dict[int, str], page_number: int) -> str:
+    # include the last 50 characters...for continuity of the transcription:
+    context = ""
+    for number in sorted(markdown_pages, reverse=True):
+        if len(context) >= 50:
+            break
+        if number < page_number:
+            context = "\n" + markdown_pages[number] + context
+    return context[-50:]
+
+
+def process_pages(
+    pngs: list[str],
+    config: Config,
+    model: str,
+    progress: bool,
+    journal: PageJournal | None = None,
+    page_numbers: list[int] | None = None,
+    stream: TextIO | None = None,
+    stats: RunStats | None = None,
+    deadline: Deadline | None = None,
+    ink_pngs: list[str] | None = None,
+) -> str:
+    """Transcribe page images, returning the markdown of the whole document.
+
+    `page_numbers` are the page numbers of `pngs` when only some pages of the
+    document were rendered: those pages are converted again, and the markdown
+    of the other pages is taken from the journal. Otherwise pages already in
+    the journal are not converted again (the conversion is resumed).
+
+    `ink_pngs` are the images of `pngs` that ink is measured on. See
+    `convert_pages` for `stream`, `stats` and `deadline`.
+    """
+    if page_numbers is None:
+        page_numbers = list(range(len(pngs)))
+        markdown_pages = journal.pages() if journal else {}
+        if markdown_pages:
+            logger.info(
+                "Resuming: %d of %d pages already converted",
+                len(markdown_pages),
+                len(pngs),
+            )
+    else:
+        markdown_pages = {
+            number: markdown
+            for number, markdown in (journal.pages(any_source=True) if journal else {}).items()
+            if number not in page_numbers
+        }
+
+    pending = [
+        (number, page)
+        for number, page in zip(page_numbers, pngs)
+        if number not in markdown_pages
+    ]
+    ink_pages = dict(zip(page_numbers, ink_pngs)) if ink_pngs is not None else None
+    for _ in convert_pages(
+        pending,
+        markdown_pages,
+        config,
+        model,
+        progress,
+        journal,
+        stream,
+        stats,
+        deadline,
+        ink_pages,
+    ):
+        pass
+
+    return "".join("\n" + markdown_pages[number] for number in sorted(markdown_pages))
+
+
+def convert_pages(
+    pages: Iterable[tuple[int, str | bytes]],
+    markdown_pages: dict[int, str],
+    config: Config,
+    model: str,
+    progress: bool = False,
+    journal: PageJournal | None = None,
+    stream: TextIO | None = None,
+    stats: RunStats | None = None,
+    deadline: Deadline | None = None,
+    ink_pages: Mapping[int, str | bytes] | None = None,
+) -> Generator[tuple[int, str], None, None]:
+    """Transcribe (page number, image) pages, yielding the number and markdown
+    of each page as it completes. Images are paths, or PNGs held in memory.
+    Pages can be an iterator: they are taken from it as they are converted.
+
+    `markdown_pages` holds the markdown of the pages that are already converted
+    (the context of the following pages): the markdown of each converted page
+    is added to it, and recorded in the journal.
+
+    With `stream`, LLM responses are streamed (the progress bar counts their
+    chunks), and the markdown of each page is written to it once its final
+    attempt completes.
+
+    Pages whose markdown looks wrong are converted again with the next of the
+    `escalation_models`. The model used for each page, and the token usage of
+    the requests, are recorded in `stats`. The ink of a page (to escalate it,
+    or split a dense page into bands) is measured on its image in `ink_pages`,
+    by page number, when it has one: the page without its background.
+
+    Each request is given up after `request_timeout` seconds, and no request
+    is made past the `deadline` (both raise a TimeoutError): the pages that
+    were completed are already in the journal.
+    """
+    from tqdm import tqdm
+
+    from sn2md.ai_utils import bands_to_markdown, image_to_markdown, images_to_markdown
+    from sn2md.cascade import escalation_reason
+    from sn2md.tiles import is_dense
+
+    stats = stats if stats is not None else RunStats()
+    policy = request_policy(config)
+    progress_bar = (
+        tqdm(
+            total=len(pages) if isinstance(pages, Sized) else None,
+            desc="Processing pages",
+            unit="page",
+        )
+        if progress
+        else None
+    )
+
+    on_chunk: Callable[[str], None] | None = None
+    if stream is not None:
+        streamed_chunks = 0
+        stream.write("".join("\n" + markdown_pages[n] for n in sorted(markdown_pages)))
+        stream.flush()
+
+        def count_chunk(chunk: str) -> None:
+            nonlocal streamed_chunks
+            # Each streamed chunk is (about) one token:
+            streamed_chunks += 1
+            if progress_bar is not None:
+                progress_bar.set_postfix(chunks=streamed_chunks)
+
+        on_chunk = count_chunk
+
+    for batch in _batches(pages, config.pages_per_request):
+        if deadline is not None:
+            deadline.check()
+        context = _page_context(markdown_pages, batch[0][0])
+        markdowns = None
+        if len(batch) > 1:
+            markdowns = images_to_markdown(
+                [page for _, page in batch],
                 context,
                 config.api_key,
                 model,
                 config.prompt,
+                config.crop_padding,
+                on_chunk,
+                policy,
+                system=config.system_prompt,
+                on_usage=stats.add_usage,
+                timeout=config.request_timeout,
+                deadline=deadline,
             )
-        )
-    return template_output
+            if markdowns is None:
+                logger.warning(
+                    "Could not split the response for pages %d-%d, converting them one at a time",
+                    batch[0][0] + 1,
+                    batch[-1][0] + 1,
+                )
+
+        for i, (number, page) in enumerate(batch):
+
+            def convert(page_model: str) -> str:
+                if dense:
+                    return bands_to_markdown(
+                        page,
+                        _page_context(markdown_pages, number),
+                        config.api_key,
+                        page_model,
+                        config.prompt,
+                        config.tile_bands,
+                        config.tile_overlap,
+                        config.crop_padding,
+                        on_chunk,
+                        policy,
+                        system=config.system_prompt,
+                        on_usage=stats.add_usage,
+                        timeout=config.request_timeout,
+                        deadline=deadline,
+                    )
+                return image_to_markdown(
+                    page,
+                    _page_context(markdown_pages, number),
+                    config.api_key,
+                    page_model,
+                    config.prompt,
+                    config.crop_padding,
+                    on_chunk,
+                    policy,
+                    system=config.system_prompt,
+                    on_usage=stats.add_usage,
+                    timeout=config.request_timeout,
+                    deadline=deadline,
+                )
+
+            ink_page = ink_pages.get(number, page) if ink_pages is not None else page
+            # Pages of a multi-page request aren't split into bands.
+            dense = (
+                markdowns is None
+                and config.tile_min_ink is not None
+                and config.tile_bands > 1
+                and is_dense(ink_page, config.tile_min_ink)
+            )
+            if dense:
+                stats.tiled_pages += 1
+
+            page_model = model
+            markdown = markdowns[i] if markdowns is not None else convert(model)
+            for next_model in config.escalation_models:
+                reason = escalation_reason(markdown, ink_page, config.min_text_per_ink)
+                if reason is None:
+                    break
+                logger.info(
+                    "Page %d (%s): converting again with %s", number + 1, reason, next_model
+                )
+                stats.escalations[reason] += 1
+                page_model = next_model
+                markdown = convert(next_model)
+            stats.page_models[number] = page_model
+
+            markdown_pages[number] = markdown
+            if journal:
+                # Pages converted from memory have no image file:
+                journal.record(number, markdown, os.path.basename(page) if isinstance(page, str) else None)
+            if stream is not None:
+                stream.write("\n" + markdown)
+                stream.flush()
+            if progress_bar is not None:
+                progress_bar.update()
+            yield number, markdown
+
+    if progress_bar is not None:
+        progress_bar.close()
+
+
+def request_policy(config: Config) -> "RequestPolicy | None":
+    """The hedging/failover policy of LLM requests, or None when neither is enabled."""
+    if config.hedge_percentile is None and not config.fallback_models:
+        return None
+
+    from sn2md.ai_utils import get_policy
+
+    return get_policy(
+        config.hedge_percentile, tuple(config.hedge_models), tuple(config.fallback_models)
+    )
+
+
+def _batches(
+    pages: Iterable[tuple[int, str | bytes]], size: int
+) -> Generator[list[tuple[int, str | bytes]], None, None]:
+    """Group (number, image) pages into runs of at most `size` consecutive pages."""
+    batch: list[tuple[int, str | bytes]] = []
+    for number, page in pages:
+        if batch and number != batch[-1][0] + 1:
+            yield batch
+            batch = []
+        batch.append((number, page))
+        # A full batch is yielded before the next page is taken (and rendered):
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def merge_page_images(
+    pngs: list[str], page_numbers: list[int], journal: PageJournal, output_path: str
+) -> list[str]:
+    """Combine newly rendered page images with the images of the other pages
+    that are already in the output directory."""
+    images = {
+        number: os.path.join(output_path, image)
+        for number, image in journal.images(any_source=True).items()
+        if os.path.exists(os.path.join(output_path, image))
+    }
+    images.update(zip(page_numbers, pngs))
+    return [images[number] for number in sorted(images)]
 
 
-def create_basic_context(file_basename: str, file_name: str) -> dict:
+def remove_superseded_images(
+    images: list[str], journal: PageJournal, output_path: str
+) -> None:
+    """Remove the images of earlier conversions recorded in the journal that
+    the output no longer refers to."""
+    names = {os.path.basename(image) for image in images}
+    for image in journal.recorded_images() - names:
+        path = os.path.join(output_path, image)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def create_basic_context(
+    file_basename: str, file_name: str, member: ArchiveMember | None = None
+) -> dict:
+    if member is not None:
+        # Archive members only have a modification time.
+        ctime = mtime = member.mtime_ns / 1_000_000_000
+    else:
+        ctime, mtime = os.path.getctime(file_name), os.path.getmtime(file_name)
     return {
         "file_basename": file_basename,
         "file_name": file_name,
-        "ctime": datetime.fromtimestamp(os.path.getctime(file_name)),
-        "mtime": datetime.fromtimestamp(os.path.getmtime(file_name)),
-        "year_month_day": datetime.fromtimestamp(os.path.getctime(file_name)).strftime(
-            "%Y-%m-%d"
-        ),
+        "ctime": datetime.fromtimestamp(ctime),
+        "mtime": datetime.fromtimestamp(mtime),
+        "year_month_day": datetime.fromtimestamp(ctime).strftime("%Y-%m-%d"),
     }
 
-def create_notebook_context(notebook: Notebook, config: Config, model: str) -> dict:
+def create_notebook_context(
+    notebook: "Notebook", config: Config, model: str, deadline: Deadline | None = None
+) -> dict:
     # Codes:
     # TODO add a pull request for this feature:
     # https://github.com/jya-dev/supernote-tool/blob/807d5fa4bf524fdb1f9c7f1c67ed66ea96a49db5/supernotelib/fileformat.py#L236
@@ -113,29 +416,48 @@ def create_notebook_context(notebook: Notebook, config: Config, model: str) -> d
             }
             for keyword in (notebook.keywords if notebook else [])
         ],
-        "titles": [
-            {
-                "page_number": title.get_page_number(),
-                "content": image_to_text(
-                    convert_binary_to_image(notebook, title),
-                    config.api_key,
-                    model,
-                    config.title_prompt,
-                ),
-                "level": title.metadata["TITLELEVEL"],
-            }
-            for title in (notebook.titles if notebook else [])
-        ],
+        "titles": create_titles_context(notebook, config, model, deadline) if notebook else [],
     }
 
 
+def create_titles_context(
+    notebook: "Notebook", config: Config, model: str, deadline: Deadline | None = None
+) -> list[dict[str, Any]]:
+    from sn2md.ai_utils import image_to_text
+    from sn2md.importers.note import convert_binary_to_image
+
+    policy = request_policy(config)
+
+    def title_context(title) -> dict[str, Any]:
+        return {
+            "page_number": title.get_page_number(),
+            "content": image_to_text(
+                convert_binary_to_image(notebook, title),
+                config.api_key,
+                model,
+                config.title_prompt,
+                policy,
+                timeout=config.request_timeout,
+                deadline=deadline,
+            ),
+            "level": title.metadata["TITLELEVEL"],
+        }
+
+    # Daemon threads: the other titles aren't waited for (or started) when
+    # one fails, or the run is interrupted.
+    return daemon_map(title_context, notebook.titles, TITLE_WORKERS)
+
+
 def create_context(
-    notebook: Notebook | None,
+    notebook: "Notebook | None",
     pngs: list[str],
     config: Config,
     file_name: str,
     model: str,
     template_output: str,
+    output: str = "",
+    member: ArchiveMember | None = None,
+    deadline: Deadline | None = None,
 ) -> dict:
     file_basename = os.path.splitext(os.path.basename(file_name))[0]
     images = [
@@ -146,19 +468,27 @@ def create_context(
         }
         for png_path in pngs
     ]
+    if config.image_store:
+        for image in images:
+            image["hash"] = compute_hash(image["rel_path"])
+            image["store_path"] = asset_path(
+                os.path.join(output, config.image_store),
+                image["hash"],
+                os.path.splitext(image["name"])[1],
+            )
 
     # TODO add pages - for each page include keywords and titles
     context = {
         "markdown": template_output,
         "llm_output": template_output,
         "images": images,
-        **create_basic_context(file_basename, file_name),
+        **create_basic_context(file_basename, file_name, member),
     }
 
     if notebook:
         return {
             **context,
-            **create_notebook_context(notebook, config, model),
+            **create_notebook_context(notebook, config, model, deadline),
         }
 
     return {
@@ -176,43 +506,118 @@ def generate_output(
     file_name: str,
     output: str,
     template,
-) -> None:
+    member: ArchiveMember | None = None,
+) -> str:
     jinja_markdown = template.render(context)
 
-    output_filename_template = Template(config.output_filename_template)
-    output_filename = output_filename_template.render(context)
-
-    output_path_template = Template(config.output_path_template)
-    output_path = output_path_template.render(context)
+    templates = get_templates(config)
+    output_filename = templates.output_filename.render(context)
+    output_path = templates.output_path.render(context)
     output_path = os.path.join(output, output_path)
     os.makedirs(output_path, exist_ok=True)
 
     output_path_and_file = os.path.join(output_path, output_filename)
-    with open(output_path_and_file, "w") as f:
-        _ = f.write(jinja_markdown)
+    # Write to a temporary file first, so the output is replaced atomically:
+    try:
+        with open(output_path_and_file + ".tmp", "w") as f:
+            _ = f.write(jinja_markdown)
+        os.replace(output_path_and_file + ".tmp", output_path_and_file)
+    except BaseException:
+        if os.path.exists(output_path_and_file + ".tmp"):
+            os.remove(output_path_and_file + ".tmp")
+        raise
     logger.debug("Wrote output to %s", output_path_and_file)
 
-    # copy everything from image_output_path to output_path:
+    # move everything from image_output_path to output_path:
+    hashes = {image["rel_path"]: image.get("hash") for image in context.get("images", [])}
     for png_path in pngs:
-        png_name = os.path.basename(png_path)
-        os.rename(png_path, os.path.join(output_path, png_name))
-
-    write_metadata_file(file_name, output_path_and_file)
+        png_name = os.path.join(output_path, os.path.basename(png_path))
+        if config.image_store:
+            stored = store_asset(
+                png_path, os.path.join(output, config.image_store), hashes.get(png_path)
+            )
+            link_file(stored, png_name)
+        else:
+            move_file(png_path, png_name)
 
     logger.debug("Moved images to %s", output_path)
 
     print(output_path_and_file)
+    return output_path_and_file
 
 
-def verify_metadata_file(config: Config, output: str, file_name: str) -> None:
+def get_output_path(
+    config: Config, output: str, file_name: str, member: ArchiveMember | None = None
+) -> str:
     file_basename = os.path.splitext(os.path.basename(file_name))[0]
-    basic_context = create_basic_context(file_basename, file_name)
+    basic_context = create_basic_context(file_basename, file_name, member)
 
-    output_path_template = Template(config.output_path_template)
-    output_path = output_path_template.render(basic_context)
-    output_path = os.path.join(output, output_path)
+    output_path = get_templates(config).output_path.render(basic_context)
+    return os.path.join(output, output_path)
+
+
+def get_provisional_path(
+    config: Config, output_path: str, file_name: str, member: ArchiveMember | None = None
+) -> str:
+    """The file LLM output is streamed to while a file is being converted."""
+    file_basename = os.path.splitext(os.path.basename(file_name))[0]
+    basic_context = create_basic_context(file_basename, file_name, member)
+
+    output_filename = get_templates(config).output_filename.render(basic_context)
+    root, extension = os.path.splitext(output_filename)
+    return os.path.join(output_path, root + ".partial" + extension)
+
+
+@contextmanager
+def provisional_file(path: str | None) -> Generator[TextIO | None, None, None]:
+    """Open the provisional file that LLM output is streamed to (when `path` is
+    set). It is removed when the conversion ends, whether it completed or not:
+    the converted pages are in the journal."""
+    if path is None:
+        yield None
+        return
+    try:
+        with open(path, "w") as stream:
+            yield stream
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
 
-    check_metadata_file(output_path)
+
+def verify_metadata_file(
+    config: Config,
+    output: str,
+    file_name: str,
+    partial: bool = False,
+    member: ArchiveMember | None = None,
+) -> None:
+    output_path = get_output_path(config, output, file_name, member)
+    # Re-converting selected pages of an unchanged source is expected.
+    check_metadata_file(output_path, allow_unchanged_input=partial, member=member)
+
+
+def open_journal(
+    output_path: str,
+    file_name: str,
+    resume: bool,
+    partial: bool = False,
+    member: ArchiveMember | None = None,
+) -> PageJournal:
+    """Open the page journal for a source file in its output directory.
+
+    Unless resuming, or when the previous run for this source completed, the
+    journal is started afresh. A partial conversion always keeps the journal,
+    as it holds the markdown of the pages that are not converted again.
+    """
+    os.makedirs(output_path, exist_ok=True)
+
+    journal = PageJournal(
+        os.path.join(output_path, JOURNAL_FILE),
+        member.hash if member is not None else compute_hash(file_name),
+    )
+    if not partial and (not resume or journal.is_complete() or not journal.pages()):
+        journal.reset()
+    return journal
 
 
 def import_supernote_file_core(
@@ -223,22 +628,156 @@ def import_supernote_file_core(
     force: bool = False,
     progress: bool = False,
     model: str | None = None,
-) -> None:
-    if not force:
-        verify_metadata_file(config, output, file_name)
+    resume: bool = True,
+    pages: list[int] | None = None,
+    member: ArchiveMember | None = None,
+    deadline: Deadline | None = None,
+    verified: bool = False,
+) -> str:
+    """Convert a file, writing its output (and images) to `output`, and
+    returning the path of the output file.
+
+    `pages` selects the (zero based, sorted) page numbers to convert. The
+    result is merged with the previous conversion of the file, leaving the
+    content and images of the other pages untouched.
+
+    An archive `member` is converted from memory (with a MemberExtractor):
+    `file_name` is its path.
+
+    The output isn't checked (see `needs_conversion`) when the caller has
+    already `verified` that the file needs converting.
+
+    The conversion stops with a TimeoutError when it takes longer than
+    `file_timeout`, or goes past the (run's) `deadline`. The pages that were
+    converted are kept in the journal, for the next run to resume from.
+    """
+    partial = pages is not None
+    file_deadline = Deadline(config.file_timeout, deadline)
+    if not force and not verified:
+        verify_metadata_file(config, output, file_name, partial, member)
 
     model = model if model else config.model
-    template = Template(config.template)
-
-    with generate_images(image_extractor, file_name, output) as pngs:
-        template_output = process_pages(pngs, config, model, progress)
+    template = get_templates(config).output
+    output_path = get_output_path(config, output, file_name, member)
+    journal = open_journal(output_path, file_name, resume, partial, member)
+
+    provisional_path = (
+        get_provisional_path(config, output_path, file_name, member) if config.stream else None
+    )
+    file_deadline.check()
+    with (
+        generate_images(image_extractor, file_name, output, pages) as pngs,
+        provisional_file(provisional_path) as stream,
+    ):
+        file_deadline.check()
+        images = pngs
+        page_numbers = None
+        if pages is not None:
+            # Pages past the end of the document aren't rendered, and pages
+            # are sorted, so the rendered pages are the first of the selection.
+            page_numbers = pages[: len(pngs)]
+            if not journal.pages(any_source=True):
+                logger.warning(
+                    "No previous conversion of %s: the output will only contain the selected pages",
+                    file_name,
+                )
+            images = merge_page_images(pngs, page_numbers, journal, output_path)
+
+        llm_pngs = [image_extractor.get_llm_image(png) for png in pngs]
+        ink_pngs = [image_extractor.get_ink_image(png) for png in pngs]
+        stats = RunStats()
+        template_output = process_pages(
+            llm_pngs,
+            config,
+            model,
+            progress,
+            journal,
+            page_numbers,
+            stream,
+            stats,
+            file_deadline,
+            ink_pngs,
+        )
+        logger.info("Converted %s: %s", file_name, stats.summary())
 
         notebook = image_extractor.get_notebook(file_name)
         context = create_context(
-            notebook, pngs, config, file_name, model, template_output
+            notebook,
+            images,
+            config,
+            file_name,
+            model,
+            template_output,
+            output,
+            member,
+            file_deadline,
+        )
+
+        file_deadline.check()
+        output_file = generate_output(
+            images, config, context, file_name, output, template, member
+        )
+        remove_superseded_images(images, journal, os.path.dirname(output_file))
+
+    if config.corpus:
+        from sn2md.corpus import add_to_corpus, build_records
+
+        add_to_corpus(
+            os.path.join(output, config.corpus),
+            *build_records(
+                file_name,
+                journal.source_hash,
+                output_file,
+                model,
+                context,
+                journal.pages(any_source=partial),
+                stats.page_models,
+            ),
         )
 
-        generate_output(pngs, config, context, file_name, output, template)
+    # The metadata file marks the source as converted, so it is written last: a
+    # conversion that fails before then (e.g. adding to the corpus) is retried.
+    write_metadata_file(file_name, output_file, member)
+    journal.complete()
+    return output_file
+
+
+def needs_conversion(
+    config: Config,
+    output: str,
+    file_name: str,
+    partial: bool = False,
+    member: ArchiveMember | None = None,
+) -> bool:
+    try:
+        verify_metadata_file(config, output, file_name, partial, member)
+    except ValueError as e:
+        logger.debug(f"Skipping {file_name}: {e}")
+        return False
+    return True
+
+
+def schedule_files(
+    directory: str,
+    output: str,
+    config: Config | None,
+    force: bool = False,
+    partial: bool = False,
+) -> list[SourceFile]:
+    """Find the files of a directory that need converting, in the order they
+    should be converted (see `directory_order` and `priority`).
+
+    The output directory is not scanned, when it is within `directory`.
+    """
+    config = config if config else Config()
+    files = [
+        file
+        for file in scan_directory(
+            directory, config.include, config.exclude, skip_dirs=[output]
+        )
+        if force or needs_conversion(config, output, file.path, partial)
+    ]
+    return order_files(files, config.directory_order, config.priority)
 
 
 def import_supernote_directory_core(
@@ -248,32 +787,196 @@ def import_supernote_directory_core(
     force: bool = False,
     progress: bool = False,
     model: str | None = None,
+    resume: bool = True,
+    pages: list[int] | None = None,
 ) -> None:
-    for root, _, files in os.walk(directory):
-        file_list = (
-            tqdm(files, desc="Processing files", unit="file") if progress else files
+    """Convert the files of a directory, or of a zip or tar archive (see
+    `import_supernote_archive_core`)."""
+    if is_archive(directory):
+        import_supernote_archive_core(
+            directory, output, config, force, progress, model, resume, pages
+        )
+        return
+
+    from tqdm import tqdm
+
+    files = [
+        file.path
+        for file in schedule_files(directory, output, config, force, pages is not None)
+    ]
+    file_list = (
+        tqdm(files, desc="Processing files", unit="file") if progress else files
+    )
+    run_deadline = Deadline(config.run_timeout if config else None)
+    for i, filename in enumerate(file_list):
+        if run_deadline.expired():
+            _log_run_timeout(len(files) - i)
+            break
+        logger.debug(f"Processing file {filename}") # handy to see file name when things go wrong
+        image_extractor = get_extractor(filename, config)
+        # Only files of supported types are scheduled:
+        assert image_extractor is not None
+        try:
+            import_supernote_file_core(
+                image_extractor,
+                filename,
+                output,
+                config,
+                force,
+                progress,
+                model,
+                resume=resume,
+                pages=pages,
+                deadline=run_deadline,
+                verified=True,
+            )
+        except TimeoutError as e:
+            _log_file_timeout(filename, e)
+        except (ValueError, *image_extractor.errors) as e:
+            logger.debug(f"Skipping {filename}: {e}")
+
+
+def _log_file_timeout(filename: str, e: TimeoutError) -> None:
+    logger.warning(
+        "Stopped converting %s (%s): the converted pages are kept for the next run",
+        filename,
+        e,
+    )
+
+
+def _log_run_timeout(remaining: int | None = None) -> None:
+    if remaining is None:
+        logger.warning("Run timeout reached: the remaining files are left for the next run")
+    else:
+        logger.warning(
+            "Run timeout reached: %d files are left for the next run", remaining
         )
-        for file in file_list:
-            filename = os.path.join(root, file)
-            logger.debug(f"Processing file {filename}") # handy to see file name when things go wrong
+
+
+def import_supernote_archive_core(
+    archive: str,
+    output: str,
+    config: Config,
+    force: bool = False,
+    progress: bool = False,
+    model: str | None = None,
+    resume: bool = True,
+    pages: list[int] | None = None,
+) -> None:
+    """Convert the files of a zip or tar archive, reading each one from the
+    archive into memory rather than extracting the archive.
+
+    Files are converted in the order they are stored in (`directory_order`
+    and `priority` don't apply: compressed tar archives can only be read in
+    order). The metadata of each file is keyed by its `ArchiveMember.path`, so
+    files that haven't changed in a new version of the archive are skipped.
+    """
+    from tqdm import tqdm
+
+    config = config if config else Config()
+    partial = pages is not None
+    members = iter_members(archive, config.include, config.exclude)
+    run_deadline = Deadline(config.run_timeout)
+    for member in tqdm(members, desc="Processing files", unit="file") if progress else members:
+        if run_deadline.expired():
+            # Archives are read in order: the number of files left isn't known.
+            _log_run_timeout()
+            break
+        if not force and not needs_conversion(config, output, member.path, partial, member):
+            continue
+        logger.debug(f"Processing file {member.path}")
+        member_extractor = get_extractor(member.name, config)
+        # Only members of supported types are read:
+        assert member_extractor is not None
+        image_extractor = MemberExtractor(member_extractor, member)
+        try:
+            import_supernote_file_core(
+                image_extractor,
+                member.path,
+                output,
+                config,
+                force,
+                progress,
+                model,
+                resume=resume,
+                pages=pages,
+                member=member,
+                deadline=run_deadline,
+                verified=True,
+            )
+        except TimeoutError as e:
+            _log_file_timeout(member.path, e)
+        except (ValueError, *image_extractor.errors) as e:
+            logger.debug(f"Skipping {member.path}: {e}")
+
+
+def import_supernote_queue_core(
+    directory: str,
+    output: str,
+    config: Config,
+    queue: "WorkQueue",
+    force: bool = False,
+    progress: bool = False,
+    model: str | None = None,
+    resume: bool = True,
+    pages: list[int] | None = None,
+) -> None:
+    """Convert a directory as one of several workers sharing `queue`.
+
+    The files of the directory that need converting are added to the queue (in
+    the order of `schedule_files`), and files are claimed from it and converted
+    until there are none left to claim.
+    """
+    files = schedule_files(directory, output, config, force, pages is not None)
+    added = queue.add(directory, [file.rel_path for file in files])
+    scheduled = {file.rel_path for file in files}
+    logger.debug(f"Queued {added} new or changed files")
+
+    run_deadline = Deadline(config.run_timeout)
+    while not run_deadline.expired() and (lease := queue.claim()) is not None:
+        filename = os.path.join(directory, lease.path)
+        logger.debug(f"Processing file {filename}")
+        image_extractor = get_extractor(filename, config)
+        # Only files of supported types are queued:
+        assert image_extractor is not None
+        with queue.heartbeat(lease) as lost:
             try:
-                if file.lower().endswith(".note"):
-                    import_supernote_file_core(
-                        NotebookExtractor(),
-                        filename,
-                        output,
-                        config,
-                        force,
-                        progress,
-                        model,
-                    )
-                if file.lower().endswith(".pdf"):
-                    import_supernote_file_core(
-                        PDFExtractor(), filename, output, config, force, progress, model
-                    )
-                if file.lower().endswith(".png"):
-                    import_supernote_file_core(
-                        PNGExtractor(), filename, output, config, force, progress, model
+                import_supernote_file_core(
+                    image_extractor,
+                    filename,
+                    output,
+                    config,
+                    force,
+                    progress,
+                    model,
+                    resume=resume,
+                    pages=pages,
+                    # The conversion stops once the lease is lost:
+                    deadline=Deadline(parent=run_deadline, cancel=lost),
+                    # Files queued by other workers haven't been checked by
+                    # this one:
+                    verified=lease.path in scheduled,
+                )
+            except TimeoutError as e:
+                if lost.is_set():
+                    logger.warning(
+                        f"Stopped converting {filename}: its lease was lost to another worker"
                     )
-            except (ValueError, DecoderException) as e:
+                    continue
+                # Another worker (or the next run) resumes the file:
+                _log_file_timeout(filename, e)
+                _ = queue.release(lease, f"{type(e).__name__}: {e}")
+                continue
+            except (ValueError, *image_extractor.errors) as e:
                 logger.debug(f"Skipping {filename}: {e}")
+                _ = queue.skip(lease, str(e))
+                continue
+            except BaseException as e:
+                _ = queue.release(lease, f"{type(e).__name__}: {e}")
+                raise
+
+        if not queue.complete(lease):
+            logger.warning(f"{filename} was converted, but its lease had expired")
+
+    if run_deadline.expired():
+        _log_run_timeout()
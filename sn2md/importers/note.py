@@ -1,18 +1,224 @@
 import logging
+import mmap
 import os
-from typing import Callable
-from unittest.mock import patch
+from contextlib import contextmanager
+from functools import partial
+from io import BytesIO
+from typing import Any, Callable, Iterator
 
-from sn2md.types import ImageExtractor
+from PIL import Image
+
+from sn2md.images import png_bytes
+from sn2md.importers.resolution import scale_note_page
+from sn2md.types import Config, ImageExtractor
 
 import supernotelib as sn
+from supernotelib import decoder as Decoder
+from supernotelib import fileformat
 from supernotelib.converter import ImageConverter, VisibilityOverlay
+from supernotelib.exceptions import DecoderException, UnknownDecodeProtocol
+from supernotelib.utils import WorkaroundPageWrapper
 
 logger = logging.getLogger(__name__)
 
+# The directory (within the image directory) of the page images rendered for
+# the LLM, when they have different layers than the saved page images.
+LLM_IMAGE_DIR = "llm"
+# The directory of the page images without their background that ink is
+# measured on, when both the saved and the LLM images have a background.
+INK_IMAGE_DIR = "ink"
+
+
+def ink_overlay() -> dict[str, VisibilityOverlay]:
+    """The visibility overlay of the ink of a page: its layers without the
+    background (template) layer."""
+    return sn.converter.build_visibility_overlay(background=VisibilityOverlay.INVISIBLE)
+
+
+def llm_image_path(image_path: str) -> str:
+    return os.path.join(
+        os.path.dirname(image_path), LLM_IMAGE_DIR, os.path.basename(image_path)
+    )
+
+
+def ink_image_path(image_path: str) -> str:
+    return os.path.join(
+        os.path.dirname(image_path), INK_IMAGE_DIR, os.path.basename(image_path)
+    )
+
+
+def _measures_ink(config: Config) -> bool:
+    # Ink is measured to escalate pages, and to find dense pages.
+    return bool(config.escalation_models) or config.tile_min_ink is not None
+
+
+def _separate_llm_image(config: Config) -> bool:
+    return config.llm_background != config.image_background
+
+
+def _separate_ink_image(config: Config) -> bool:
+    # Ink is measured without the background: an image is only saved for it
+    # when both other images have a background.
+    return config.llm_background and config.image_background and _measures_ink(config)
+
+
+def read_block(data: bytes | mmap.mmap, address: int) -> bytes | None:
+    """Read the block at an address of a .note file (its length, then its
+    content), as supernotelib's parser does. Address 0 is no block."""
+    if address == 0:
+        return None
+    start = address + fileformat.LENGTH_FIELD_SIZE
+    length = int.from_bytes(data[address:start], "little")
+    return bytes(data[start : start + length])
+
+
+def lazy_page(data: bytes | mmap.mmap, page_info: dict[str, Any]) -> fileformat.Page:
+    """A page whose bitmaps are read from `data` each time they are used,
+    rather than held by the page."""
+    page = fileformat.Page(page_info)
+
+    def reader(key: str, info: dict[str, Any] = page_info) -> Callable[[], bytes | None]:
+        return partial(read_block, data, int(info.get(key, 0)))
+
+    if page.is_layer_supported():
+        for layer in page.get_layers():
+            layer.get_content = reader("LAYERBITMAP", layer.metadata)
+    else:
+        page.get_content = reader("DATA")
+    page.get_totalpath = reader("TOTALPATH")
+    page.get_recogn_file = reader("RECOGNFILE")
+    page.get_recogn_text = reader("RECOGNTEXT")
+    return page
+
+
+def load_lazily(data: bytes | mmap.mmap) -> sn.Notebook:
+    """Load a notebook from its content, without reading its pages.
+
+    Only the metadata blocks (indexed from the footer), cover, keywords, titles
+    and links are read up front. The bitmaps of a page's layers, which make up
+    most of a notebook, are read when the page is rendered, and released once
+    it is: memory use stays about the size of one page.
+    """
+    stream = data if isinstance(data, mmap.mmap) else BytesIO(data)
+    metadata = sn.parser.parse_metadata(stream)
+    without_pages = fileformat.SupernoteMetadata()
+    without_pages.type = metadata.type
+    without_pages.signature = metadata.signature
+    without_pages.header = metadata.header
+    without_pages.footer = metadata.footer
+    without_pages.pages = []
+
+    notebook = sn.parser.load(stream, without_pages)
+    notebook.metadata = metadata
+    notebook.pages = [lazy_page(data, page_info) for page_info in metadata.pages or []]
+    return notebook
+
 
 def load_notebook(path: str) -> sn.Notebook:
-    return sn.load_notebook(path)
+    """Load a notebook file, memory-mapped: its pages are read (by the OS, as
+    they are used) when they are rendered (see `load_lazily`)."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files can't be mapped (the parser rejects them):
+            return sn.parser.load(f)
+        # The mapping stays open (after the file is closed) until the pages of
+        # the notebook are no longer used.
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return load_lazily(data)
+
+
+def read_notebook(data: bytes) -> sn.Notebook:
+    """Load a notebook held in memory (see `load_lazily`)."""
+    return load_lazily(data)
+
+
+def layer_names(page: fileformat.Page) -> list[str | None]:
+    """The names of the layers of a page, as ImageConverter names them (a
+    second MAINLAYER is the background layer)."""
+    return [layer.get_name() for layer in WorkaroundPageWrapper(page.metadata).get_layers()]
+
+
+@contextmanager
+def decoding_only(page: fileformat.Page, background: bool) -> Iterator[None]:
+    """Only decode the background layer of a page (or only its other layers)
+    while it is rendered.
+
+    ImageConverter decodes every layer with content, whatever the visibility
+    overlay: the other layers are rendered without content.
+    """
+    hidden = [
+        layer
+        for layer, name in zip(page.get_layers(), layer_names(page))
+        if (name == "BGLAYER") != background
+    ]
+    originals = [vars(layer).get("get_content") for layer in hidden]
+    for layer in hidden:
+        layer.get_content = lambda: None
+    try:
+        yield
+    finally:
+        for layer, original in zip(hidden, originals):
+            if original is None:
+                del layer.get_content
+            else:
+                layer.get_content = original
+
+
+def render_layers(
+    converter: ImageConverter, number: int, background: bool = True
+) -> tuple[Image.Image, Image.Image | None]:
+    """Render the ink of a page (transparent elsewhere), and its background
+    layer (None without `background`, or for pages without layers), decoding
+    each layer of the page once."""
+    page = converter.note.get_page(number)
+    if not page.is_layer_supported():
+        return converter.convert(number, ink_overlay()), None
+
+    with decoding_only(page, background=False):
+        ink = converter.convert(number, ink_overlay())
+    if not background:
+        return ink, None
+    with decoding_only(page, background=True):
+        return ink, converter.convert(number, sn.converter.build_visibility_overlay())
+
+
+def flatten(ink: Image.Image, background: Image.Image | None = None) -> Image.Image:
+    """Composite the ink of a page onto its background, or onto white (in
+    grayscale) without one."""
+    if background is None:
+        white = Image.new("RGBA", ink.size, "white")
+        return Image.alpha_composite(white, ink.convert("RGBA")).convert("L")
+    return Image.alpha_composite(background.convert("RGBA"), ink.convert("RGBA")).convert("RGB")
+
+
+def render_page_images(
+    converter: ImageConverter,
+    total: int,
+    config: Config,
+    pages: list[int] | None = None,
+) -> Iterator[tuple[int, Image.Image, Image.Image | None, Image.Image | None]]:
+    """Render pages, yielding the page number, the image of the page, the
+    image of the page for the LLM (when its layers differ; None otherwise),
+    and the image that ink is measured on (when neither other image is
+    without the background; None otherwise), for each (selected) page.
+
+    Each page is decoded once (see `render_layers`), and its images are
+    composited from its ink and background. Images without the background are
+    on white, in grayscale.
+    """
+    background = config.image_background or config.llm_background
+    for i in range(total) if pages is None else [p for p in pages if p < total]:
+        ink, background_img = render_layers(converter, i, background)
+        ink_only = flatten(ink)
+        with_background = flatten(ink, background_img) if background_img is not None else ink_only
+
+        img = with_background if config.image_background else ink_only
+        llm_img = ink_img = None
+        if _separate_llm_image(config):
+            llm_img = with_background if config.llm_background else ink_only
+        if _separate_ink_image(config):
+            ink_img = ink_only
+        yield i, img, llm_img, ink_img
 
 
 def convert_pages_to_pngs(
@@ -20,52 +226,140 @@ def convert_pages_to_pngs(
     total: int,
     path: str,
     save_func: Callable,
-    visibility_overlay: dict[str, VisibilityOverlay],
+    config: Config,
+    pages: list[int] | None = None,
 ) -> list[str]:
+    """Save the pages as PNGs, returning their file names.
+
+    An image of each page for the LLM is saved to its `llm_image_path`, and an
+    image to measure ink on to its `ink_image_path`, when they differ from the
+    page image (see `render_page_images`).
+    """
     file_name = path + "/" + os.path.basename(path) + ".png"
     basename, extension = os.path.splitext(file_name)
     max_digits = len(str(total))
     files = []
-    for i in range(total):
+    if _separate_llm_image(config):
+        os.makedirs(os.path.join(path, LLM_IMAGE_DIR), exist_ok=True)
+    if _separate_ink_image(config):
+        os.makedirs(os.path.join(path, INK_IMAGE_DIR), exist_ok=True)
+    for i, img, llm_img, ink_img in render_page_images(converter, total, config, pages):
         numbered_filename = basename + "_" + str(i).zfill(max_digits) + extension
-        img = converter.convert(i, visibility_overlay)
+        if llm_img is not None:
+            save_func(llm_img, llm_image_path(numbered_filename))
+        if ink_img is not None:
+            save_func(ink_img, ink_image_path(numbered_filename))
         save_func(img, numbered_filename)
         files.append(numbered_filename)
     return files
 
 
-def convert_notebook_to_pngs(notebook: sn.Notebook, path: str) -> list[str]:
-    converter = ImageConverter(notebook)
-    bg_visibility = VisibilityOverlay.DEFAULT
-    vo = sn.converter.build_visibility_overlay(background=bg_visibility)
+def convert_notebook_to_pngs(
+    notebook: sn.Notebook,
+    path: str,
+    pages: list[int] | None = None,
+    config: Config | None = None,
+) -> list[str]:
+    config = config if config else Config()
 
     def save(img, file_name):
-        img.save(file_name, format="PNG")
+        scale_note_page(img, config).save(file_name, format="PNG")
 
-    return convert_pages_to_pngs(converter, notebook.get_total_pages(), path, save, vo)
+    return convert_pages_to_pngs(
+        ImageConverter(notebook), notebook.get_total_pages(), path, save, config, pages
+    )
 
 
-def convert_binary_to_image(notebook, title):
-    page = notebook.get_page(title.get_page_number())
-    binary = title.get_content()
+def find_decoder(page) -> Decoder.FlateDecoder | Decoder.RattaRleDecoder:
+    protocol = page.get_protocol()
+    if protocol == "SN_ASA_COMPRESS":
+        return Decoder.FlateDecoder()
+    elif protocol == "RATTA_RLE":
+        return Decoder.RattaRleDecoder()
+    raise UnknownDecodeProtocol(f"unknown decode protocol: {protocol}")
+
 
-    image_converter = sn.converter.ImageConverter(notebook)
-    decoder = image_converter.find_decoder(page)
-    titlerect = title.metadata["TITLERECT"].split(",")
-    # TODO ideally decoder would support decoding these titles directly - make a PR on supernotelib!
-    with (
-        patch.object(notebook, "get_width") as width_mock,
-        patch.object(notebook, "get_height") as height_mock,
-    ):
-        width_mock.return_value = int(titlerect[2])
-        height_mock.return_value = int(titlerect[3])
-        return image_converter._create_image_from_decoder(decoder, binary)
+def decode_region(
+    decoder: Decoder.FlateDecoder | Decoder.RattaRleDecoder,
+    binary: bytes,
+    width: int,
+    height: int,
+) -> Image.Image:
+    """Decode a bitmap of the given size (rather than the notebook's page size).
+
+    Decoders are stateless, so this is safe to call from several threads.
+    """
+    bitmap, size, bpp = decoder.decode(binary, width, height)
+    # The same modes as supernotelib's ImageConverter._create_image_from_decoder
+    # (titles are never PNGs):
+    if bpp == 32:
+        return Image.frombytes("RGBA", size, bitmap)
+    elif bpp == 24:
+        return Image.frombytes("RGB", size, bitmap)
+    elif bpp == 16:
+        return Image.frombytes("I;16", size, bitmap)
+    return Image.frombytes("L", size, bitmap)
+
+
+def convert_binary_to_image(notebook: sn.Notebook, title) -> Image.Image:
+    """Decode the image of a title (the TITLERECT region of its page)."""
+    page = notebook.get_page(title.get_page_number())
+    _, _, width, height = (int(v) for v in title.metadata["TITLERECT"].split(","))
+    return decode_region(find_decoder(page), title.get_content(), width, height)
 
 
 class NotebookExtractor(ImageExtractor):
-    def extract_images(self, filename: str, output_path: str) -> list[str]:
+    """Render the pages of a .note file.
+
+    The background (template) layer can be left out of the saved page images
+    (`image_background`) and/or of the images sent to the LLM
+    (`llm_background`).
+    """
+
+    @property
+    def errors(self) -> tuple[type[Exception], ...]:
+        return (DecoderException,)
+
+    def extract_images(
+        self, filename: str, output_path: str, pages: list[int] | None = None
+    ) -> list[str]:
         notebook = load_notebook(filename)
-        return convert_notebook_to_pngs(notebook, output_path)
+        return convert_notebook_to_pngs(notebook, output_path, pages, self.config)
+
+    def get_llm_image(self, image_path: str) -> str:
+        if _separate_llm_image(self.config):
+            return llm_image_path(image_path)
+        return image_path
+
+    def get_ink_image(self, image_path: str) -> str:
+        if _separate_ink_image(self.config):
+            return ink_image_path(image_path)
+        if not self.config.image_background:
+            return image_path
+        return self.get_llm_image(image_path)
 
     def get_notebook(self, filename: str) -> sn.Notebook | None:
         return load_notebook(filename)
+
+    def render_pages(
+        self, data: bytes, pages: list[int] | None = None
+    ) -> Iterator[tuple[int, bytes, bytes, bytes]]:
+        notebook = read_notebook(data)
+        for i, img, llm_img, ink_img in render_page_images(
+            ImageConverter(notebook), notebook.get_total_pages(), self.config, pages
+        ):
+            image = png_bytes(scale_note_page(img, self.config))
+            llm_image = image
+            if llm_img is not None:
+                llm_image = png_bytes(scale_note_page(llm_img, self.config))
+            if ink_img is not None:
+                ink_image = png_bytes(scale_note_page(ink_img, self.config))
+            else:
+                ink_image = image if not self.config.image_background else llm_image
+            yield i, image, llm_image, ink_image
+
+    def count_pages(self, data: bytes) -> int:
+        return read_notebook(data).get_total_pages()
+
+    def read_notebook(self, data: bytes) -> sn.Notebook | None:
+        return read_notebook(data)
@@ -1,23 +1,93 @@
+import logging
 import os
+
+from typing import TYPE_CHECKING, Iterator
+
 import pymupdf
-from supernotelib import Notebook
-from sn2md.types import ImageExtractor
+from sn2md.importers.resolution import pdf_page_dpi
+from sn2md.types import Config, ImageExtractor
+
+if TYPE_CHECKING:
+    from supernotelib import Notebook
+
+logger = logging.getLogger(__name__)
+
+
+def rss_mb() -> float | None:
+    """Return the current resident set size of this process in MiB, where it
+    is known (on Linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):  # pragma: no cover - not Linux
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
 
 
 class PDFExtractor(ImageExtractor):
-    def extract_images(self, filename: str, output_path: str) -> list[str]:
+    """Render PDF pages to PNGs, one page at a time.
+
+    Each page and its pixmap are released as soon as the PNG is written, and
+    MuPDF's resource store (fonts, decoded images) is emptied after every
+    `window` pages, so memory use doesn't grow with the number of pages.
+    The RSS after each window is kept in `rss`.
+
+    Pages are rendered at the resolution chosen by `pdf_page_dpi`.
+    """
+
+    def __init__(self, config: Config | None = None, window: int = 50):
+        super().__init__(config)
+        self.window = window
+        self.rss: list[float | None] = []
+
+    def extract_images(
+        self, filename: str, output_path: str, pages: list[int] | None = None
+    ) -> list[str]:
         file_name = output_path + "/" + os.path.basename(output_path) + ".png"
         basename, extension = os.path.splitext(file_name)
-        doc = pymupdf.open(filename)
-        max_digits = len(str(doc.page_count))
         files = []
-        for page in doc:
-            numbered_filename = basename + "_" + str(page.number).zfill(max_digits) + extension
-            pixmap = page.get_pixmap(dpi=150)
-            pixmap.save(numbered_filename)
-            files.append(numbered_filename)
+        with pymupdf.open(filename) as doc:
+            max_digits = len(str(doc.page_count))
+            for number, pixmap in self._render(doc, pages):
+                numbered_filename = basename + "_" + str(number).zfill(max_digits) + extension
+                pixmap.save(numbered_filename)
+                files.append(numbered_filename)
         return files
 
-    def get_notebook(self, filename: str) -> Notebook | None:
+    def render_pages(
+        self, data: bytes, pages: list[int] | None = None
+    ) -> Iterator[tuple[int, bytes, bytes, bytes]]:
+        with pymupdf.open(stream=data, filetype="pdf") as doc:
+            for number, pixmap in self._render(doc, pages):
+                image = pixmap.tobytes("png")
+                yield number, image, image, image
+
+    def count_pages(self, data: bytes) -> int:
+        with pymupdf.open(stream=data, filetype="pdf") as doc:
+            return doc.page_count
+
+    def _render(
+        self, doc: pymupdf.Document, pages: list[int] | None
+    ) -> Iterator[tuple[int, pymupdf.Pixmap]]:
+        """Yield the number and pixmap of each (selected) page."""
+        numbers = range(doc.page_count) if pages is None else [
+            p for p in pages if p < doc.page_count
+        ]
+        for i, number in enumerate(numbers, start=1):
+            page = doc.load_page(number)
+            pixmap = page.get_pixmap(dpi=pdf_page_dpi(page, self.config))
+            yield number, pixmap
+            del pixmap, page
+
+            if i % self.window == 0 or i == len(numbers):
+                self._end_window(i)
+
+    def _end_window(self, rendered: int) -> None:
+        pymupdf.TOOLS.store_shrink(100)
+        rss = rss_mb()
+        self.rss.append(rss)
+        logger.debug("Rendered %d pages (RSS: %s MiB)", rendered, rss)
+
+    def get_notebook(self, filename: str) -> "Notebook | None":
         # TODO: this is correct, but really we're talking about metadata of this specific extractor type - for notebooks its one thing, for PDFs its another...
         return None
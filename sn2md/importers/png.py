@@ -1,15 +1,34 @@
 import os
 import shutil
-from supernotelib import Notebook
+from typing import TYPE_CHECKING, Iterator
+
 from sn2md.types import ImageExtractor
 
+if TYPE_CHECKING:
+    from supernotelib import Notebook
+
 
 class PNGExtractor(ImageExtractor):
-    def extract_images(self, filename: str, output_path: str) -> list[str]:
+    def extract_images(
+        self, filename: str, output_path: str, pages: list[int] | None = None
+    ) -> list[str]:
+        if pages is not None and 0 not in pages:
+            return []
         file_name = os.path.join(output_path, os.path.basename(filename))
-        shutil.copy(filename, file_name)
+        # A copy, not a link: the image is moved to the output (and the image
+        # store), where it must not share its content with the source file.
+        shutil.copyfile(filename, file_name)
         return [file_name]
 
-    def get_notebook(self, filename: str) -> Notebook | None:
+    def render_pages(
+        self, data: bytes, pages: list[int] | None = None
+    ) -> Iterator[tuple[int, bytes, bytes, bytes]]:
+        if pages is None or 0 in pages:
+            yield 0, data, data, data
+
+    def count_pages(self, data: bytes) -> int:
+        return 1
+
+    def get_notebook(self, filename: str) -> "Notebook | None":
         # TODO: this is correct, but really we're talking about metadata of this specific extractor type - for notebooks its one thing, for PDFs its another...
         return None
@@ -0,0 +1,76 @@
+import importlib
+import os
+from typing import TYPE_CHECKING, Iterator
+
+from sn2md.types import Config, ImageExtractor
+
+if TYPE_CHECKING:
+    from supernotelib import Notebook
+
+# The extractor for each supported file extension, as "module:class". Backends
+# (pymupdf, supernotelib) are only imported once a matching file is converted.
+EXTRACTORS = {
+    ".note": "sn2md.importers.note:NotebookExtractor",
+    ".pdf": "sn2md.importers.pdf:PDFExtractor",
+    ".png": "sn2md.importers.png:PNGExtractor",
+}
+
+
+class LazyExtractor(ImageExtractor):
+    """An extractor that imports and creates its backend on first use.
+
+    Checking whether a file needs converting (which doesn't need the backend)
+    stays cheap: a run that skips every file never imports a backend.
+    """
+
+    def __init__(self, target: str, config: Config):
+        super().__init__(config)
+        self.target = target
+        self._extractor: ImageExtractor | None = None
+
+    @property
+    def extractor(self) -> ImageExtractor:
+        extractor = self._extractor
+        if extractor is None:
+            module_name, class_name = self.target.split(":")
+            extractor_class: type[ImageExtractor] = getattr(
+                importlib.import_module(module_name), class_name
+            )
+            extractor = self._extractor = extractor_class(self.config)
+        return extractor
+
+    @property
+    def errors(self) -> tuple[type[Exception], ...]:
+        # An extractor that was never loaded can't have raised anything.
+        return self._extractor.errors if self._extractor else ()
+
+    def extract_images(
+        self, filename: str, output_path: str, pages: list[int] | None = None
+    ) -> list[str]:
+        return self.extractor.extract_images(filename, output_path, pages)
+
+    def get_notebook(self, filename: str) -> "Notebook | None":
+        return self.extractor.get_notebook(filename)
+
+    def get_llm_image(self, image_path: str) -> str:
+        return self.extractor.get_llm_image(image_path)
+
+    def get_ink_image(self, image_path: str) -> str:
+        return self.extractor.get_ink_image(image_path)
+
+    def render_pages(
+        self, data: bytes, pages: list[int] | None = None
+    ) -> Iterator[tuple[int, bytes, bytes, bytes]]:
+        return self.extractor.render_pages(data, pages)
+
+    def count_pages(self, data: bytes) -> int:
+        return self.extractor.count_pages(data)
+
+    def read_notebook(self, data: bytes) -> "Notebook | None":
+        return self.extractor.read_notebook(data)
+
+
+def get_extractor(file_name: str, config: Config) -> ImageExtractor | None:
+    """Return the extractor for a file, or None if the file type is unsupported."""
+    target = EXTRACTORS.get(os.path.splitext(file_name)[1].lower())
+    return LazyExtractor(target, config) if target else None
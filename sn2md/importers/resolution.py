@@ -0,0 +1,80 @@
+import math
+import statistics
+
+from PIL.Image import Image, Resampling
+
+from sn2md.images import ink_mask
+from sn2md.types import Config
+
+# The height (in pixels) that rendered text should have to be transcribed accurately.
+TARGET_TEXT_HEIGHT = 24
+
+# Below this fraction of inked pixels, a notebook page is considered sparse.
+SPARSE_INK_DENSITY = 0.02
+
+# Sparse notebook pages are downscaled by this factor (strokes stay legible).
+SPARSE_SCALE = 0.75
+
+
+def clamp_dpi(dpi: float, width_pt: float, height_pt: float, config: Config) -> int:
+    """Clamp a DPI to the configured bounds, and to `max_pixels` for a page of
+    the given size (in points)."""
+    dpi = min(max(dpi, config.min_dpi), config.max_dpi)
+    max_dpi = 72 * math.sqrt(config.max_pixels / (width_pt * height_pt))
+    return max(1, int(min(dpi, max_dpi)))
+
+
+def pdf_page_dpi(page, config: Config) -> int:
+    """Choose the DPI to render a PDF page at.
+
+    Pages with text are rendered so that the typical word is TARGET_TEXT_HEIGHT
+    pixels high: large print is rendered at a lower resolution, small print at
+    a higher one. Scanned pages are rendered no higher than the resolution of
+    their images. Other pages use the configured `dpi`.
+    """
+    if not config.adaptive_resolution:
+        return config.dpi
+
+    width_pt, height_pt = page.rect.width, page.rect.height
+    word_heights = [y1 - y0 for _, y0, _, y1, *_ in page.get_text("words") if y1 > y0]
+    if word_heights:
+        dpi = TARGET_TEXT_HEIGHT * 72 / statistics.median(word_heights)
+    else:
+        dpi = config.dpi
+        image_dpis = [
+            72 * info["width"] / (info["bbox"][2] - info["bbox"][0])
+            for info in page.get_image_info()
+            if info["bbox"][2] > info["bbox"][0]
+        ]
+        if image_dpis:
+            dpi = min(dpi, max(image_dpis))
+
+    return clamp_dpi(dpi, width_pt, height_pt, config)
+
+
+def ink_density(image: Image) -> float:
+    """The fraction of inked pixels in an image."""
+    return float(ink_mask(image).mean())
+
+
+def note_page_scale(image: Image, config: Config) -> float:
+    """Choose the scale of a notebook page rendered at device resolution.
+
+    Sparse pages are downscaled, and all pages are limited to `max_pixels`.
+    """
+    if not config.adaptive_resolution:
+        return 1.0
+
+    scale = SPARSE_SCALE if ink_density(image) < SPARSE_INK_DENSITY else 1.0
+    width, height = image.size
+    return min(scale, math.sqrt(config.max_pixels / (width * height)))
+
+
+def scale_note_page(image: Image, config: Config) -> Image:
+    scale = note_page_scale(image, config)
+    if scale >= 1.0:
+        return image
+
+    width, height = image.size
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return image.resize(size, Resampling.LANCZOS)
@@ -0,0 +1,90 @@
+import json
+import os
+from typing import Any
+
+JOURNAL_FILE = ".sn2md.journal.jsonl"
+
+
+class PageJournal:
+    """An append-only log of the pages transcribed from a source file.
+
+    Each page's markdown is flushed to disk as soon as it is converted, so an
+    interrupted run can continue from the first missing page. Records are
+    keyed by the hash of the source file and the page index: records left
+    behind by a different version of the source are ignored.
+    """
+
+    def __init__(self, path: str, source_hash: str):
+        self.path = path
+        self.source_hash = source_hash
+
+    def _records(self, any_source: bool = False) -> list[dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+
+        records = []
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A partially written final line (the run was killed mid-write).
+                    continue
+                if any_source or record.get("source_hash") == self.source_hash:
+                    records.append(record)
+        return records
+
+    def _append(self, record: dict[str, Any]) -> None:
+        with open(self.path, "a") as f:
+            _ = f.write(json.dumps({"source_hash": self.source_hash, **record}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _page_records(self, any_source: bool) -> dict[int, dict[str, Any]]:
+        # Later records replace earlier ones for the same page.
+        return {
+            record["page"]: record
+            for record in self._records(any_source)
+            if "page" in record
+        }
+
+    def pages(self, any_source: bool = False) -> dict[int, str]:
+        """Return the markdown of every page already converted, by page index.
+
+        With `any_source`, the latest record of each page is returned, even if
+        it was converted from an earlier version of the source.
+        """
+        return {
+            page: record["markdown"]
+            for page, record in self._page_records(any_source).items()
+        }
+
+    def images(self, any_source: bool = False) -> dict[int, str]:
+        """Return the image file name of every page already converted, by page index."""
+        return {
+            page: record["image"]
+            for page, record in self._page_records(any_source).items()
+            if "image" in record
+        }
+
+    def recorded_images(self) -> set[str]:
+        """Return every image file name recorded in the journal, including the
+        images of pages that were converted again."""
+        return {record["image"] for record in self._records(any_source=True) if "image" in record}
+
+    def is_complete(self) -> bool:
+        """Whether the output for this version of the source was fully generated."""
+        return any(record.get("complete") for record in self._records())
+
+    def record(self, page: int, markdown: str, image: str | None = None) -> None:
+        record = {"page": page, "markdown": markdown}
+        if image:
+            record["image"] = image
+        self._append(record)
+
+    def complete(self) -> None:
+        self._append({"complete": True})
+
+    def reset(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
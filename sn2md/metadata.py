@@ -1,14 +1,57 @@
 import hashlib
 import os
+import time
 import yaml
 from dataclasses import asdict
+from typing import TYPE_CHECKING
+
 from .types import ConversionMetadata
 
+if TYPE_CHECKING:
+    from .archives import ArchiveMember
+
+
+def compute_hash(file_name: str) -> str:
+    """Return the sha1 hex digest of a file's contents."""
+    with open(file_name, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
 
-def check_metadata_file(metadata_file: str) -> ConversionMetadata | None:
+# File times are coarse (as coarse as 2s on some filesystems): a file modified
+# this recently could change again without its modification time changing, so
+# its size and time aren't recorded.
+RACY_MTIME_NS = 2_000_000_000
+
+
+def input_unchanged(
+    metadata: ConversionMetadata, member: "ArchiveMember | None" = None
+) -> bool:
+    """Whether the input file (or archive `member`) is the one that was converted.
+
+    Files with the recorded size and modification time are assumed unchanged,
+    without reading them.
+    """
+    if member is not None:
+        size, mtime_ns = member.size, member.mtime_ns
+    else:
+        stat = os.stat(metadata.input_file)
+        size, mtime_ns = stat.st_size, stat.st_mtime_ns
+    if (metadata.input_size, metadata.input_mtime_ns) == (size, mtime_ns):
+        return True
+    if member is not None:
+        return metadata.input_hash == member.hash
+    return metadata.input_hash == compute_hash(metadata.input_file)
+
+
+def check_metadata_file(
+    metadata_file: str,
+    allow_unchanged_input: bool = False,
+    member: "ArchiveMember | None" = None,
+) -> ConversionMetadata | None:
     """Check the hashes of the source file against the metadata.
 
-    Raises a ValueError if the source file hasn't been modified.
+    Raises a ValueError if the source file hasn't been modified (unless
+    `allow_unchanged_input`), or if the output file has been modified.
 
     Returns the computed source and output hashes.
     """
@@ -18,29 +61,33 @@ def check_metadata_file(metadata_file: str) -> ConversionMetadata | None:
             data = yaml.safe_load(f)
             metadata = ConversionMetadata(**data)
 
-            with open(metadata.output_file, "rb") as f:
-                output_hash = hashlib.sha1(f.read()).hexdigest()
-
-            with open(metadata.input_file, "rb") as f:
-                source_hash = hashlib.sha1(f.read()).hexdigest()
-
-            if metadata.input_hash == source_hash:
+            if not allow_unchanged_input and input_unchanged(metadata, member):
                 raise ValueError(f"Input {metadata.input_file} has NOT changed!")
 
-            if metadata.output_hash != output_hash:
+            if metadata.output_hash != compute_hash(metadata.output_file):
                 raise ValueError(f"Output {metadata.output_file} HAS been changed!")
 
             return metadata
 
 
-def write_metadata_file(source_file: str, output_file: str) -> None:
-    """Write the source hash and path to the metadata file."""
-    output_path = os.path.dirname(output_file)
-    with open(output_file, "rb") as f:
-        output_hash = hashlib.sha1(f.read()).hexdigest()
+def write_metadata_file(
+    source_file: str, output_file: str, member: "ArchiveMember | None" = None
+) -> None:
+    """Write the source hash and path to the metadata file.
 
-    with open(source_file, "rb") as f:
-        source_hash = hashlib.sha1(f.read()).hexdigest()
+    The source of an archive `member` is its path (see `ArchiveMember.path`).
+    """
+    output_path = os.path.dirname(output_file)
+    output_hash = compute_hash(output_file)
+    if member is not None:
+        source_hash, size, mtime_ns = member.hash, member.size, member.mtime_ns
+        # Archive members can't change without the archive being replaced.
+        racy = False
+    else:
+        source_hash = compute_hash(source_file)
+        source_stat = os.stat(source_file)
+        size, mtime_ns = source_stat.st_size, source_stat.st_mtime_ns
+        racy = time.time_ns() - mtime_ns < RACY_MTIME_NS
 
     metadata_path = os.path.join(output_path, ".sn2md.metadata.yaml")
     with open(metadata_path, "w") as f:
@@ -50,6 +97,8 @@ def write_metadata_file(source_file: str, output_file: str) -> None:
                 input_hash=source_hash,
                 output_file=output_file,
                 output_hash=output_hash,
+                input_size=None if racy else size,
+                input_mtime_ns=None if racy else mtime_ns,
             )),
             f,
         )
@@ -0,0 +1,121 @@
+import os
+from dataclasses import dataclass
+from fnmatch import fnmatch
+from typing import Iterator
+
+from sn2md.importers.registry import EXTRACTORS
+
+# A file of globs (one per line) of files and directories that directory
+# conversions leave out. Globs are relative to the directory of the file.
+IGNORE_FILE = ".sn2mdignore"
+
+
+@dataclass
+class SourceFile:
+    path: str
+    # The path relative to the directory that was scanned, with "/" separators.
+    rel_path: str
+    mtime: float
+    size: int
+
+
+def matches(rel_path: str, is_dir: bool, glob: str) -> bool:
+    """Match a path (relative to the scanned directory) against a glob.
+
+    Like .gitignore patterns: a glob without a "/" matches the name of a file
+    or directory at any depth, other globs match the whole relative path
+    (ignoring a leading "/"), and globs ending with "/" only match directories.
+    """
+    if glob.endswith("/"):
+        if not is_dir:
+            return False
+        glob = glob.rstrip("/")
+    if "/" in glob:
+        return fnmatch(rel_path, glob.lstrip("/"))
+    return fnmatch(rel_path.rsplit("/", 1)[-1], glob)
+
+
+def read_ignore_file(path: str) -> list[str]:
+    """Read the globs of an ignore file, if there is one."""
+    try:
+        with open(os.path.join(path, IGNORE_FILE)) as f:
+            lines = [line.strip() for line in f]
+    except FileNotFoundError:
+        return []
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def scan_directory(
+    directory: str,
+    include: list[str] | None = None,
+    exclude: list[str] | None = None,
+    skip_dirs: list[str] | None = None,
+) -> Iterator[SourceFile]:
+    """Yield the supported files in a directory tree.
+
+    Only files that match one of the `include` globs (when there are any) are
+    yielded. Directories and files that match an `exclude` glob, or a glob of
+    an IGNORE_FILE, are left out: excluded directories (and `skip_dirs`) are
+    not descended into. See `matches` for the syntax of the globs.
+
+    Uses os.scandir, so file types (and on Windows, sizes and times) come with
+    the directory listing. Symbolic links to directories aren't followed.
+    """
+    include = include or []
+    skipped = {
+        (stat.st_dev, stat.st_ino)
+        for stat in (os.stat(path) for path in skip_dirs or [] if os.path.isdir(path))
+    }
+
+    # Each directory to scan, with the excluded globs that apply to it (and the
+    # relative path of the directory the globs are relative to).
+    pending = [(directory, "", [("", glob) for glob in exclude or []])]
+    while pending:
+        path, rel_path, excluded = pending.pop()
+        excluded = excluded + [(rel_path, glob) for glob in read_ignore_file(path)]
+
+        def is_excluded(entry_rel_path: str, is_dir: bool) -> bool:
+            return any(
+                matches(entry_rel_path[len(base):], is_dir, glob)
+                for base, glob in excluded
+            )
+
+        with os.scandir(path) as entries:
+            for entry in entries:
+                entry_rel_path = rel_path + entry.name
+                if entry.is_dir():
+                    if entry.is_symlink() or is_excluded(entry_rel_path, True):
+                        continue
+                    stat = entry.stat()
+                    if (stat.st_dev, stat.st_ino) not in skipped:
+                        pending.append((entry.path, entry_rel_path + "/", excluded))
+                elif (
+                    os.path.splitext(entry.name)[1].lower() in EXTRACTORS
+                    and not is_excluded(entry_rel_path, False)
+                    and (not include or any(matches(entry_rel_path, False, g) for g in include))
+                ):
+                    stat = entry.stat()
+                    yield SourceFile(entry.path, entry_rel_path, stat.st_mtime, stat.st_size)
+
+
+ORDER_KEYS = {
+    "path": lambda f: (f.rel_path,),
+    "newest": lambda f: (-f.mtime, f.rel_path),
+    "smallest": lambda f: (f.size, f.rel_path),
+}
+
+
+def order_files(
+    files: list[SourceFile], order: str = "path", priority: list[str] | None = None
+) -> list[SourceFile]:
+    """Order files by `order` (see ORDER_KEYS), after putting the files that
+    match the `priority` globs first, in the order of the globs."""
+    priority = priority or []
+
+    def rank(file: SourceFile) -> int:
+        return next(
+            (i for i, glob in enumerate(priority) if fnmatch(file.rel_path, glob)),
+            len(priority),
+        )
+
+    return sorted(files, key=lambda f: (rank(f), *ORDER_KEYS[order](f)))
@@ -0,0 +1,260 @@
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, cast
+
+from .importer import (
+    get_extractor,
+    import_supernote_directory_core,
+    import_supernote_file_core,
+)
+from .types import Config
+
+logger = logging.getLogger(__name__)
+
+# Finished jobs are forgotten once there are more than this many.
+MAX_FINISHED_JOBS = 1000
+
+
+@dataclass
+class Job:
+    # A file or directory to convert.
+    path: str
+    # The output directory.
+    output: str
+    # Whether `path` is a directory.
+    directory: bool = False
+    force: bool = False
+    resume: bool = True
+    model: str | None = None
+    pages: list[int] | None = None
+    # Globs added to the `include` and `exclude` globs of the config, for a directory.
+    include: list[str] = field(default_factory=list)
+    exclude: list[str] = field(default_factory=list)
+
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    # queued, running, done, or failed.
+    status: str = "queued"
+    # The output file of a file job.
+    output_file: str | None = None
+    error: str | None = None
+
+
+def write_token(path: str) -> str:
+    """Create a new server token, writing it to a file only the user can read."""
+    token = secrets.token_urlsafe(32)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd = os.open(path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        _ = f.write(token)
+    os.replace(path + ".tmp", path)
+    return token
+
+
+def read_token(path: str) -> str | None:
+    """The token of a server (see `write_token`), or None if there is none."""
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+class ConversionService:
+    """Runs conversion jobs in a pool of worker threads.
+
+    The service lives as long as the process, so the imported libraries, llm
+    plugins and models (see `ai_utils.get_model`) stay loaded between jobs.
+    Models are cached per model and key, so the workers share one instance of
+    each model, and prompt it concurrently (llm models keep no per-prompt
+    state on the instance).
+    """
+
+    def __init__(self, config: Config, workers: int = 4):
+        self.config = config
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.jobs: dict[str, Job] = {}
+        self.lock = threading.Lock()
+
+    def submit(self, job: Job) -> Job:
+        with self.lock:
+            self._forget_finished_jobs()
+            self.jobs[job.id] = job
+        self.executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
+
+    def _forget_finished_jobs(self) -> None:
+        finished = [j.id for j in self.jobs.values() if j.status in ("done", "failed")]
+        for job_id in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def _run(self, job: Job) -> None:
+        job.status = "running"
+        image_extractor = None
+        try:
+            if job.directory:
+                config = replace(
+                    self.config,
+                    include=self.config.include + job.include,
+                    exclude=self.config.exclude + job.exclude,
+                )
+                import_supernote_directory_core(
+                    job.path,
+                    job.output,
+                    config,
+                    job.force,
+                    False,
+                    job.model,
+                    resume=job.resume,
+                    pages=job.pages,
+                )
+            else:
+                image_extractor = get_extractor(job.path, self.config)
+                if image_extractor is None:
+                    raise ValueError("Unsupported file format")
+                job.output_file = import_supernote_file_core(
+                    image_extractor,
+                    job.path,
+                    job.output,
+                    self.config,
+                    job.force,
+                    False,
+                    job.model,
+                    resume=job.resume,
+                    pages=job.pages,
+                )
+            job.status = "done"
+        except (ValueError, *(image_extractor.errors if image_extractor else ())) as e:
+            job.error = str(e)
+            job.status = "failed"
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job.id, job.path)
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = "failed"
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """The job API:
+
+    - POST /jobs with a JSON Job (`path` and `output` are required) queues a job.
+    - GET /jobs/<id> returns the job, including its status.
+
+    Requests must have the server's token (`Authorization: Bearer <token>`),
+    and jobs must be sent as `application/json`: web pages can't send either
+    without a CORS preflight, which the server doesn't answer.
+    """
+
+    @property
+    def conversion_server(self) -> "ConversionServer":
+        return cast("ConversionServer", self.server)
+
+    def _send_json(self, status: int, data: dict[str, Any]) -> None:
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        _ = self.wfile.write(body)
+
+    def _authorized(self) -> bool:
+        if hmac.compare_digest(
+            self.headers.get("Authorization", ""), f"Bearer {self.conversion_server.token}"
+        ):
+            return True
+        self._send_json(401, {"error": "Unauthorized"})
+        return False
+
+    def do_POST(self) -> None:
+        if not self._authorized():
+            return
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip()
+        if content_type != "application/json":
+            self._send_json(415, {"error": "Jobs must be sent as application/json"})
+            return
+        if self.path != "/jobs":
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            data = json.loads(self.rfile.read(length))
+            job = Job(
+                **{
+                    key: value
+                    for key, value in data.items()
+                    if key not in ("id", "status", "output_file", "error")
+                }
+            )
+        except (ValueError, TypeError) as e:
+            self._send_json(400, {"error": f"Invalid job: {e}"})
+            return
+
+        self._send_json(202, asdict(self.conversion_server.service.submit(job)))
+
+    def do_GET(self) -> None:
+        if not self._authorized():
+            return
+        job = None
+        if self.path.startswith("/jobs/"):
+            job = self.conversion_server.service.get(self.path[len("/jobs/"):])
+        if job is None:
+            self._send_json(404, {"error": "Not found"})
+            return
+        self._send_json(200, asdict(job))
+
+    def log_message(self, format, *args) -> None:
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class ConversionServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        service: ConversionService,
+        host: str,
+        port: int,
+        token: str,
+    ):
+        super().__init__((host, port), JobRequestHandler)
+        self.service = service
+        self.token = token
+
+
+def _request(url: str, token: str | None, data: dict[str, Any] | None = None) -> dict[str, Any]:
+    body = json.dumps(data).encode("utf-8") if data is not None else None
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    request = urllib.request.Request(url, data=body, headers=headers)
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def submit_job(
+    server_url: str, job: Job, poll_interval: float = 0.5, token: str | None = None
+) -> Job:
+    """Submit a job to a `sn2md serve` server (with its `token`), and wait for
+    it to finish."""
+    server_url = server_url.rstrip("/")
+    data = _request(f"{server_url}/jobs", token, asdict(job))
+    while data["status"] not in ("done", "failed"):
+        time.sleep(poll_interval)
+        data = _request(f"{server_url}/jobs/{data['id']}", token)
+    return Job(**data)
@@ -0,0 +1,67 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any
+
+# The keys LLM providers report cached prompt tokens under, in the details of a
+# response's usage (OpenAI: prompt_tokens_details/input_tokens_details,
+# Anthropic, Gemini).
+CACHED_TOKEN_KEYS = ("cached_tokens", "cache_read_input_tokens", "cachedContentTokenCount")
+
+
+def cached_tokens(details: dict[str, Any] | None) -> int:
+    """The number of cached prompt tokens in the details of a usage."""
+    if not details:
+        return 0
+    total = 0
+    for key, value in details.items():
+        if isinstance(value, dict):
+            total += cached_tokens(value)
+        elif key in CACHED_TOKEN_KEYS and isinstance(value, int):
+            total += value
+    return total
+
+
+@dataclass
+class RunStats:
+    """Statistics of the LLM requests made while converting a file."""
+
+    # The model whose output was used, for each converted page.
+    page_models: dict[int, str] = field(default_factory=dict)
+    # The number of times a page was converted again with the next model of
+    # the cascade, by the reason it was escalated.
+    escalations: Counter[str] = field(default_factory=Counter)
+    # The number of (dense) pages converted in bands.
+    tiled_pages: int = 0
+    # Token usage of the responses, as reported by the providers. Cached input
+    # tokens are included in input_tokens.
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0
+
+    def add_usage(self, usage) -> None:
+        """Add the usage (an llm.Usage) of a response."""
+        self.input_tokens += usage.input or 0
+        self.output_tokens += usage.output or 0
+        self.cached_tokens += cached_tokens(usage.details)
+
+    def models(self) -> Counter[str]:
+        """The number of pages converted by each model."""
+        return Counter(self.page_models.values())
+
+    def summary(self) -> str:
+        parts = [
+            f"{count} pages with {model}" for model, count in sorted(self.models().items())
+        ]
+        if self.escalations:
+            parts.append(
+                "escalated: "
+                + ", ".join(f"{reason} ({count})" for reason, count in sorted(self.escalations.items()))
+            )
+        if self.tiled_pages:
+            parts.append(f"{self.tiled_pages} pages in bands")
+        if self.input_tokens or self.output_tokens:
+            parts.append(
+                f"tokens: {self.input_tokens} in ({self.cached_tokens} cached), "
+                f"{self.output_tokens} out"
+            )
+        return "; ".join(parts) if parts else "no pages converted"
@@ -0,0 +1,78 @@
+import os
+from functools import lru_cache
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template
+
+from sn2md.types import Config
+
+
+class Templates:
+    """The compiled templates of a configuration.
+
+    The output path and filename templates are compiled once, and shared by
+    the check for unchanged files and the rendering of outputs. With a
+    `template_file`, the output template is loaded from the file (and can
+    include or extend the templates next to it), and is reloaded when the file
+    changes. With a `template_cache` directory, compiled file templates are
+    kept there between runs.
+    """
+
+    def __init__(
+        self,
+        template: str,
+        template_file: str | None,
+        template_cache: str | None,
+        output_path_template: str,
+        output_filename_template: str,
+    ):
+        loader = None
+        if template_file:
+            template_file = os.path.abspath(os.path.expanduser(template_file))
+            loader = FileSystemLoader(os.path.dirname(template_file))
+        bytecode_cache = None
+        if template_cache:
+            cache_dir = os.path.expanduser(template_cache)
+            os.makedirs(cache_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+        self.environment = Environment(loader=loader, bytecode_cache=bytecode_cache)
+        self.template_file = template_file
+        self.template = template
+        self.output_path = self.environment.from_string(output_path_template)
+        self.output_filename = self.environment.from_string(output_filename_template)
+        self._output: Template | None = None
+
+    @property
+    def output(self) -> Template:
+        """The template of output files."""
+        if self.template_file:
+            # The environment caches the template until the file changes.
+            return self.environment.get_template(os.path.basename(self.template_file))
+        if self._output is None:
+            self._output = self.environment.from_string(self.template)
+        return self._output
+
+
+@lru_cache(maxsize=16)
+def _templates(
+    template: str,
+    template_file: str | None,
+    template_cache: str | None,
+    output_path_template: str,
+    output_filename_template: str,
+) -> Templates:
+    return Templates(
+        template, template_file, template_cache, output_path_template, output_filename_template
+    )
+
+
+def get_templates(config: Config) -> Templates:
+    """Return the compiled templates of a configuration, reusing them for every
+    file of a run (and every job of a server) with the same templates."""
+    return _templates(
+        config.template,
+        config.template_file,
+        config.template_cache,
+        config.output_path_template,
+        config.output_filename_template,
+    )
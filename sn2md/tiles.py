@@ -0,0 +1,84 @@
+from difflib import SequenceMatcher
+from io import BytesIO
+
+from PIL import Image as PILImage
+from PIL.Image import Image
+
+from sn2md.images import crop_to_content, ink_percent, png_bytes
+
+# The most lines at the start of a band that can repeat the end of the band
+# before it (the overlap of bands is a small part of their height).
+MAX_OVERLAP_LINES = 10
+
+# How similar (0-1) two lines have to be to be the same line of the overlap:
+# the LLM doesn't always transcribe a line the same way twice.
+LINE_SIMILARITY = 0.9
+
+
+def _open(image: str | bytes) -> Image:
+    return PILImage.open(BytesIO(image) if isinstance(image, bytes) else image)
+
+
+def is_dense(image: str | bytes, min_ink: float) -> bool:
+    """Whether at least `min_ink` percent of a page (a path, or a PNG held in
+    memory) is covered in ink."""
+    with _open(image) as page:
+        return ink_percent(page) >= min_ink
+
+
+def split_bands(
+    image: str | bytes, bands: int, overlap: float, crop_padding: int | None = None
+) -> list[bytes]:
+    """Split a page into `bands` horizontal bands (PNGs), each overlapping the
+    next by `overlap` of a band's height, so lines cut by the edge of one band
+    are whole in the other.
+
+    With `crop_padding`, the blank margins of the page are cropped first (see
+    `crop_to_content`), so the bands share the content evenly.
+    """
+    with _open(image) as page:
+        if crop_padding is not None:
+            page = crop_to_content(page, crop_padding)
+        width, height = page.size
+        step = height / bands
+        margin = int(step * overlap / 2)
+        return [
+            png_bytes(
+                page.crop(
+                    (
+                        0,
+                        max(0, int(i * step) - margin),
+                        width,
+                        min(height, int((i + 1) * step) + margin),
+                    )
+                )
+            )
+            for i in range(bands)
+        ]
+
+
+def _same_line(a: str, b: str) -> bool:
+    a, b = " ".join(a.split()).lower(), " ".join(b.split()).lower()
+    return a == b or SequenceMatcher(None, a, b).ratio() >= LINE_SIMILARITY
+
+
+def _overlap(previous: list[str], band: list[str]) -> int:
+    """The number of lines at the start of `band` that repeat the end of
+    `previous`."""
+    for count in range(min(len(previous), len(band), MAX_OVERLAP_LINES), 0, -1):
+        lines = zip(previous[-count:], band[:count])
+        if any(line.strip() for line in band[:count]) and all(
+            _same_line(a, b) for a, b in lines
+        ):
+            return count
+    return 0
+
+
+def merge_bands(markdowns: list[str]) -> str:
+    """Join the markdown of the bands of a page, leaving out the lines that
+    both a band and the band before it transcribed (from their overlap)."""
+    lines: list[str] = []
+    for markdown in markdowns:
+        band = markdown.strip("\n").splitlines()
+        lines.extend(band[_overlap(lines, band) :])
+    return "\n".join(lines)
@@ -1,13 +1,15 @@
 from abc import ABC, abstractmethod
+from dataclasses import field
+from typing import TYPE_CHECKING, Iterator, Literal
 
 from pydantic.dataclasses import dataclass
-from supernotelib import Notebook
 
-TO_MARKDOWN_TEMPLATE = """###
-Context (the last few lines of markdown from the previous page):
-{context}
-###
-Convert the image to markdown:
+if TYPE_CHECKING:
+    from supernotelib import Notebook
+
+# The instructions sent with every page, as the system prompt: they're the
+# same for every request, so providers can cache them.
+TO_MARKDOWN_SYSTEM_PROMPT = """Convert the image to markdown:
 - If there is a simple diagram that the mermaid syntax can achieve, create a mermaid codeblock of it.
 - When it is unclear what an image is, don't output anything for it.
 - Use $$, $ latex math blocks for math equations.
@@ -15,6 +17,14 @@ Convert the image to markdown:
 - Do not wrap text in codeblocks.
 """
 
+# The part of the prompt that changes from page to page.
+TO_MARKDOWN_TEMPLATE = """###
+Context (the last few lines of markdown from the previous page):
+{context}
+###
+Convert the image to markdown.
+"""
+
 TO_TEXT_TEMPLATE = """
 Convert the following image to text.
 - If the image does not appear to be text, output a brief description (no more than 4 words), prepended with "Image: "
@@ -61,17 +71,108 @@ class Config:
     output_path_template: str = "{{file_basename}}"
     # The name of the output files. All template variables are available.
     output_filename_template: str = "{{file_basename}}.md"
-    # The prompt used to convert an image to markdown.
+    # The system prompt sent with every page: the instructions that don't
+    # change from page to page (not sent when empty). Defaults to the
+    # instructions of the default `prompt`, and is empty with a custom `prompt`
+    # (which holds its own instructions).
+    system_prompt: str | None = None
+    # The prompt used to convert an image to markdown, with the context of the
+    # previous page.
     prompt: str = TO_MARKDOWN_TEMPLATE
     # The prompt used to convert some image to plain text (used for header highlights (H1, H2, etc.))
     title_prompt: str = TO_TEXT_TEMPLATE
     # The jinja template used to output markdown files.
     template: str = DEFAULT_MD_TEMPLATE
+    # A jinja template file used to output markdown files instead of `template`
+    # (it can include or extend other templates in its directory).
+    template_file: str | None = None
+    # A directory where compiled template files are cached between runs
+    # (disabled when not set).
+    template_cache: str | None = None
     # The LLM model to use for conversion (e.g. gpt-4o-mini). Can be any model installed in the environment (https://llm.datasette.io/en/stable/plugins/index.html)
     model: str = "gpt-4o-mini"
+    # Stronger models that a page is converted with, in turn, when the output of
+    # the previous model looks wrong: it's empty, a refusal, has malformed LaTeX
+    # or mermaid, or is short for the amount of ink on the page.
+    escalation_models: list[str] = field(default_factory=list)
+    # Pages with fewer characters of output per percent of the page covered in
+    # ink than this are escalated.
+    min_text_per_ink: float = 20.0
+    # Send a request again when it takes longer than this percentile of recent
+    # request latencies (e.g. 95), using the first response (disabled when not set).
+    hedge_percentile: float | None = None
+    # The models hedged requests are sent to (the first is used). The model of
+    # the request when empty.
+    hedge_models: list[str] = field(default_factory=list)
+    # Models that a request is sent to, in turn, when it fails (e.g. when the
+    # provider is down).
+    fallback_models: list[str] = field(default_factory=list)
+    # Give up on an LLM request after this many seconds (no limit when not set).
+    request_timeout: float | None = None
+    # Stop converting a file after this many seconds: the converted pages are
+    # kept, and the next run resumes from them (no limit when not set).
+    file_timeout: float | None = None
+    # Stop a directory run after this many seconds, leaving the remaining files
+    # for the next run (no limit when not set).
+    run_timeout: float | None = None
     # The API KEY for the model selected.
     api_key: str | None = None
 
+    # The resolution PDF pages are rendered at.
+    dpi: int = 150
+    # Choose the resolution of each page from its size and content: PDF text is
+    # rendered at a legible size, sparse notebook pages are downscaled.
+    adaptive_resolution: bool = False
+    # The range of resolutions adaptive resolution picks from.
+    min_dpi: int = 72
+    max_dpi: int = 300
+    # The largest page image (in pixels) adaptive resolution renders.
+    max_pixels: int = 2_000_000
+
+    # Include the background (template) layer of .note pages in the saved page
+    # images, and in the images sent to the LLM (by default, the LLM is sent the
+    # ink only). When these differ, each page is rendered twice.
+    image_background: bool = True
+    llm_background: bool = False
+    # The number of consecutive pages sent to the LLM in each request. With more
+    # than one, the LLM is asked to delimit the pages in its response (pages are
+    # sent one at a time if the response can't be split).
+    pages_per_request: int = 1
+    # Stream LLM responses, writing each page to a provisional output file (the
+    # output file name with a `.partial` suffix) as it is converted. The
+    # provisional file is removed when the conversion ends.
+    stream: bool = False
+    # Crop the blank margins of page images sent to the LLM, keeping this many
+    # pixels of padding around the content (disabled when not set).
+    crop_padding: int | None = None
+    # Convert pages with at least this percent of the page covered in ink (a
+    # dense page, with a long transcription) in `tile_bands` overlapping
+    # horizontal bands, in concurrent requests (disabled when not set).
+    tile_min_ink: float | None = None
+    # The number of bands dense pages are split into.
+    tile_bands: int = 3
+    # How much consecutive bands overlap, as a fraction of a band's height.
+    tile_overlap: float = 0.1
+    # Store each distinct page image once, named by its content hash, in this
+    # directory (relative to the output directory). Output folders hard link to
+    # the stored images (disabled when not set).
+    image_store: str | None = None
+    # Also record each converted file, and each of its pages, in this corpus
+    # (relative to the output directory): a JSONL file (".jsonl"), or a SQLite
+    # database with a full-text index of the pages (disabled when not set).
+    corpus: str | None = None
+    # The order the files of a directory are converted in: by "path", "newest"
+    # (most recently modified) first, or "smallest" first.
+    directory_order: Literal["path", "newest", "smallest"] = "path"
+    # Files of a directory that match these globs (matched against their path
+    # relative to the directory) are converted first, in the order of the globs.
+    priority: list[str] = field(default_factory=list)
+    # Only convert the files of a directory that match one of these globs (when
+    # set), and leave out the files and directories that match the `exclude`
+    # globs. Globs follow the .gitignore syntax (see `scheduler.matches`).
+    include: list[str] = field(default_factory=list)
+    exclude: list[str] = field(default_factory=list)
+
     # The API key, deprecated - use `api_key`
     openai_api_key: str | None = None
 
@@ -79,6 +180,10 @@ class Config:
         # support the deprecated configuration:
         if self.api_key is None:
             self.api_key = self.openai_api_key
+        if self.system_prompt is None:
+            self.system_prompt = (
+                TO_MARKDOWN_SYSTEM_PROMPT if self.prompt == TO_MARKDOWN_TEMPLATE else ""
+            )
 
 @dataclass
 class ConversionMetadata:
@@ -90,14 +195,66 @@ class ConversionMetadata:
     output_file: str
     # The hash of the output file at the time it was generated.
     output_hash: str
+    # The size and modification time of the input at the time of conversion
+    # (when these are unchanged, the input is not hashed again).
+    input_size: int | None = None
+    input_mtime_ns: int | None = None
 
 class ImageExtractor(ABC):
+    def __init__(self, config: Config | None = None):
+        self.config = config if config else Config()
+
+    @property
+    def errors(self) -> tuple[type[Exception], ...]:
+        """Exceptions raised for source files that can't be converted."""
+        return ()
+
     @abstractmethod
-    def extract_images(self, filename: str, output_path: str) -> list[str]:
+    def extract_images(
+        self, filename: str, output_path: str, pages: list[int] | None = None
+    ) -> list[str]:
+        """Render pages of `filename` as PNGs in `output_path`.
+
+        `pages` selects (zero based, sorted) page numbers to render; all pages
+        are rendered when it is None. Selected pages past the end of the
+        document are ignored.
+        """
         pass
 
     @abstractmethod
-    def get_notebook(self, filename: str) -> Notebook | None:
+    def get_notebook(self, filename: str) -> "Notebook | None":
         pass
 
+    def get_llm_image(self, image_path: str) -> str:
+        """Return the image of a page to send to the LLM (by default, the page
+        image itself)."""
+        return image_path
+
+    def get_ink_image(self, image_path: str) -> str:
+        """Return the image of a page that its ink is measured on: the page
+        without its background (by default, the image sent to the LLM)."""
+        return self.get_llm_image(image_path)
+
+    @abstractmethod
+    def render_pages(
+        self, data: bytes, pages: list[int] | None = None
+    ) -> Iterator[tuple[int, bytes, bytes, bytes]]:
+        """Render pages of a file held in memory, without writing files.
+
+        Yields the page number, the PNG of the page, the PNG of the page to
+        send to the LLM, and the PNG that its ink is measured on (see
+        `get_ink_image`), for each (selected) page, as it is rendered.
+        """
+        pass
+
+    @abstractmethod
+    def count_pages(self, data: bytes) -> int:
+        """Return the number of pages of a file held in memory (page numbers
+        are padded to its width)."""
+        pass
+
+    def read_notebook(self, data: bytes) -> "Notebook | None":
+        """Return the notebook of a file held in memory (if it is one)."""
+        return None
+
 
@@ -0,0 +1,245 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Generator
+
+from sn2md.metadata import compute_hash
+
+logger = logging.getLogger(__name__)
+
+# How long a claimed file stays leased to a worker without a heartbeat. A
+# worker that stops heartbeating (it died, or lost the shared filesystem) for
+# longer than this loses the file to another worker.
+LEASE_SECONDS = 300.0
+
+# A file that has been claimed this many times without being converted (e.g.
+# it crashes every worker that converts it) is marked as failed rather than
+# claimed again.
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT NOT NULL,
+    source_hash TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    -- Files with a lower priority are claimed first.
+    priority INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    -- The size and modification time of the file when it was hashed.
+    size INTEGER,
+    mtime_ns INTEGER,
+    PRIMARY KEY (path, source_hash)
+)
+"""
+
+# Columns added to the files table after it was first released, added to the
+# tables of existing queues (as "name definition").
+MIGRATIONS = [
+    "priority INTEGER NOT NULL DEFAULT 0",
+    "size INTEGER",
+    "mtime_ns INTEGER",
+]
+
+
+@dataclass
+class Lease:
+    path: str
+    source_hash: str
+    worker: str
+
+
+class WorkQueue:
+    """A queue of source files, shared by workers through a SQLite database.
+
+    Workers (on any host that can reach the database file) claim one file at
+    a time, holding a lease on it that they renew with heartbeats while the
+    file is converted. Files are keyed by path and content hash, so each
+    version of a file is converted once: a file is only queued again when it
+    changes. Leases of workers that stop heartbeating expire, and their files
+    are claimed by other workers.
+
+    Lease expiry compares wall clock times, so the clocks of the workers'
+    hosts should be in sync (to well within the lease duration). The database
+    must be on a filesystem with working locks (SQLite does not support NFS
+    without them).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        worker: str | None = None,
+        lease_seconds: float = LEASE_SECONDS,
+    ):
+        self.path = path
+        self.worker = worker if worker else f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        with self._connect() as db:
+            db.execute(SCHEMA)
+            columns = {row[1] for row in db.execute("PRAGMA table_info(files)")}
+            for column in MIGRATIONS:
+                if column.split()[0] not in columns:
+                    db.execute(f"ALTER TABLE files ADD COLUMN {column}")
+
+    @contextmanager
+    def _connect(self) -> Generator[sqlite3.Connection, None, None]:
+        # Autocommit mode: transactions are started explicitly, with
+        # BEGIN IMMEDIATE, so that claims by concurrent workers are serialized.
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @contextmanager
+    def _transaction(self) -> Generator[sqlite3.Connection, None, None]:
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    def add(self, root: str, paths: list[str]) -> int:
+        """Queue the files that haven't been queued in their current version,
+        returning the number of files queued. Files are claimed in the order of
+        their position in `paths` (the files of separate calls interleave).
+
+        Files are queued by their path relative to `root`, so workers can
+        mount the shared source tree at different places. Files whose size and
+        modification time match their queued version aren't hashed again.
+        """
+        with self._connect() as db:
+            hashed = {
+                (path, size, mtime_ns): source_hash
+                for path, source_hash, size, mtime_ns in db.execute(
+                    "SELECT path, source_hash, size, mtime_ns FROM files"
+                    " WHERE size IS NOT NULL"
+                )
+            }
+        rows = []
+        for priority, path in enumerate(paths):
+            stat = os.stat(os.path.join(root, path))
+            source_hash = hashed.get((path, stat.st_size, stat.st_mtime_ns))
+            if source_hash is None:
+                source_hash = compute_hash(os.path.join(root, path))
+            rows.append((path, source_hash, priority, stat.st_size, stat.st_mtime_ns))
+
+        with self._transaction() as db:
+            before = db.total_changes
+            db.executemany(
+                "INSERT OR IGNORE INTO files (path, source_hash, priority, size, mtime_ns)"
+                " VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            return db.total_changes - before
+
+    def claim(self) -> Lease | None:
+        """Lease the next file to convert, or return None if there is none."""
+        now = time.time()
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE files SET status = 'failed', error = 'Lease expired too many times'"
+                " WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, MAX_ATTEMPTS),
+            )
+            row = db.execute(
+                "SELECT path, source_hash FROM files"
+                " WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?)"
+                " ORDER BY attempts, priority, path LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE files SET status = 'leased', worker = ?, lease_expires = ?,"
+                " attempts = attempts + 1 WHERE path = ? AND source_hash = ?",
+                (self.worker, now + self.lease_seconds, *row),
+            )
+        return Lease(row[0], row[1], self.worker)
+
+    def _finish(self, lease: Lease, status: str, error: str | None = None) -> bool:
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE files SET status = ?, error = ?, lease_expires = NULL"
+                " WHERE path = ? AND source_hash = ? AND worker = ? AND status = 'leased'",
+                (status, error, lease.path, lease.source_hash, lease.worker),
+            )
+            return cursor.rowcount == 1
+
+    def renew(self, lease: Lease) -> bool:
+        """Extend a lease. Returns False if the lease was lost to another worker."""
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE files SET lease_expires = ?"
+                " WHERE path = ? AND source_hash = ? AND worker = ? AND status = 'leased'",
+                (time.time() + self.lease_seconds, lease.path, lease.source_hash, lease.worker),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, lease: Lease) -> bool:
+        """Mark a leased file as converted. Returns False if the lease was lost."""
+        return self._finish(lease, "done")
+
+    def skip(self, lease: Lease, reason: str) -> bool:
+        """Mark a leased file as not converted (e.g. it is unchanged since it
+        was last converted). Returns False if the lease was lost."""
+        return self._finish(lease, "skipped", reason)
+
+    def release(self, lease: Lease, error: str) -> bool:
+        """Give up a leased file after an error, so another worker can retry it
+        (unless it was already tried MAX_ATTEMPTS times, then it has failed).
+        Returns False if the lease was lost."""
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE files SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+                " error = ?, worker = NULL, lease_expires = NULL"
+                " WHERE path = ? AND source_hash = ? AND worker = ? AND status = 'leased'",
+                (MAX_ATTEMPTS, error, lease.path, lease.source_hash, lease.worker),
+            )
+            return cursor.rowcount == 1
+
+    def counts(self) -> dict[str, int]:
+        """The number of files in each status."""
+        with self._connect() as db:
+            return dict(
+                db.execute("SELECT status, COUNT(*) FROM files GROUP BY status").fetchall()
+            )
+
+    @contextmanager
+    def heartbeat(self, lease: Lease) -> Generator[threading.Event, None, None]:
+        """Renew a lease in the background while the block runs.
+
+        The yielded event is set if the lease is lost.
+        """
+        lost = threading.Event()
+        done = threading.Event()
+
+        def beat() -> None:
+            while not done.wait(self.lease_seconds / 3):
+                try:
+                    if not self.renew(lease):
+                        logger.warning("Lost the lease on %s", lease.path)
+                        lost.set()
+                        return
+                except sqlite3.Error as e:
+                    # Try again on the next beat: the lease is still valid.
+                    logger.warning("Could not renew the lease on %s: %s", lease.path, e)
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield lost
+        finally:
+            done.set()
+            thread.join()
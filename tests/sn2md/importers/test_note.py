@@ -1,10 +1,23 @@
+from io import BytesIO
 from unittest.mock import MagicMock, patch
 
 import pytest
 import supernotelib as sn
 
-from sn2md.importers.note import (convert_notebook_to_pngs,
-                                   convert_pages_to_pngs, load_notebook)
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+from supernotelib.converter import ImageConverter
+from supernotelib.decoder import RattaRleDecoder
+from supernotelib.exceptions import UnknownDecodeProtocol, UnsupportedFileFormat
+
+from sn2md.importers.note import (NotebookExtractor,
+                                   convert_binary_to_image,
+                                   convert_notebook_to_pngs,
+                                   convert_pages_to_pngs, find_decoder,
+                                   load_notebook, read_notebook,
+                                   render_page_images)
+from sn2md.types import Config
 
 
 @pytest.fixture
@@ -13,32 +26,283 @@ def mock_notebook():
     notebook.get_total_pages.return_value = 3
     return notebook
 
-def test_load_notebook():
-    with patch("sn2md.importers.note.sn.load_notebook") as mock_load:
-        mock_load.return_value = "mock_notebook"
-        result = load_notebook("fake_path")
-        mock_load.assert_called_once_with("fake_path")
-        assert result == "mock_notebook"
+LAYER_INFO = (
+    '[{"layerId"#0,"isBackgroundLayer"#false,"isVisible"#true},'
+    '{"layerId"#-1,"isBackgroundLayer"#true,"isVisible"#true}]'
+)
+
+
+def page_bitmap(name: str, number: int) -> bytes:
+    """A RATTA_RLE bitmap of a whole (N5) page: the main layer has black ink at
+    the top of the page, and the background layer gray lines at the bottom."""
+    runs = [0x62] * 300  # runs of 0x4000 transparent pixels
+    if name == "MAINLAYER":
+        runs[0] = 0x61
+    else:
+        runs[-1] = 0x64
+    return bytes(byte for code in runs for byte in (code, 0xFF))
+
+
+def make_note(pages: int = 2, bitmap=lambda name, number: f"{name} of page {number}") -> bytes:
+    """A .note file (X-series format) with a (visible) main and background
+    layer on each page, a title and a keyword."""
+    data = bytearray(b"noteSN_FILE_VER_20230015")
+
+    def block(content: bytes | str) -> int:
+        address = len(data)
+        content = content.encode() if isinstance(content, str) else content
+        data.extend(len(content).to_bytes(4, "little") + content)
+        return address
+
+    page_addresses = []
+    for number in range(pages):
+        layers = {
+            name: block(
+                f"<LAYERNAME:{name}><LAYERPROTOCOL:RATTA_RLE>"
+                f"<LAYERBITMAP:{block(bitmap(name, number))}>"
+            )
+            for name in ["MAINLAYER", "BGLAYER"]
+        }
+        page_addresses.append(
+            block(
+                f"<PAGESTYLE:none><LAYERINFO:{LAYER_INFO}><LAYERSEQ:MAINLAYER,BGLAYER>"
+                f"<MAINLAYER:{layers['MAINLAYER']}><LAYER1:0><LAYER2:0>"
+                f"<LAYER3:0><BGLAYER:{layers['BGLAYER']}><TOTALPATH:{block(f'path {number}')}>"
+            )
+        )
+    title = block(f"<TITLEBITMAP:{block('title bitmap')}><TITLERECT:0,0,2,2><TITLELEVEL:1>")
+    keyword = block(f"<KEYWORDSITE:{block('word')}><KEYWORDPAGE:1>")
+    footer = block(
+        f"<FILE_FEATURE:{block('<FILE_TYPE:NOTE><APPLY_EQUIPMENT:N5>')}>"
+        + "".join(f"<PAGE{n + 1}:{address}>" for n, address in enumerate(page_addresses))
+        + f"<TITLE_00010000:{title}><KEYWORD_00010000:{keyword}><COVER_0:0>"
+    )
+    data.extend(footer.to_bytes(4, "little"))
+    return bytes(data)
+
+
+def assert_same_notebook(notebook, expected):
+    assert notebook.get_total_pages() == expected.get_total_pages()
+    assert notebook.get_width() == expected.get_width()
+    for number in range(expected.get_total_pages()):
+        page, expected_page = notebook.get_page(number), expected.get_page(number)
+        assert page.metadata == expected_page.metadata
+        assert [layer.get_content() for layer in page.get_layers()] == [
+            layer.get_content() for layer in expected_page.get_layers()
+        ]
+        assert page.get_totalpath() == expected_page.get_totalpath()
+        assert page.get_recogn_text() == expected_page.get_recogn_text()
+    assert [t.get_content() for t in notebook.titles] == [t.get_content() for t in expected.titles]
+    assert [t.get_page_number() for t in notebook.titles] == [0]
+    assert [k.get_content() for k in notebook.keywords] == [b"word"]
+
+
+def test_load_notebook(tmp_path):
+    path = tmp_path / "test.note"
+    path.write_bytes(make_note())
+
+    notebook = load_notebook(str(path))
+
+    assert_same_notebook(notebook, sn.load_notebook(str(path)))
+    assert notebook.get_page(1).get_layer(0).get_content() == b"MAINLAYER of page 1"
+    # Pages are read from the file when they are used, not held in memory:
+    assert notebook.get_page(1).get_layer(0).content is None
+
+
+def test_load_empty_notebook(tmp_path):
+    path = tmp_path / "empty.note"
+    path.write_bytes(b"")
+    with pytest.raises(UnsupportedFileFormat):
+        load_notebook(str(path))
+
+def _converter(pages: int = 3) -> ImageConverter:
+    return ImageConverter(read_notebook(make_note(pages, page_bitmap)))
+
+
+def _has_background(image) -> bool:
+    # The background layer has gray lines at the bottom of the page:
+    return image.convert("L").getpixel((0, image.height - 1)) < 255
+
+
+def test_convert_pages_to_pngs(tmp_path):
+    mock_save_func = MagicMock()
+    path = str(tmp_path)
+    result = convert_pages_to_pngs(_converter(), 3, path, mock_save_func, Config())
+    assert result == [f"{path}/{tmp_path.name}_{n}.png" for n in range(3)]
+    # With an image for the LLM, without the background:
+    assert mock_save_func.call_count == 6
+    assert (tmp_path / "llm").is_dir()
+
+
+def test_convert_pages_to_pngs_selected_pages(tmp_path):
+    mock_save_func = MagicMock()
+    path = str(tmp_path)
+    config = Config(llm_background=True)
+    result = convert_pages_to_pngs(_converter(), 3, path, mock_save_func, config, [1, 5])
+    assert result == [f"{path}/{tmp_path.name}_1.png"]
+    mock_save_func.assert_called_once()
+
+
+def test_convert_notebook_to_pngs(tmp_path):
+    path = str(tmp_path)
+    notebook = read_notebook(make_note(3, page_bitmap))
+    result = convert_notebook_to_pngs(notebook, path)
+
+    assert result == [f"{path}/{tmp_path.name}_{n}.png" for n in range(3)]
+    with Image.open(result[0]) as image:
+        assert _has_background(image)
+    with Image.open(f"{path}/llm/{tmp_path.name}_0.png") as llm_image:
+        # Ink only, on white, in grayscale:
+        assert llm_image.mode == "L"
+        assert not _has_background(llm_image)
+        assert llm_image.getpixel((0, 0)) == 0
+
+
+def test_render_page_images():
+    converter = _converter(1)
+    with patch.object(
+        RattaRleDecoder, "decode", autospec=True, side_effect=RattaRleDecoder.decode
+    ) as mock_decode:
+        [(number, image, llm_image, ink_image)] = render_page_images(converter, 1, Config())
 
-def test_convert_pages_to_pngs(mock_notebook):
-    mock_converter = MagicMock()
+    # Each layer is decoded once:
+    assert mock_decode.call_count == 2
+    assert number == 0 and ink_image is None
+    # The page image is the same as supernotelib's rendering of the page:
+    assert image.tobytes() == converter.convert(0).convert("RGB").tobytes()
+    assert llm_image.mode == "L" and not _has_background(llm_image)
+    assert llm_image.getpixel((0, 0)) == 0
+    # The layers of the page are left as they were:
+    contents = {layer.get_name(): layer.get_content() for layer in converter.note.get_page(0).get_layers()}
+    assert contents["BGLAYER"] == page_bitmap("BGLAYER", 0)
+    assert contents["MAINLAYER"] == page_bitmap("MAINLAYER", 0)
+
+
+def test_render_page_images_without_background():
+    converter = _converter(1)
+    config = Config(image_background=False)
+    with patch.object(
+        RattaRleDecoder, "decode", autospec=True, side_effect=RattaRleDecoder.decode
+    ) as mock_decode:
+        [(_, image, llm_image, ink_image)] = render_page_images(converter, 1, config)
+
+    # The background layer isn't decoded:
+    assert mock_decode.call_count == 1
+    assert image.mode == "L" and not _has_background(image)
+    assert llm_image is None and ink_image is None
+
+
+@pytest.mark.parametrize(
+    "llm_background, image_background, expected",
+    [
+        (True, True, "dir/page.png"),
+        (False, False, "dir/page.png"),
+        (False, True, "dir/llm/page.png"),
+    ],
+)
+def test_get_llm_image(llm_background, image_background, expected):
+    config = Config(llm_background=llm_background, image_background=image_background)
+    assert NotebookExtractor(config).get_llm_image("dir/page.png") == expected
+
+
+def test_llm_image_is_ink_only_by_default():
+    assert NotebookExtractor().get_llm_image("dir/page.png") == "dir/llm/page.png"
+
+
+def _title(width, height):
+    title = MagicMock()
+    title.get_page_number.return_value = 0
+    title.metadata = {"TITLERECT": f"10,20,{width},{height}"}
+    # RATTA_RLE: 6 black pixels, then 6 background pixels
+    title.get_content.return_value = bytes([0x61, 5, 0x62, 5])
+    return title
+
+
+def test_convert_binary_to_image(mock_notebook):
+    mock_notebook.get_page.return_value.get_protocol.return_value = "RATTA_RLE"
+    image = convert_binary_to_image(mock_notebook, _title(4, 3))
+
+    assert image.size == (4, 3)
+    assert image.mode == "L"
+    assert image.tobytes()[:6] == bytes(6)
+    # the notebook's own dimensions aren't used (or modified):
+    mock_notebook.get_width.assert_not_called()
+    mock_notebook.get_height.assert_not_called()
+
+
+def test_convert_binary_to_image_threads(mock_notebook):
+    mock_notebook.get_page.return_value.get_protocol.return_value = "RATTA_RLE"
+    titles = [_title(4, 3), _title(6, 2), _title(2, 6)] * 10
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        images = list(executor.map(lambda t: convert_binary_to_image(mock_notebook, t), titles))
+
+    assert [image.size for image in images] == [(4, 3), (6, 2), (2, 6)] * 10
+
+
+def test_find_decoder():
+    page = MagicMock()
+    page.get_protocol.return_value = "SN_ASA_COMPRESS"
+    assert type(find_decoder(page)).__name__ == "FlateDecoder"
+    page.get_protocol.return_value = "unknown"
+    with pytest.raises(UnknownDecodeProtocol):
+        find_decoder(page)
+
+
+@pytest.mark.parametrize(
+    "options, backgrounds",
+    [
+        ({}, [True, False, False]),
+        ({"llm_background": True}, [True, True, True]),
+        ({"llm_background": True, "image_background": False}, [False, True, False]),
+        # Ink is measured on an image without the background:
+        ({"llm_background": True, "escalation_models": ["strong"]}, [True, True, False]),
+        ({"llm_background": True, "tile_min_ink": 10.0}, [True, True, False]),
+    ],
+)
+def test_render_pages(options, backgrounds):
+    data = make_note(2, page_bitmap)
+    config = Config(**options)
+    with patch("sn2md.importers.note.read_notebook", wraps=read_notebook) as mock_read:
+        rendered = list(NotebookExtractor(config).render_pages(data, [1]))
+
+    mock_read.assert_called_once_with(data)
+    assert len(rendered) == 1
+    number, *images = rendered[0]
+    assert number == 1
+    assert [_has_background(Image.open(BytesIO(image))) for image in images] == backgrounds
+
+
+@pytest.mark.parametrize(
+    "options, expected",
+    [
+        ({}, "dir/llm/page.png"),
+        ({"llm_background": True}, "dir/page.png"),
+        ({"llm_background": True, "image_background": False}, "dir/page.png"),
+        ({"llm_background": True, "escalation_models": ["strong"]}, "dir/ink/page.png"),
+    ],
+)
+def test_get_ink_image(options, expected):
+    assert NotebookExtractor(Config(**options)).get_ink_image("dir/page.png") == expected
+
+
+def test_convert_pages_to_pngs_ink_image(tmp_path):
     mock_save_func = MagicMock()
-    visibility_overlay = {"default": MagicMock()}
-    result = convert_pages_to_pngs(mock_converter, 3, "fake_path", mock_save_func, visibility_overlay)
-    assert len(result) == 3
-    assert result[0] == "fake_path/fake_path_0.png"
-    assert result[1] == "fake_path/fake_path_1.png"
-    assert result[2] == "fake_path/fake_path_2.png"
-    mock_save_func.assert_called()
-
-def test_convert_notebook_to_pngs(mock_notebook):
-    with patch("sn2md.importers.note.ImageConverter") as MockImageConverter:
-        mock_converter_instance = MockImageConverter.return_value
-        mock_converter_instance.convert.return_value = MagicMock()
-        with patch("sn2md.importers.note.sn.converter.build_visibility_overlay") as mock_build_vo:
-            mock_build_vo.return_value = {"default": MagicMock()}
-            result = convert_notebook_to_pngs(mock_notebook, "fake_path")
-            assert len(result) == 3
-            assert result[0] == "fake_path/fake_path_0.png"
-            assert result[1] == "fake_path/fake_path_1.png"
-            assert result[2] == "fake_path/fake_path_2.png"
+    path = str(tmp_path)
+    config = Config(llm_background=True, escalation_models=["strong"])
+    convert_pages_to_pngs(_converter(1), 1, path, mock_save_func, config)
+
+    saved = {call.args[1]: call.args[0] for call in mock_save_func.call_args_list}
+    assert set(saved) == {f"{path}/{tmp_path.name}_0.png", f"{path}/ink/{tmp_path.name}_0.png"}
+    assert not _has_background(saved[f"{path}/ink/{tmp_path.name}_0.png"])
+    assert (tmp_path / "ink").is_dir()
+
+
+def test_count_pages():
+    assert NotebookExtractor().count_pages(make_note(3)) == 3
+
+
+def test_read_notebook():
+    data = make_note(3)
+    notebook = NotebookExtractor().read_notebook(data)
+    assert_same_notebook(notebook, sn.parser.load(BytesIO(data)))
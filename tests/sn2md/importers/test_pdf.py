@@ -2,6 +2,7 @@ import os
 import tempfile
 from unittest.mock import MagicMock, patch
 
+import pymupdf
 import pytest
 
 from sn2md.importers.pdf import PDFExtractor
@@ -37,8 +38,8 @@ def test_extract_images(mock_open, pdf_file, output_dir):
     mock_page2 = MagicMock()
     mock_page2.number = 1
     
-    mock_doc.__iter__.return_value = [mock_page1, mock_page2]
-    mock_open.return_value = mock_doc
+    mock_doc.load_page.side_effect = [mock_page1, mock_page2]
+    mock_open.return_value.__enter__.return_value = mock_doc
 
     # Mock pixmaps
     mock_pixmap1 = MagicMock()
@@ -59,6 +60,7 @@ def test_extract_images(mock_open, pdf_file, output_dir):
     
     # Verify mocks were called correctly
     mock_open.assert_called_once_with(pdf_file)
+    mock_open.return_value.__exit__.assert_called_once()
     mock_page1.get_pixmap.assert_called_once_with(dpi=150)
     mock_page2.get_pixmap.assert_called_once_with(dpi=150)
     mock_pixmap1.save.assert_called_once_with(f"{expected_base}_0.png")
@@ -68,3 +70,75 @@ def test_extract_images(mock_open, pdf_file, output_dir):
 def test_get_notebook():
     extractor = PDFExtractor()
     assert extractor.get_notebook("any_file.pdf") is None
+
+
+@patch('pymupdf.open')
+def test_extract_images_selected_pages(mock_open, pdf_file, output_dir):
+    extractor = PDFExtractor()
+
+    mock_doc = MagicMock()
+    mock_doc.page_count = 12
+    mock_open.return_value.__enter__.return_value = mock_doc
+
+    result = extractor.extract_images(pdf_file, output_dir, [3, 11, 40])
+
+    expected_base = os.path.join(output_dir, os.path.basename(output_dir))
+    assert result == [f"{expected_base}_03.png", f"{expected_base}_11.png"]
+    assert [c.args[0] for c in mock_doc.load_page.call_args_list] == [3, 11]
+
+
+def test_extract_images_in_windows(output_dir):
+    pdf_path = os.path.join(output_dir, "doc.pdf")
+    with pymupdf.open() as doc:
+        for number in range(5):
+            page = doc.new_page(width=200, height=100)
+            page.insert_text((20, 50), f"Page {number}")
+        doc.save(pdf_path)
+
+    image_dir = os.path.join(output_dir, "images")
+    os.makedirs(image_dir)
+    extractor = PDFExtractor(window=2)
+    result = extractor.extract_images(pdf_path, image_dir)
+
+    assert [os.path.basename(f) for f in result] == [f"images_{n}.png" for n in range(5)]
+    assert all(os.path.getsize(f) > 0 for f in result)
+    # one entry per window of two pages (the last window is partial):
+    assert len(extractor.rss) == 3
+    assert all(rss is not None and rss > 0 for rss in extractor.rss)
+
+
+def test_extract_images_memory_is_flat(output_dir):
+    pdf_path = os.path.join(output_dir, "doc.pdf")
+    with pymupdf.open() as doc:
+        for number in range(32):
+            page = doc.new_page()  # A4: about 6 MiB per pixmap at 150 DPI
+            page.insert_text((72, 72), f"Page {number}")
+        doc.save(pdf_path)
+
+    image_dir = os.path.join(output_dir, "images")
+    os.makedirs(image_dir)
+    extractor = PDFExtractor(window=8)
+    extractor.extract_images(pdf_path, image_dir)
+
+    if extractor.rss[0] is None:
+        pytest.skip("RSS is only measured on Linux")
+    # Memory doesn't grow with the number of pages rendered (keeping the 24
+    # pages after the first window would take over 100 MiB):
+    assert len(extractor.rss) == 4
+    assert max(extractor.rss) - extractor.rss[0] < 30
+
+
+def test_render_pages():
+    with pymupdf.open() as doc:
+        for number in range(3):
+            page = doc.new_page(width=200, height=100)
+            page.insert_text((20, 50), f"Page {number}")
+        data = doc.tobytes()
+
+    rendered = list(PDFExtractor(window=2).render_pages(data, [0, 2, 7]))
+
+    assert [number for number, *_ in rendered] == [0, 2]
+    for _, image, llm_image, ink_image in rendered:
+        assert image.startswith(b"\x89PNG")
+        assert llm_image == ink_image == image
+    assert PDFExtractor().count_pages(data) == 3
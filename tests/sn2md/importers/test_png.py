@@ -35,11 +35,33 @@ def test_extract_images(png_file, output_dir):
     assert result[0] == expected_output
     assert os.path.exists(expected_output)
     assert os.path.isfile(expected_output)
+    # The image is copied, so the output never shares the source's content:
+    assert not os.path.samefile(expected_output, filename)
+    with open(expected_output, "rb") as output, open(filename, "rb") as source:
+        assert output.read() == source.read()
 
     # Cleanup
     os.unlink(png_file)
 
 
+def test_extract_images_unselected(png_file, output_dir):
+    extractor = PNGExtractor()
+
+    assert extractor.extract_images(png_file, output_dir, [1, 2]) == []
+    assert extractor.extract_images(png_file, output_dir, [0]) == [
+        os.path.join(output_dir, os.path.basename(png_file))
+    ]
+
+    os.unlink(png_file)
+
+
 def test_get_notebook():
     extractor = PNGExtractor()
     assert extractor.get_notebook("any_file.png") is None
+
+
+def test_render_pages():
+    extractor = PNGExtractor()
+    assert list(extractor.render_pages(b"png")) == [(0, b"png", b"png", b"png")]
+    assert list(extractor.render_pages(b"png", [1])) == []
+    assert extractor.count_pages(b"png") == 1
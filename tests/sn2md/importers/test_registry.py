@@ -0,0 +1,41 @@
+from unittest.mock import patch
+
+from supernotelib.exceptions import DecoderException
+
+from sn2md.importers.registry import LazyExtractor, get_extractor
+from sn2md.types import Config
+
+
+def test_get_extractor_unsupported():
+    assert get_extractor("notes.txt", Config()) is None
+    assert get_extractor("notes", Config()) is None
+
+
+def test_get_extractor_is_lazy():
+    config = Config()
+    extractor = get_extractor("Notes.PDF", config)
+    assert isinstance(extractor, LazyExtractor)
+    assert extractor._extractor is None
+    assert extractor.errors == ()
+
+    assert extractor.extractor.__class__.__name__ == "PDFExtractor"
+    assert extractor.extractor.config is config
+    assert extractor.extractor is extractor.extractor
+
+
+def test_lazy_extractor_delegates():
+    extractor = get_extractor("test.note", Config(llm_background=False))
+    with patch("sn2md.importers.note.load_notebook") as mock_load:
+        assert extractor.get_notebook("test.note") is mock_load.return_value
+    assert extractor.get_llm_image("/out/page.png") == "/out/llm/page.png"
+    assert extractor.errors == (DecoderException,)
+
+
+def test_lazy_extractor_extract_images(tmp_path):
+    source = tmp_path / "image.png"
+    source.write_bytes(b"png")
+    output = tmp_path / "out"
+    output.mkdir()
+
+    extractor = get_extractor(str(source), Config())
+    assert extractor.extract_images(str(source), str(output)) == [str(output / "image.png")]
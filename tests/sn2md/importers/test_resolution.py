@@ -0,0 +1,85 @@
+import io
+
+import pymupdf
+import pytest
+from PIL import Image, ImageDraw
+
+from sn2md.importers.resolution import (
+    clamp_dpi,
+    ink_density,
+    note_page_scale,
+    pdf_page_dpi,
+    scale_note_page,
+)
+from sn2md.types import Config
+
+
+@pytest.fixture
+def config():
+    return Config(adaptive_resolution=True)
+
+
+def test_clamp_dpi(config):
+    # A5 page (in points):
+    assert clamp_dpi(10, 420, 595, config) == config.min_dpi
+    assert clamp_dpi(150, 420, 595, config) == 150
+    # 300 dpi would exceed max_pixels:
+    assert clamp_dpi(300, 420, 595, config) == 203
+
+
+def test_pdf_page_dpi_not_adaptive():
+    with pymupdf.open() as doc:
+        page = doc.new_page()
+        assert pdf_page_dpi(page, Config(dpi=120)) == 120
+
+
+@pytest.mark.parametrize("fontsize, expected", [(6, 203), (8, 157), (11, 114), (40, 72)])
+def test_pdf_page_dpi_text(config, fontsize, expected):
+    with pymupdf.open() as doc:
+        page = doc.new_page(width=420, height=595)
+        page.insert_text((20, 100), "some words on the page", fontsize=fontsize)
+        assert pdf_page_dpi(page, config) == expected
+
+
+def test_pdf_page_dpi_scanned(config):
+    image = Image.new("RGB", (420, 595), "white")
+    stream = io.BytesIO()
+    image.save(stream, format="PNG")
+    with pymupdf.open() as doc:
+        page = doc.new_page(width=420, height=595)
+        page.insert_image(page.rect, stream=stream.getvalue())
+        # a 72 dpi scan isn't upscaled to the default dpi:
+        assert pdf_page_dpi(page, config) == 72
+
+
+def test_pdf_page_dpi_blank(config):
+    with pymupdf.open() as doc:
+        page = doc.new_page(width=420, height=595)
+        assert pdf_page_dpi(page, config) == config.dpi
+
+
+def _page(ink_rows: int) -> Image.Image:
+    image = Image.new("L", (1404, 1872), 255)
+    draw = ImageDraw.Draw(image)
+    for row in range(ink_rows):
+        draw.line((100, 100 + row * 10, 1300, 100 + row * 10), fill=0, width=4)
+    return image
+
+
+def test_ink_density():
+    assert ink_density(_page(0)) == 0
+    assert 0 < ink_density(_page(10)) < ink_density(_page(100))
+
+
+def test_note_page_scale(config):
+    assert note_page_scale(_page(10), Config()) == 1.0
+    # sparse:
+    assert note_page_scale(_page(10), config) == 0.75
+    # dense, but larger than max_pixels:
+    assert note_page_scale(_page(150), config) == pytest.approx(0.872, abs=0.001)
+
+
+def test_scale_note_page(config):
+    dense = _page(150)
+    assert scale_note_page(dense, Config()) is dense
+    assert scale_note_page(_page(10), config).size == (1053, 1404)
@@ -1,10 +1,32 @@
+from io import BytesIO
 from pathlib import Path
 from unittest.mock import patch
 
 from PIL import Image
 
-from sn2md.ai_utils import image_to_markdown, image_to_text, _image_to_bytes, convert_image
-from llm import Attachment
+import pytest
+
+from sn2md.ai_utils import (
+    bands_to_markdown,
+    image_to_markdown,
+    image_to_text,
+    images_to_markdown,
+    split_pages,
+    _image_to_bytes,
+    convert_image,
+    get_model,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_model_cache():
+    get_model.cache_clear()
+    yield
+    get_model.cache_clear()
+import llm
+from llm import Attachment, Usage
+
+from sn2md.stats import RunStats
 
 
 @patch("sn2md.ai_utils.llm.get_model")
@@ -17,15 +39,90 @@ def test_convert_image(get_model_mock):
     assert convert_image("text", "dummy_attachment", "dummy_key", "dummy_model") == "dummy_result"
 
 
+@patch("sn2md.ai_utils.llm.get_model")
+def test_get_model_is_cached(get_model_mock):
+    model = get_model("dummy_model", "dummy_key")
+    assert get_model("dummy_model", "dummy_key") is model
+    get_model_mock.assert_called_once_with("dummy_model")
+    assert model.key == "dummy_key"
+
+
+@patch("sn2md.ai_utils.llm.get_model")
+def test_convert_image_streaming(get_model_mock):
+    get_model_mock.return_value.prompt.return_value.__iter__.return_value = iter(["one ", "two"])
+    chunks = []
+
+    assert convert_image("text", "dummy_attachment", None, "dummy_model", chunks.append) == "one two"
+    assert chunks == ["one ", "two"]
+
+
+@patch("sn2md.ai_utils.llm.get_model")
+def test_convert_image_system_prompt_and_usage(get_model_mock):
+    response = get_model_mock.return_value.prompt.return_value
+    response.text.return_value = "dummy_result"
+    response.usage.return_value = Usage(
+        input=1500, output=20, details={"prompt_tokens_details": {"cached_tokens": 1024}}
+    )
+    stats = RunStats()
+
+    result = convert_image(
+        "text", "dummy_attachment", None, "dummy_model", system="system", on_usage=stats.add_usage
+    )
+
+    assert result == "dummy_result"
+    get_model_mock.return_value.prompt.assert_called_once_with(
+        "text", attachments=["dummy_attachment"], system="system"
+    )
+    assert (stats.input_tokens, stats.output_tokens, stats.cached_tokens) == (1500, 20, 1024)
+
+
+@patch("sn2md.ai_utils.llm.get_model")
+def test_convert_image_cache_option(get_model_mock):
+    class Options(llm.Options):
+        cache: bool | None = None
+
+    get_model_mock.return_value.Options = Options
+    convert_image("text", "dummy_attachment", None, "dummy_model", system="system")
+    get_model_mock.return_value.prompt.assert_called_once_with(
+        "text", attachments=["dummy_attachment"], system="system", cache=True
+    )
+
+
 @patch("sn2md.ai_utils.convert_image")
 def test_image_to_markdown(convert_mock):
     convert_mock.return_value = "dummy_result"
     result = image_to_markdown("dummy_path", "dummy_context", "dummy_key", "dummy_model", "some prompt: {context}")
     image = Attachment(path="dummy_path")
-    convert_mock.assert_called_once_with("some prompt: dummy_context", image, "dummy_key", "dummy_model")
+    convert_mock.assert_called_once_with(
+        "some prompt: dummy_context",
+        image,
+        "dummy_key",
+        "dummy_model",
+        None,
+        None,
+        system=None,
+        on_usage=None,
+        timeout=None,
+        deadline=None,
+    )
     assert result == "dummy_result"
 
 
+@patch("sn2md.ai_utils.convert_image")
+def test_image_to_markdown_cropped(convert_mock, tmp_path):
+    image_path = tmp_path / "page.png"
+    image = Image.new("L", (200, 300), 255)
+    image.paste(0, (50, 100, 80, 150))
+    image.save(image_path)
+
+    image_to_markdown(str(image_path), "", "dummy_key", "dummy_model", "{context}", 10)
+
+    attachment = convert_mock.call_args[0][1]
+    assert Image.open(BytesIO(attachment.content)).size == (50, 70)
+    # the page image itself isn't modified:
+    assert Image.open(image_path).size == (200, 300)
+
+
 @patch("sn2md.ai_utils.convert_image")
 def test_image_to_text(convert_mock):
     image_path = Path(__file__).parent / "fixtures/ponder.png"
@@ -35,6 +132,82 @@ def test_image_to_text(convert_mock):
         "dummy_prompt",
         Attachment(content=_image_to_bytes(image)),
         "dummy_key",
-        "dummy_model"
+        "dummy_model",
+        policy=None,
+        timeout=None,
+        deadline=None,
+        kind="title",
     )
     assert result == convert_mock.return_value
+
+
+@pytest.mark.parametrize(
+    "text, count, expected",
+    [
+        ("<!-- page 1 -->\n# One\n<!-- page 2 -->\nTwo\n", 2, ["# One", "Two"]),
+        ("<!-- page 1 -->\n\n<!-- page 2 -->\nTwo", 2, ["", "Two"]),
+        ("<!-- page 1 -->\nOne", 2, None),
+        ("<!-- page 2 -->\nTwo\n<!-- page 1 -->\nOne", 2, None),
+        ("Sure! Here you go:\n<!-- page 1 -->\nOne", 1, None),
+        ("No delimiters", 2, None),
+    ],
+)
+def test_split_pages(text, count, expected):
+    assert split_pages(text, count) == expected
+
+
+@patch("sn2md.ai_utils.convert_images")
+def test_images_to_markdown(convert_mock):
+    convert_mock.return_value = "<!-- page 1 -->\none\n<!-- page 2 -->\ntwo"
+    result = images_to_markdown(["a.png", "b.png"], "ctx", "dummy_key", "dummy_model", "prompt: {context}")
+
+    assert result == ["one", "two"]
+    text, attachments, api_key, model, on_chunk, policy = convert_mock.call_args[0]
+    assert text.startswith("prompt: ctx\n")
+    assert "The 2 images are consecutive pages" in text
+    assert attachments == [Attachment(path="a.png"), Attachment(path="b.png")]
+
+
+@patch("sn2md.ai_utils.convert_image")
+def test_image_to_markdown_bytes(convert_mock):
+    image = Image.new("L", (200, 300), 255)
+    image.paste(0, (50, 100, 80, 150))
+    data = _image_to_bytes(image)
+
+    image_to_markdown(data, "", "dummy_key", "dummy_model", "{context}")
+    assert convert_mock.call_args[0][1] == Attachment(content=data)
+
+    image_to_markdown(data, "", "dummy_key", "dummy_model", "{context}", 10)
+    attachment = convert_mock.call_args[0][1]
+    assert Image.open(BytesIO(attachment.content)).size == (50, 70)
+
+
+@patch("sn2md.ai_utils.convert_image")
+def test_bands_to_markdown(convert_mock):
+    image = Image.new("L", (100, 300), 255)
+    data = _image_to_bytes(image)
+
+    def convert(text, attachment, api_key, model, on_chunk=None, policy=None, on_usage=None, **kwargs):
+        number = text.split("band ")[1][0]
+        on_usage(Usage(input=10, output=5))
+        return f"line {number}\nshared" if number != "3" else "shared\nlast"
+
+    convert_mock.side_effect = convert
+    chunks = []
+    stats = RunStats()
+    result = bands_to_markdown(
+        data, "ctx", "key", "model", "prompt: {context}", 3, 0.1, None, chunks.append, on_usage=stats.add_usage
+    )
+
+    assert result == "line 1\nshared\nline 2\nshared\nlast"
+    # The merged markdown is passed on in one chunk, and all the usage is reported:
+    assert chunks == [result]
+    assert (stats.input_tokens, stats.output_tokens) == (30, 15)
+
+    texts = {call[0][0].split("band ")[1][0]: call[0][0] for call in convert_mock.call_args_list}
+    assert texts["1"].startswith("prompt: ctx\n")
+    assert "band 1 of the 3 horizontal bands" in texts["1"]
+    # Only the first band has the context of the previous page:
+    assert texts["2"].startswith("prompt: \n")
+    heights = [Image.open(BytesIO(call[0][1].content)).size[1] for call in convert_mock.call_args_list]
+    assert sorted(heights) == [105, 105, 110]
@@ -0,0 +1,120 @@
+import io
+import os
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pymupdf
+import pytest
+
+from sn2md.api import Page, convert, iter_pages
+from sn2md.stats import RunStats
+from sn2md.types import Config
+
+PNG = Path(__file__).parent / "fixtures/ponder.png"
+
+
+def fake_image_to_markdown(page, context, api_key, model, *args, **kwargs):
+    # The page is sent to the model from memory:
+    assert isinstance(page, bytes)
+    return f"markdown of {len(page)} bytes"
+
+
+@pytest.fixture
+def pdf_bytes():
+    with pymupdf.open() as doc:
+        for number in range(3):
+            page = doc.new_page(width=200, height=100)
+            page.insert_text((20, 50), f"Page {number}")
+        return doc.tobytes()
+
+
+def test_convert_bytes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data = PNG.read_bytes()
+    with patch("sn2md.ai_utils.image_to_markdown", side_effect=fake_image_to_markdown):
+        result = convert(data, Config(model="mini"), file_type="png")
+
+    assert len(result.pages) == 1
+    page = result.pages[0]
+    assert (page.number, page.image, page.model) == (0, data, "mini")
+    assert page.markdown == f"markdown of {len(data)} bytes"
+    assert result.markdown == "\n" + page.markdown
+    assert (result.links, result.keywords, result.titles) == ([], [], [])
+    assert result.stats.page_models == {0: "mini"}
+    assert result.duration >= page.elapsed >= 0
+    # Nothing is written to disk:
+    assert os.listdir(tmp_path) == []
+
+
+def test_convert_path_and_file_object():
+    with patch("sn2md.ai_utils.image_to_markdown", side_effect=fake_image_to_markdown):
+        from_path = convert(PNG)
+        with open(PNG, "rb") as f:
+            from_file = convert(f)
+        from_stream = convert(io.BytesIO(PNG.read_bytes()), file_type=".PNG")
+
+    assert from_path.markdown == from_file.markdown == from_stream.markdown
+
+
+def test_convert_requires_file_type():
+    with pytest.raises(ValueError, match="file_type is required"):
+        convert(b"data")
+    with pytest.raises(ValueError, match="Unsupported file type: .txt"):
+        convert(b"data", file_type="txt")
+
+
+def test_iter_pages(pdf_bytes):
+    stats = RunStats()
+    with patch("sn2md.ai_utils.image_to_markdown", side_effect=fake_image_to_markdown) as mock:
+        pages = iter_pages(pdf_bytes, Config(), file_type=".pdf", pages=[1, 2], stats=stats)
+        first = next(pages)
+        # Pages are converted as they are consumed:
+        assert mock.call_count == 1
+        rest = list(pages)
+
+    assert isinstance(first, Page)
+    assert [page.number for page in [first, *rest]] == [1, 2]
+    assert first.image.startswith(b"\x89PNG")
+    assert stats.page_models == {1: "gpt-4o-mini", 2: "gpt-4o-mini"}
+
+
+def test_iter_pages_renders_lazily():
+    rendered = []
+
+    def render_pages(data, pages=None):
+        for number in range(3):
+            rendered.append(number)
+            yield number, f"image{number}".encode(), f"llm{number}".encode(), b"ink"
+
+    with (
+        patch("sn2md.importers.png.PNGExtractor.render_pages", side_effect=render_pages),
+        patch("sn2md.ai_utils.image_to_markdown", side_effect=fake_image_to_markdown),
+    ):
+        pages = iter_pages(b"png", file_type="png")
+        first = next(pages)
+        # Later pages aren't rendered before the first is converted:
+        assert rendered == [0]
+        rest = list(pages)
+
+    assert [page.image for page in [first, *rest]] == [b"image0", b"image1", b"image2"]
+
+
+def test_convert_notebook():
+    notebook = MagicMock()
+    context = {"links": ["link"], "keywords": ["keyword"], "titles": ["title"]}
+    with (
+        patch("sn2md.importers.note.NotebookExtractor.render_pages", return_value=iter([])),
+        patch("sn2md.importers.note.NotebookExtractor.read_notebook", return_value=notebook),
+        patch("sn2md.api.create_notebook_context", return_value=context) as mock_context,
+    ):
+        result = convert(b"note", file_type=".note", model="large")
+
+    mock_context.assert_called_once()
+    assert mock_context.call_args[0][0] is notebook
+    assert mock_context.call_args[0][2] == "large"
+    assert (result.pages, result.links, result.keywords, result.titles) == (
+        [],
+        ["link"],
+        ["keyword"],
+        ["title"],
+    )
@@ -0,0 +1,148 @@
+import io
+import os
+import tarfile
+import zipfile
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+import yaml
+
+from sn2md.archives import ArchiveMember, MemberExtractor, is_archive, iter_members, selected
+from sn2md.importer import import_supernote_directory_core
+from sn2md.types import Config
+
+PNG = (Path(__file__).parent / "fixtures/ponder.png").read_bytes()
+
+MEMBERS = {
+    "notes/a.png": PNG,
+    "notes/b.png": PNG + b"\0",
+    "trash/c.png": PNG,
+    "notes/readme.txt": b"text",
+}
+
+
+def make_zip(path, members, date_time=(2024, 7, 12, 15, 11, 48)):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, data in members.items():
+            archive.writestr(zipfile.ZipInfo(name, date_time), data)
+    return str(path)
+
+
+def make_tar(path, members, mtime=1_720_000_000):
+    with tarfile.open(path, "w:gz") as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo("./" + name)
+            info.size = len(data)
+            info.mtime = mtime
+            archive.addfile(info, io.BytesIO(data))
+    return str(path)
+
+
+@pytest.mark.parametrize("make, suffix", [(make_zip, ".zip"), (make_tar, ".tar.gz")])
+def test_iter_members(tmp_path, make, suffix):
+    archive = make(tmp_path / f"backup{suffix}", MEMBERS)
+    assert is_archive(archive)
+
+    members = []
+    for member in iter_members(archive, exclude=["trash/"]):
+        # Tar members must be read before moving on to the next one:
+        members.append((member.name, member.size, member.data))
+        assert member.path == os.path.join(archive, "notes", os.path.basename(member.name))
+        assert member.mtime_ns > 0
+
+    assert members == [
+        ("notes/a.png", len(PNG), PNG),
+        ("notes/b.png", len(PNG) + 1, PNG + b"\0"),
+    ]
+
+
+def test_is_archive(tmp_path):
+    (tmp_path / "notes.note").write_bytes(b"")
+    assert not is_archive(str(tmp_path / "notes.note"))
+    assert not is_archive(str(tmp_path / "missing.zip"))
+    assert not is_archive(str(tmp_path))
+
+
+def test_selected():
+    assert selected("a/b.note", [], [])
+    assert not selected("a/b.txt", [], [])
+    assert not selected("a/b.note", [], ["a/"])
+    assert not selected("a/b.note", [], ["*.note"])
+    assert selected("a/b.note", ["a/*"], [])
+    assert not selected("c/b.note", ["a/*"], [])
+
+
+def test_member_is_read_once():
+    read = MagicMock(return_value=b"data")
+    member = ArchiveMember("backup.zip", "a.note", 4, 0, read)
+    assert member.data == b"data"
+    assert member.hash == "a17c9aaa61e80a1bf71d0d850af4e5baa9800bbd"
+    read.assert_called_once()
+
+
+def test_member_extractor(tmp_path):
+    extractor = MagicMock()
+    extractor.render_pages.return_value = iter(
+        [
+            (0, b"page", b"page", b"ink"),
+            (9, b"page", b"llm", b"llm"),
+        ]
+    )
+    extractor.count_pages.return_value = 12
+    member = ArchiveMember("backup.zip", "a.note", 4, 0, lambda: b"note")
+    member_extractor = MemberExtractor(extractor, member)
+
+    pngs = member_extractor.extract_images("backup.zip/a.note", str(tmp_path), [0, 9])
+
+    extractor.render_pages.assert_called_once_with(b"note", [0, 9])
+    name = tmp_path.name
+    assert pngs == [str(tmp_path / f"{name}_00.png"), str(tmp_path / f"{name}_09.png")]
+    assert member_extractor.get_llm_image(pngs[0]) == pngs[0]
+    assert member_extractor.get_llm_image(pngs[1]) == str(tmp_path / "llm" / f"{name}_09.png")
+    assert Path(member_extractor.get_llm_image(pngs[1])).read_bytes() == b"llm"
+    assert member_extractor.get_ink_image(pngs[0]) == str(tmp_path / "ink" / f"{name}_00.png")
+    assert Path(member_extractor.get_ink_image(pngs[0])).read_bytes() == b"ink"
+    # The LLM image is used when it is the image to measure ink on:
+    assert member_extractor.get_ink_image(pngs[1]) == member_extractor.get_llm_image(pngs[1])
+    assert not (tmp_path / "ink" / f"{name}_09.png").exists()
+    assert member_extractor.get_notebook("a.note") is extractor.read_notebook.return_value
+    extractor.read_notebook.assert_called_once_with(b"note")
+    assert member_extractor.render_pages(b"data", [1]) is extractor.render_pages.return_value
+    extractor.render_pages.assert_called_with(b"data", [1])
+    assert member_extractor.count_pages(b"data") == 12
+
+
+def test_member_extractor_pads_by_page_count(tmp_path):
+    extractor = MagicMock()
+    extractor.render_pages.return_value = iter([(2, b"page", b"page", b"page")])
+    extractor.count_pages.return_value = 12
+    member = ArchiveMember("backup.zip", "doc.pdf", 4, 0, lambda: b"pdf")
+
+    pngs = MemberExtractor(extractor, member).extract_images("backup.zip/doc.pdf", str(tmp_path), [2])
+
+    # Padded like the images of a conversion of all 12 pages:
+    assert pngs == [str(tmp_path / f"{tmp_path.name}_02.png")]
+
+
+@pytest.mark.parametrize("make, suffix", [(make_zip, ".zip"), (make_tar, ".tar.gz")])
+def test_import_archive(tmp_path, make, suffix):
+    archive = make(tmp_path / f"backup{suffix}", MEMBERS)
+    output = str(tmp_path / "output")
+    config = Config(exclude=["trash/"], template="{{llm_output}}")
+
+    with patch("sn2md.ai_utils.image_to_markdown", return_value="markdown") as mock_convert:
+        import_supernote_directory_core(archive, output, config)
+        assert mock_convert.call_count == 2
+
+        with open(os.path.join(output, "a", ".sn2md.metadata.yaml")) as f:
+            metadata = yaml.safe_load(f)
+        assert metadata["input_file"] == os.path.join(archive, "notes", "a.png")
+        assert os.path.exists(os.path.join(output, "a", "a.md"))
+        assert any(name.endswith("_0.png") for name in os.listdir(os.path.join(output, "a")))
+
+        # Unchanged members are skipped, changed ones are converted again:
+        mock_convert.reset_mock()
+        make(archive, {**MEMBERS, "notes/b.png": PNG + b"\0\0"})
+        import_supernote_directory_core(archive, output, config)
+        assert mock_convert.call_count == 1
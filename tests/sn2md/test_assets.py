@@ -0,0 +1,90 @@
+import errno
+import os
+from unittest.mock import patch
+
+import pytest
+
+from sn2md.assets import asset_path, link_file, move_file, store_asset
+
+
+def write(path, content: str) -> str:
+    with open(path, "w") as f:
+        _ = f.write(content)
+    return str(path)
+
+
+def read(path) -> str:
+    with open(path) as f:
+        return f.read()
+
+
+def test_move_file(tmp_path):
+    src, dst = write(tmp_path / "src", "content"), str(tmp_path / "dst")
+    move_file(src, dst)
+    assert not os.path.exists(src)
+    assert read(dst) == "content"
+
+
+def test_move_file_across_filesystems(tmp_path):
+    src, dst = write(tmp_path / "src", "content"), write(tmp_path / "dst", "old")
+    with patch("os.rename", side_effect=OSError(errno.EXDEV, "Invalid cross-device link")):
+        move_file(src, dst)
+    assert not os.path.exists(src)
+    assert read(dst) == "content"
+    assert not os.path.exists(dst + ".tmp")
+
+
+def test_move_file_errors(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        move_file(str(tmp_path / "missing"), str(tmp_path / "dst"))
+
+
+def test_link_file(tmp_path):
+    src, dst = write(tmp_path / "src", "content"), write(tmp_path / "dst", "old")
+    link_file(src, dst)
+    assert os.path.samefile(src, dst)
+    assert not os.path.exists(dst + ".tmp")
+
+    # Linking a file to itself leaves it alone:
+    link_file(src, dst)
+    assert os.path.samefile(src, dst)
+
+
+def test_link_file_copies_without_links(tmp_path):
+    src, dst = write(tmp_path / "src", "content"), str(tmp_path / "dst")
+    with patch("os.link", side_effect=OSError(errno.EXDEV, "Invalid cross-device link")):
+        link_file(src, dst)
+    assert read(dst) == "content"
+    assert not os.path.samefile(src, dst)
+
+
+def test_store_asset(tmp_path):
+    store = str(tmp_path / "store")
+    first = write(tmp_path / "first.png", "page")
+    second = write(tmp_path / "second.png", "page")
+    other = write(tmp_path / "other.png", "other page")
+
+    stored = store_asset(first, store)
+    assert store_asset(second, store) == stored
+    assert store_asset(other, store) != stored
+    assert stored.endswith(".png")
+    assert read(stored) == "page"
+    assert not os.path.exists(first) and not os.path.exists(second)
+
+    # Storing a file that is already a link to the stored file keeps it:
+    link_file(stored, first)
+    assert store_asset(first, store) == stored
+    assert os.path.samefile(first, stored)
+
+
+def test_asset_path():
+    assert asset_path("store", "abcdef", ".png") == os.path.join("store", "ab", "abcdef.png")
+
+
+def test_store_asset_with_digest(tmp_path):
+    store = str(tmp_path / "store")
+    page = write(tmp_path / "page.png", "page")
+    with patch("sn2md.assets.compute_hash") as mock_hash:
+        stored = store_asset(page, store, "abcdef")
+    mock_hash.assert_not_called()
+    assert stored == asset_path(store, "abcdef", ".png")
@@ -0,0 +1,107 @@
+import pytest
+from llm import Usage
+from PIL import Image, ImageDraw
+
+from sn2md.cascade import (
+    escalation_reason,
+    malformed_latex,
+    malformed_mermaid,
+    text_per_ink,
+)
+from sn2md.stats import RunStats, cached_tokens
+
+
+@pytest.fixture
+def page(tmp_path):
+    # A 100x100 page, 10% covered in ink:
+    image = Image.new("L", (100, 100), 255)
+    ImageDraw.Draw(image).rectangle((0, 0, 9, 99), fill=0)
+    path = str(tmp_path / "page.png")
+    image.save(path)
+    return path
+
+
+@pytest.fixture
+def blank_page(tmp_path):
+    path = str(tmp_path / "blank.png")
+    Image.new("L", (100, 100), 255).save(path)
+    return path
+
+
+@pytest.mark.parametrize(
+    "markdown, expected",
+    [
+        ("$x$ and $$y$$", False),
+        ("costs \\$5", False),
+        ("$x", True),
+        ("$$x$", True),
+        ("\\begin{align} x \\end{align}", False),
+        ("\\begin{align} x", True),
+        ("\\begin{a} \\begin{b} \\end{a} \\end{b}", True),
+        ("```\n$\n```", False),
+    ],
+)
+def test_malformed_latex(markdown, expected):
+    assert malformed_latex(markdown) == expected
+
+
+@pytest.mark.parametrize(
+    "markdown, expected",
+    [
+        ("```mermaid\ngraph TD\n  A --> B\n```", False),
+        ("```mermaid\n%% a comment\nsequenceDiagram\n  A->>B: hi\n```", False),
+        ("```mermaid\nA --> B\n```", True),
+        ("```mermaid\n```", True),
+        ("```mermaid\ngraph TD\n", True),
+        ("```python\nprint()\n```", False),
+    ],
+)
+def test_malformed_mermaid(markdown, expected):
+    assert malformed_mermaid(markdown) == expected
+
+
+def test_text_per_ink(page, blank_page):
+    assert text_per_ink("x" * 50, page) == pytest.approx(5)
+    assert text_per_ink("x", blank_page) is None
+    # Pages held in memory:
+    with open(page, "rb") as f:
+        assert text_per_ink("x" * 50, f.read()) == pytest.approx(5)
+
+
+@pytest.mark.parametrize(
+    "markdown, expected",
+    [
+        ("a" * 300, None),
+        ("  \n", "empty"),
+        ("I'm sorry, I can't help with that." + "a" * 300, "refusal"),
+        ("$x" + "a" * 300, "latex"),
+        ("```mermaid\nA --> B\n```" + "a" * 300, "mermaid"),
+        ("a" * 100, "text per ink"),
+    ],
+)
+def test_escalation_reason(page, markdown, expected):
+    assert escalation_reason(markdown, page, 20) == expected
+
+
+def test_escalation_reason_blank_page(blank_page):
+    assert escalation_reason("", blank_page, 20) is None
+
+
+def test_run_stats_summary():
+    assert RunStats().summary() == "no pages converted"
+    stats = RunStats(page_models={0: "mini", 1: "mini", 2: "large"})
+    stats.escalations["empty"] += 1
+    assert stats.summary() == "1 pages with large; 2 pages with mini; escalated: empty (1)"
+
+
+def test_run_stats_usage():
+    stats = RunStats(page_models={0: "mini", 1: "mini"})
+    stats.add_usage(Usage(input=1500, output=20, details={"prompt_tokens_details": {"cached_tokens": 1024}}))
+    stats.add_usage(Usage(input=1500, output=30, details={"cache_read_input_tokens": 1200}))
+    stats.add_usage(Usage(input=None, output=None))
+    assert stats.summary() == "2 pages with mini; tokens: 3000 in (2224 cached), 50 out"
+
+
+def test_cached_tokens():
+    assert cached_tokens(None) == 0
+    assert cached_tokens({"cachedContentTokenCount": 7, "reasoning_tokens": 3}) == 7
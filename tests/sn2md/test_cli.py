@@ -1,4 +1,7 @@
 import logging
+import os
+import urllib.error
+import zipfile
 from pathlib import Path
 from unittest.mock import patch
 
@@ -6,7 +9,15 @@ import pytest
 from click.testing import CliRunner
 
 from sn2md.cli import cli, get_config, logger, setup_logging
-from sn2md.types import DEFAULT_MD_TEMPLATE, TO_MARKDOWN_TEMPLATE, TO_TEXT_TEMPLATE
+from sn2md.deadlines import DeadlineExceeded
+from sn2md.server import Job
+from sn2md.types import (
+    DEFAULT_MD_TEMPLATE,
+    TO_MARKDOWN_SYSTEM_PROMPT,
+    TO_MARKDOWN_TEMPLATE,
+    TO_TEXT_TEMPLATE,
+    Config,
+)
 
 
 @pytest.mark.parametrize("level", ["DEBUG", "INFO", "WARNING"])
@@ -18,6 +29,7 @@ def test_setup_logging_sets_debug_level(level):
 def test_get_config():
     config = get_config("no-file")
     assert config.prompt == TO_MARKDOWN_TEMPLATE
+    assert config.system_prompt == TO_MARKDOWN_SYSTEM_PROMPT
     assert config.title_prompt == TO_TEXT_TEMPLATE
     assert config.template == DEFAULT_MD_TEMPLATE
     assert config.model == "gpt-4o-mini"
@@ -36,12 +48,19 @@ def test_get_config():
 def test_get_config_from_file(path, api_key):
     config = get_config(path)
     assert config.prompt == "custom-prompt"
+    # A custom prompt holds its own instructions:
+    assert config.system_prompt == ""
     assert config.title_prompt == TO_TEXT_TEMPLATE
     assert config.template == "custom-template"
     assert config.model == "gemini-1.5-pro-latest"
     assert config.api_key == api_key
 
 
+def test_config_system_prompt():
+    assert Config(prompt="custom", system_prompt="system").system_prompt == "system"
+    assert Config(system_prompt="").system_prompt == ""
+
+
 @pytest.mark.parametrize("extractor, output", [
   ("NotebookExtractor", "test.note"),
   ("PDFExtractor", "test.pdf"),
@@ -53,7 +72,7 @@ def test_import_supernote_file(extractor, output):
         result = cli_runner.invoke(cli, ["file", output])
         assert result.exit_code == 0
         mock_import_file.assert_called_once()
-        assert mock_import_file.call_args[0][0].__class__.__name__ == extractor
+        assert mock_import_file.call_args[0][0].extractor.__class__.__name__ == extractor
         assert mock_import_file.call_args[0][1] == output
 
 
@@ -71,3 +90,156 @@ def test_import_supernote_file_error():
         result = cli_runner.invoke(cli, ["file", "test.note"])
         assert result.exit_code == 1
         assert "Test error" in result.output
+
+
+def test_import_supernote_file_timeout():
+    cli_runner = CliRunner()
+    with patch("sn2md.cli.import_supernote_file_core") as mock_import_file:
+        mock_import_file.side_effect = DeadlineExceeded("Deadline exceeded")
+        result = cli_runner.invoke(cli, ["file", "test.note"])
+        assert result.exit_code == 1
+        assert isinstance(result.exception, SystemExit)
+        assert "Stopped converting test.note (Deadline exceeded)" in result.output
+        assert "kept for the next run" in result.output
+
+
+@pytest.mark.parametrize(
+    "pages, expected",
+    [
+        ("10-12,42", [9, 10, 11, 41]),
+        ("3,1-2", [0, 1, 2]),
+        ("5", [4]),
+    ],
+)
+def test_import_supernote_file_pages(pages, expected):
+    cli_runner = CliRunner()
+    with patch("sn2md.cli.import_supernote_file_core") as mock_import_file:
+        result = cli_runner.invoke(cli, ["file", "--pages", pages, "test.pdf"])
+        assert result.exit_code == 0
+        assert mock_import_file.call_args.kwargs["pages"] == expected
+
+
+@pytest.mark.parametrize("pages", ["0", "5-2", "a-b", ""])
+def test_import_supernote_file_invalid_pages(pages):
+    cli_runner = CliRunner()
+    result = cli_runner.invoke(cli, ["file", "--pages", pages, "test.pdf"])
+    assert result.exit_code == 2
+    assert "Invalid page selection" in result.output
+
+
+def test_import_supernote_file_server():
+    cli_runner = CliRunner()
+    with patch("sn2md.server.submit_job") as mock_submit, patch(
+        "sn2md.cli.import_supernote_file_core"
+    ) as mock_import_file, patch("sn2md.server.read_token", return_value="file token"):
+        mock_submit.return_value = Job(
+            path="/tmp/test.note", output="/tmp/out", status="done", output_file="/tmp/out/test/test.md"
+        )
+        result = cli_runner.invoke(
+            cli, ["--server", "http://localhost:8765", "-o", "/tmp/out", "file", "--pages", "2", "test.note"]
+        )
+        assert result.exit_code == 0
+        assert "/tmp/out/test/test.md" in result.output
+        mock_import_file.assert_not_called()
+
+        server_url, job = mock_submit.call_args[0]
+        assert server_url == "http://localhost:8765"
+        assert os.path.isabs(job.path) and job.path.endswith("test.note")
+        assert job.output == "/tmp/out"
+        assert not job.directory
+        assert job.pages == [1]
+        # Without --server-token, the token is read from the token file:
+        assert mock_submit.call_args[1]["token"] == "file token"
+
+
+def test_import_supernote_directory_server_failed():
+    cli_runner = CliRunner()
+    with patch("sn2md.server.submit_job") as mock_submit:
+        mock_submit.return_value = Job(path="/d", output="/o", directory=True, status="failed", error="Boom")
+        result = cli_runner.invoke(cli, ["--server", "http://localhost:8765", "directory", "."])
+        assert result.exit_code == 1
+        assert "Boom" in result.output
+        assert mock_submit.call_args[0][1].directory
+
+
+def test_import_supernote_directory_server_config(tmp_path):
+    config_file = tmp_path / "sn2md.toml"
+    config_file.write_text('include = ["*.note"]\nexclude = ["archive/"]\nmodel = "other"\n')
+    cli_runner = CliRunner()
+    with patch("sn2md.server.submit_job") as mock_submit:
+        mock_submit.return_value = Job(path="/d", output="/o", directory=True, status="done")
+        result = cli_runner.invoke(
+            cli,
+            ["-c", str(config_file), "--server", "http://localhost:8765", "directory", "-x", ".git/", "."],
+        )
+        assert result.exit_code == 0
+        job = mock_submit.call_args[0][1]
+        # The globs of the config are sent with the job, the rest is left to
+        # the server's config:
+        assert job.include == ["*.note"]
+        assert job.exclude == ["archive/", ".git/"]
+        assert job.model is None
+        assert "the server converts with its own configuration" in result.output
+
+
+def test_import_supernote_server_token():
+    cli_runner = CliRunner()
+    with patch("sn2md.server.submit_job") as mock_submit:
+        mock_submit.return_value = Job(path="/d", output="/o", status="done")
+        result = cli_runner.invoke(
+            cli, ["--server", "http://localhost:8765", "--server-token", "secret", "file", "test.note"]
+        )
+        assert result.exit_code == 0
+        assert mock_submit.call_args[1]["token"] == "secret"
+
+
+def test_import_supernote_file_server_unreachable():
+    cli_runner = CliRunner()
+    with patch("sn2md.server.submit_job", side_effect=urllib.error.URLError("refused")):
+        result = cli_runner.invoke(cli, ["--server", "http://localhost:1", "file", "test.note"])
+        assert result.exit_code == 1
+        assert "Could not reach sn2md server" in result.output
+
+
+def test_import_supernote_directory_queue(tmp_path):
+    cli_runner = CliRunner()
+    queue_path = str(tmp_path / "queue.db")
+    with patch("sn2md.cli.import_supernote_queue_core") as mock_queue_core:
+        result = cli_runner.invoke(cli, ["directory", "--queue", queue_path, str(tmp_path)])
+        assert result.exit_code == 0
+        directory, _, _, queue = mock_queue_core.call_args[0][:4]
+        assert directory == str(tmp_path)
+        assert queue.path == queue_path
+
+
+def test_import_supernote_directory_include_exclude(tmp_path):
+    cli_runner = CliRunner()
+    with patch("sn2md.cli.import_supernote_directory_core") as mock_directory_core:
+        result = cli_runner.invoke(
+            cli, ["directory", "-i", "*.note", "--exclude", ".git/", "-x", "archive/", str(tmp_path)]
+        )
+        assert result.exit_code == 0
+        config = mock_directory_core.call_args[0][2]
+        assert config.include == ["*.note"]
+        assert config.exclude == [".git/", "archive/"]
+
+
+def test_import_supernote_directory_archive(tmp_path):
+    cli_runner = CliRunner()
+    archive = tmp_path / "backup.zip"
+    with zipfile.ZipFile(archive, "w") as f:
+        f.writestr("a.note", b"")
+
+    with patch("sn2md.cli.import_supernote_directory_core") as mock_directory_core:
+        result = cli_runner.invoke(cli, ["directory", str(archive)])
+        assert result.exit_code == 0
+        assert mock_directory_core.call_args[0][0] == str(archive)
+
+    result = cli_runner.invoke(cli, ["directory", "--queue", str(tmp_path / "q.db"), str(archive)])
+    assert result.exit_code == 2
+    assert "can't be used with an archive" in result.output
+
+    (tmp_path / "notes.txt").write_text("")
+    result = cli_runner.invoke(cli, ["directory", str(tmp_path / "notes.txt")])
+    assert result.exit_code == 2
+    assert "is not a directory or a zip or tar archive" in result.output
@@ -0,0 +1,163 @@
+import json
+import os
+import shutil
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from sn2md.corpus import add_to_corpus, build_records
+from sn2md.importer import (
+    import_supernote_directory_core,
+    import_supernote_file_core,
+    needs_conversion,
+)
+from sn2md.importers.registry import get_extractor
+from sn2md.types import Config
+
+PNG = Path(__file__).parent / "fixtures/ponder.png"
+
+
+def records(source="notes/a.note", pages=None, tmp_path=None):
+    output_file = os.path.join(tmp_path, "a", "a.md")
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    for name in ["a_0.png", "a_1.png"]:
+        Path(output_file).with_name(name).write_bytes(name.encode())
+    context = {
+        "llm_output": "\nfirst page\nsecond page",
+        "images": [{"name": "a_0.png"}, {"name": "a_1.png", "hash": "stored"}],
+        "keywords": [{"page_number": 0, "content": "keyword"}],
+        "titles": [],
+        "links": [{"page_number": 1, "name": "b", "device_path": b"/Note/b.note"}],
+    }
+    pages = pages if pages is not None else {0: "first page", 1: "second page"}
+    return build_records(source, "hash", output_file, "mini", context, pages, {1: "large"})
+
+
+def test_build_records(tmp_path):
+    file_record, page_records = records(tmp_path=tmp_path)
+
+    assert file_record["source"] == "notes/a.note"
+    assert file_record["markdown"] == "\nfirst page\nsecond page"
+    assert file_record["images"] == [
+        {
+            "name": "a_0.png",
+            "path": str(tmp_path / "a" / "a_0.png"),
+            "hash": "157737a93190368ba073a54400fb4f45f74e7a72",
+        },
+        {"name": "a_1.png", "path": str(tmp_path / "a" / "a_1.png"), "hash": "stored"},
+    ]
+    assert [(r["page"], r["markdown"], r["model"], r["image_hash"]) for r in page_records] == [
+        (0, "first page", None, "157737a93190368ba073a54400fb4f45f74e7a72"),
+        (1, "second page", "large", "stored"),
+    ]
+
+
+def test_build_records_without_page_images(tmp_path):
+    _, page_records = records(pages={0: "only page"}, tmp_path=tmp_path)
+    assert [(r["page"], r["image"]) for r in page_records] == [(0, None)]
+
+
+def test_jsonl_corpus(tmp_path):
+    corpus = str(tmp_path / "corpus" / "notes.jsonl")
+    add_to_corpus(corpus, *records(tmp_path=tmp_path))
+    add_to_corpus(corpus, *records("notes/b.note", tmp_path=tmp_path))
+
+    with open(corpus) as f:
+        lines = [json.loads(line) for line in f]
+    assert [(line["type"], line["source"]) for line in lines] == [
+        ("file", "notes/a.note"),
+        ("page", "notes/a.note"),
+        ("page", "notes/a.note"),
+        ("file", "notes/b.note"),
+        ("page", "notes/b.note"),
+        ("page", "notes/b.note"),
+    ]
+    assert lines[0]["links"][0]["device_path"] == "/Note/b.note"
+
+
+def test_sqlite_corpus(tmp_path):
+    corpus = str(tmp_path / "notes.db")
+    add_to_corpus(corpus, *records(tmp_path=tmp_path))
+    add_to_corpus(corpus, *records("notes/b.note", tmp_path=tmp_path))
+    # A file converted again replaces its records:
+    add_to_corpus(corpus, *records(pages={0: "new page"}, tmp_path=tmp_path))
+
+    with closing(sqlite3.connect(corpus)) as db:
+        assert db.execute("SELECT source FROM files ORDER BY source").fetchall() == [
+            ("notes/a.note",),
+            ("notes/b.note",),
+        ]
+        assert db.execute(
+            "SELECT source, page FROM pages_fts WHERE pages_fts MATCH 'page' ORDER BY source, page"
+        ).fetchall() == [("notes/a.note", 0), ("notes/b.note", 0), ("notes/b.note", 1)]
+        assert db.execute(
+            "SELECT source FROM pages_fts WHERE pages_fts MATCH 'new'"
+        ).fetchall() == [("notes/a.note",)]
+        links = json.loads(db.execute("SELECT links FROM files LIMIT 1").fetchone()[0])
+        assert links[0]["device_path"] == "/Note/b.note"
+
+
+def test_sqlite_corpus_rolls_back(tmp_path):
+    corpus = str(tmp_path / "notes.db")
+    add_to_corpus(corpus, *records(tmp_path=tmp_path))
+    file_record, page_records = records(tmp_path=tmp_path)
+    del page_records[1]["markdown"]
+    with pytest.raises(KeyError):
+        add_to_corpus(corpus, file_record, page_records)
+
+    with closing(sqlite3.connect(corpus)) as db:
+        assert db.execute("SELECT COUNT(*) FROM pages").fetchone() == (2,)
+
+
+@pytest.mark.parametrize("corpus", ["corpus.jsonl", "corpus.db"])
+def test_import_with_corpus(tmp_path, corpus):
+    source = tmp_path / "notes"
+    source.mkdir()
+    shutil.copy(PNG, source / "ponder.png")
+    output = str(tmp_path / "output")
+    config = Config(template="{{llm_output}}", corpus=corpus)
+
+    with patch("sn2md.ai_utils.image_to_markdown", return_value="markdown"):
+        import_supernote_directory_core(str(source), output, config)
+
+    # The output folder is still written (its metadata keeps runs incremental):
+    assert os.path.exists(os.path.join(output, "ponder", "ponder.md"))
+    path = os.path.join(output, corpus)
+    if corpus.endswith(".jsonl"):
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        assert [(line["type"], line["markdown"]) for line in lines] == [
+            ("file", "\nmarkdown"),
+            ("page", "markdown"),
+        ]
+        assert os.path.exists(lines[1]["image"])
+    else:
+        with closing(sqlite3.connect(path)) as db:
+            assert db.execute(
+                "SELECT source, page, model FROM pages_fts JOIN pages USING (source, page)"
+                " WHERE pages_fts MATCH 'markdown'"
+            ).fetchall() == [(str(source / "ponder.png"), 0, "gpt-4o-mini")]
+
+
+def test_failed_corpus_write_is_retried(tmp_path):
+    source = str(tmp_path / "ponder.png")
+    shutil.copy(PNG, source)
+    output = str(tmp_path / "output")
+    config = Config(template="{{llm_output}}", corpus="corpus.db")
+    extractor = get_extractor(source, config)
+
+    with patch("sn2md.ai_utils.image_to_markdown", return_value="markdown"):
+        with patch("sn2md.corpus.add_to_corpus", side_effect=sqlite3.OperationalError("locked")):
+            with pytest.raises(sqlite3.OperationalError):
+                import_supernote_file_core(extractor, source, output, config)
+        # The source isn't marked as converted:
+        assert needs_conversion(config, output, source)
+
+        import_supernote_file_core(extractor, source, output, config)
+
+    assert not needs_conversion(config, output, source)
+    with closing(sqlite3.connect(os.path.join(output, "corpus.db"))) as db:
+        assert db.execute("SELECT COUNT(*) FROM pages").fetchone() == (1,)
@@ -0,0 +1,96 @@
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from sn2md.deadlines import Deadline, DeadlineExceeded, daemon_map, submit_daemon
+
+
+def test_no_deadline():
+    deadline = Deadline()
+    assert deadline.remaining() is None
+    assert not deadline.expired()
+    deadline.check()
+    assert deadline.timeout(5) == 5
+    assert deadline.timeout(None) is None
+
+
+def test_deadline():
+    deadline = Deadline(10)
+    assert 9 < deadline.remaining() <= 10
+    assert deadline.timeout(5) == 5
+    assert 9 < deadline.timeout(None) <= 10
+    assert 9 < deadline.timeout(20) <= 10
+
+
+def test_expired_deadline():
+    deadline = Deadline(0)
+    assert deadline.remaining() == 0.0
+    assert deadline.expired()
+    with pytest.raises(DeadlineExceeded):
+        deadline.check()
+    # It is a TimeoutError:
+    with pytest.raises(TimeoutError):
+        deadline.check()
+
+
+def test_parent_caps_deadline():
+    parent = Deadline(1)
+    assert Deadline(10, parent).expires == parent.expires
+    assert Deadline(None, parent).expires == parent.expires
+    assert Deadline(0.5, parent).expires < parent.expires
+    assert Deadline(10, Deadline()).expires > time.monotonic() + 9
+
+
+def test_cancelled_deadline():
+    cancel = threading.Event()
+    parent = Deadline(cancel=cancel)
+    deadline = Deadline(10, parent)
+    assert not deadline.expired()
+
+    cancel.set()
+    assert deadline.expired() and parent.expired()
+    assert deadline.remaining() == 0.0
+    with pytest.raises(DeadlineExceeded, match="Cancelled"):
+        deadline.check()
+
+
+def test_submit_daemon():
+    assert submit_daemon(lambda a, b: a + b, 1, 2).result(timeout=1) == 3
+    with pytest.raises(ValueError):
+        submit_daemon(int, "x").result(timeout=1)
+
+
+def test_daemon_map():
+    assert daemon_map(lambda x: x * 2, range(10), 3) == list(range(0, 20, 2))
+    assert daemon_map(lambda x: x, [], 3) == []
+
+    started = []
+
+    def fail_second(x):
+        started.append(x)
+        if x == 1:
+            raise ValueError("second")
+        return x
+
+    with pytest.raises(ValueError, match="second"):
+        daemon_map(fail_second, range(10), 1)
+    # Items after the one that failed aren't started:
+    assert started == [0, 1]
+
+
+def test_abandoned_request_does_not_delay_exit():
+    # A request left running after it timed out doesn't keep Python running:
+    code = (
+        "import time\n"
+        "from sn2md.hedging import RequestPolicy\n"
+        "try:\n"
+        "    RequestPolicy().run(lambda model, cancel: time.sleep(30), 'm', timeout=0.1)\n"
+        "except TimeoutError:\n"
+        "    pass\n"
+    )
+    start = time.monotonic()
+    subprocess.run([sys.executable, "-c", code], check=True, timeout=20)
+    assert time.monotonic() - start < 10
@@ -0,0 +1,247 @@
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from llm import Usage
+from PIL import Image
+
+from sn2md.ai_utils import (
+    bands_to_markdown,
+    convert_image,
+    get_model,
+    get_policy,
+    image_to_markdown,
+    image_to_text,
+    images_to_markdown,
+)
+from sn2md.deadlines import Deadline, DeadlineExceeded
+from sn2md.hedging import INITIAL_HEDGE_DELAY, RequestPolicy
+from sn2md.images import png_bytes
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    get_model.cache_clear()
+    get_policy.cache_clear()
+    yield
+    get_model.cache_clear()
+    get_policy.cache_clear()
+
+
+def fake_request(delays: dict[str, float], cancelled: dict[str, bool] | None = None):
+    """A request that answers with the model name after the model's delay, or
+    raises if the delay is None."""
+
+    def request(model: str, cancel: threading.Event) -> str:
+        delay = delays[model]
+        if delay is None:
+            raise RuntimeError(f"{model} is down")
+        cancel.wait(delay)
+        if cancelled is not None:
+            cancelled[model] = cancel.is_set()
+        return model
+
+    return request
+
+
+def test_no_hedging():
+    policy = RequestPolicy()
+    assert policy.hedge_delay() is None
+    assert policy.run(fake_request({"a": 0}), "a") == "a"
+    # Latencies are only used for hedging, but are still recorded:
+    assert len(policy.latencies["page"]) == 1
+
+
+def test_hedge_delay():
+    policy = RequestPolicy(hedge_percentile=50, min_hedge_delay=0.5)
+    # Until enough latencies are known:
+    assert policy.hedge_delay() == INITIAL_HEDGE_DELAY
+
+    policy.latencies["page"].extend([1.0, 2.0, 3.0, 4.0, 5.0])
+    assert policy.hedge_delay() == 3.0
+
+    policy.hedge_percentile = 99
+    assert policy.hedge_delay() == 5.0
+
+    policy.latencies["page"].clear()
+    policy.latencies["page"].extend([0.1] * 5)
+    assert policy.hedge_delay() == 0.5
+
+
+def test_latencies_per_kind():
+    policy = RequestPolicy(hedge_percentile=50, min_hedge_delay=0.01)
+    policy.latencies["title"].extend([0.5] * 5)
+    policy.latencies["page"].extend([10.0] * 5)
+    # Short title requests don't raise the hedge delay of pages, and pages
+    # don't raise the hedge delay of titles:
+    assert policy.hedge_delay("title") == 0.5
+    assert policy.hedge_delay("page") == 10.0
+    assert policy.hedge_delay("band") == INITIAL_HEDGE_DELAY
+
+    assert policy.run(fake_request({"a": 0}), "a", kind="band") == "a"
+    assert len(policy.latencies["band"]) == 1
+    assert len(policy.latencies["page"]) == 5
+
+
+@patch("sn2md.ai_utils.llm.get_model")
+def test_request_kinds(get_model_mock):
+    get_model_mock.return_value = fake_model(["Title"])
+    policy = get_policy(None, (), ())
+    image = Image.new("L", (20, 20), 255)
+    image_to_text(image, None, "a", "prompt", policy)
+    image_to_markdown(png_bytes(image), "", None, "a", "{context}", policy=policy)
+    images_to_markdown([png_bytes(image)] * 2, "", None, "a", "{context}", policy=policy)
+    bands_to_markdown(png_bytes(image), "", None, "a", "{context}", 2, 0.1, policy=policy)
+    assert {kind: len(latencies) for kind, latencies in policy.latencies.items()} == {
+        "title": 1,
+        "page": 1,
+        "2 pages": 1,
+        "band": 2,
+    }
+
+
+def test_hedge_wins_when_primary_is_slow():
+    cancelled = {}
+    policy = RequestPolicy(hedge_percentile=95, hedge_models=["fast"], min_hedge_delay=0.05)
+    policy.latencies["page"].extend([0.05] * 5)
+
+    start = time.monotonic()
+    assert policy.run(fake_request({"slow": 5, "fast": 0}, cancelled), "slow") == "fast"
+    assert time.monotonic() - start < 1
+
+    # The slow request is cancelled:
+    for _ in range(100):
+        if "slow" in cancelled:
+            break
+        time.sleep(0.01)
+    assert cancelled == {"fast": False, "slow": True}
+
+
+def test_fast_primary_is_not_hedged():
+    calls = []
+    policy = RequestPolicy(hedge_percentile=95, hedge_models=["other"], min_hedge_delay=1)
+    policy.latencies["page"].extend([1.0] * 5)
+
+    def request(model, cancel):
+        calls.append(model)
+        return model
+
+    assert policy.run(request, "a") == "a"
+    assert calls == ["a"]
+
+
+def test_failover():
+    policy = RequestPolicy(fallback_models=["b", "c"])
+    assert policy.run(fake_request({"a": None, "b": None, "c": 0}), "a") == "c"
+
+
+def test_failover_all_fail():
+    policy = RequestPolicy(fallback_models=["b"])
+    with pytest.raises(RuntimeError, match="b is down"):
+        policy.run(fake_request({"a": None, "b": None}), "a")
+
+
+def test_hedged_request_fails_over_when_both_fail():
+    policy = RequestPolicy(hedge_percentile=50, fallback_models=["b"], min_hedge_delay=0.01)
+    policy.latencies["page"].extend([0.01] * 5)
+    assert policy.run(fake_request({"a": None, "b": 0}), "a") == "b"
+
+
+def fake_model(chunks: list[str], delay: float = 0):
+    model = MagicMock()
+
+    def prompt(text, attachments, **kwargs):
+        def chunks_after_delay():
+            for chunk in chunks:
+                time.sleep(delay)
+                yield chunk
+
+        response = MagicMock()
+        response.__iter__.return_value = chunks_after_delay()
+        response.usage.return_value = Usage(input=100, output=len(chunks))
+        return response
+
+    model.prompt.side_effect = prompt
+    return model
+
+
+@patch("sn2md.ai_utils.llm.get_model")
+def test_convert_image_hedged(get_model_mock):
+    models = {
+        "slow": fake_model(["slow ", "response"], delay=1),
+        "fast": fake_model(["fast ", "response"]),
+    }
+    get_model_mock.side_effect = models.__getitem__
+    policy = get_policy(95, ("fast",), ())
+    policy.min_hedge_delay = 0.05
+    policy.latencies["page"].extend([0.05] * 5)
+
+    chunks = []
+    usages = []
+    result = convert_image(
+        "text", "attachment", None, "slow", chunks.append, policy, on_usage=usages.append
+    )
+
+    assert result == "fast response"
+    # Hedged responses are passed on in one chunk:
+    assert chunks == ["fast response"]
+    # Only the usage of the response that is used is reported:
+    assert usages == [Usage(input=100, output=2)]
+
+
+@patch("sn2md.ai_utils.llm.get_model")
+def test_convert_image_failover(get_model_mock):
+    down = MagicMock()
+    down.prompt.side_effect = RuntimeError("down")
+    models = {"a": down, "b": fake_model(["b ", "response"])}
+    get_model_mock.side_effect = models.__getitem__
+
+    chunks = []
+    policy = get_policy(None, (), ("b",))
+    assert convert_image("text", "attachment", None, "a", chunks.append, policy) == "b response"
+    assert chunks == ["b ", "response"]
+
+
+def test_get_policy_is_shared():
+    assert get_policy(95, ("a",), ()) is get_policy(95, ("a",), ())
+    assert get_policy(95, ("a",), ()) is not get_policy(None, ("a",), ())
+
+
+def test_timeout():
+    cancelled = {}
+    policy = RequestPolicy()
+    start = time.monotonic()
+    with pytest.raises(TimeoutError, match="No response from slow after 0.1s"):
+        policy.run(fake_request({"slow": 5}, cancelled), "slow", timeout=0.1)
+    assert time.monotonic() - start < 1
+
+    # The abandoned request is cancelled:
+    for _ in range(100):
+        if "slow" in cancelled:
+            break
+        time.sleep(0.01)
+    assert cancelled == {"slow": True}
+
+
+def test_timeout_fails_over():
+    policy = RequestPolicy(fallback_models=["fast"])
+    assert policy.run(fake_request({"slow": 5, "fast": 0}), "slow", timeout=0.1) == "fast"
+
+
+def test_deadline_bounds_requests():
+    policy = RequestPolicy(fallback_models=["b"])
+    start = time.monotonic()
+    # The deadline passes before the fallback model is tried:
+    with pytest.raises(DeadlineExceeded):
+        policy.run(fake_request({"a": 5, "b": 0}), "a", timeout=10, deadline=Deadline(0.1))
+    assert time.monotonic() - start < 1
+
+
+@patch("sn2md.ai_utils.llm.get_model")
+def test_convert_image_timeout(get_model_mock):
+    get_model_mock.return_value = fake_model(["slow ", "response"], delay=1)
+    # Without a policy, a timeout still applies:
+    with pytest.raises(TimeoutError):
+        convert_image("text", "attachment", None, "slow", timeout=0.1)
@@ -0,0 +1,54 @@
+from PIL import Image, ImageDraw
+
+from sn2md.images import crop_to_content, ink_bbox, ink_mask, ink_percent
+
+
+def _page(mode="L", background=255):
+    image = Image.new(mode, (200, 300), background)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((50, 100, 79, 149), fill=0 if mode == "L" else (0, 0, 0, 255))
+    return image
+
+
+def test_ink_mask():
+    assert ink_mask(_page()).sum() == 30 * 50
+
+
+def test_ink_mask_gray_pens():
+    image = Image.new("L", (100, 100), 255)
+    draw = ImageDraw.Draw(image)
+    # The dark gray and gray pens of the Supernote:
+    draw.rectangle((0, 0, 9, 9), fill=0x9D)
+    draw.rectangle((0, 10, 9, 19), fill=0xC9)
+    # Off-white paper isn't ink:
+    draw.rectangle((50, 50, 99, 99), fill=0xF5)
+    assert ink_mask(image).sum() == 200
+    assert ink_percent(image) == 2.0
+
+
+def test_ink_mask_transparent_background():
+    assert ink_mask(_page("RGBA", (0, 0, 0, 0))).sum() == 30 * 50
+
+
+def test_ink_bbox():
+    assert ink_bbox(_page()) == (50, 100, 80, 150)
+    assert ink_bbox(Image.new("L", (10, 10), 255)) is None
+
+
+def test_crop_to_content():
+    assert crop_to_content(_page(), 10).size == (50, 70)
+    # padding is limited to the image:
+    assert crop_to_content(_page(), 150).size == (200, 300)
+
+    blank = Image.new("L", (10, 10), 255)
+    assert crop_to_content(blank, 10) is blank
+
+
+def test_crop_to_content_gray_pen():
+    image = Image.new("L", (1404, 1872), 255)
+    draw = ImageDraw.Draw(image)
+    draw.line((100, 50, 400, 50), fill=0, width=4)
+    draw.line((100, 1800, 400, 1800), fill=0x9D, width=4)
+    left, upper, right, lower = ink_bbox(image)
+    assert upper <= 50 and lower > 1800
+    assert crop_to_content(image, 20).size[1] > 1750
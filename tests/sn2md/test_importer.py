@@ -1,18 +1,25 @@
 import base64
 import os
 import tempfile
+import time
 from datetime import datetime
 from unittest.mock import Mock, mock_open, patch
 
 import pytest
 
+from sn2md.deadlines import Deadline
 from sn2md.importer import create_notebook_context
 
 from sn2md.importer import (
+    _batches,
     import_supernote_directory_core,
     import_supernote_file_core,
+    open_journal,
+    process_pages,
     verify_metadata_file,
 )
+from sn2md.journal import JOURNAL_FILE, PageJournal
+from sn2md.metadata import compute_hash
 from sn2md.types import Config
 
 
@@ -31,13 +38,15 @@ def test_import_supernote_file_core(temp_dir):
 
     with (
         patch("sn2md.importer.check_metadata_file") as mock_check_metadata,
-        patch("sn2md.importer.image_to_markdown") as mock_image_to_md,
+        patch("sn2md.ai_utils.image_to_markdown") as mock_image_to_md,
         patch("sn2md.importer.write_metadata_file") as mock_write_metadata,
+        patch("sn2md.importer.open_journal") as mock_open_journal,
         patch("builtins.open", mock_open()) as mock_file,
         patch("uuid.uuid4") as mock_uuid,
         patch("os.rename") as mock_rename,
         patch("os.rename") as mock_rename,
         patch("os.rename") as mock_rename,
+        patch("os.replace") as mock_replace,
     ):
         mock_uuid.return_value.hex = "test-uuid"
         mock_extractor = Mock()
@@ -63,6 +72,8 @@ def test_import_supernote_file_core(temp_dir):
 
         mock_extractor.get_notebook.return_value = mock_notebook
         mock_extractor.extract_images.return_value = ["page1.png", "page2.png"]
+        mock_extractor.get_llm_image.side_effect = lambda png: png
+        mock_open_journal.return_value.pages.return_value = {}
 
         import_supernote_file_core(
             mock_extractor, filename, output, config, force=True, progress=False
@@ -71,6 +82,7 @@ def test_import_supernote_file_core(temp_dir):
         mock_check_metadata.assert_not_called()
         assert mock_image_to_md.call_count == 2
         mock_write_metadata.assert_called_once()
+        mock_open_journal.return_value.complete.assert_called_once()
         assert mock_rename.call_count == 2
         assert mock_rename.call_count == 2
 
@@ -84,9 +96,11 @@ def test_import_supernote_file_core_non_notebook(temp_dir):
 
     with (
         patch("sn2md.importer.check_metadata_file") as mock_check_metadata,
-        patch("sn2md.importer.image_to_markdown") as mock_image_to_md,
+        patch("sn2md.ai_utils.image_to_markdown") as mock_image_to_md,
         patch("sn2md.importer.write_metadata_file") as mock_write_metadata,
         patch("sn2md.importer.os.rename") as mock_rename,
+        patch("sn2md.importer.os.replace") as mock_replace,
+        patch("sn2md.importer.open_journal") as mock_open_journal,
         patch("builtins.open", mock_open()) as mock_file,
         patch("uuid.uuid4") as mock_uuid,
     ):
@@ -98,6 +112,8 @@ def test_import_supernote_file_core_non_notebook(temp_dir):
 
         mock_extractor.get_notebook.return_value = None
         mock_extractor.extract_images.return_value = ["page1.png", "page2.png"]
+        mock_extractor.get_llm_image.side_effect = lambda png: png
+        mock_open_journal.return_value.pages.return_value = {}
 
         import_supernote_file_core(
             mock_extractor, filename, output, config, force=True, progress=False
@@ -122,7 +138,7 @@ def test_import_supernote_directory_core(temp_dir, progress, force):
 
     with (
         patch("sn2md.importer.import_supernote_file_core") as mock_import_file,
-        patch("sn2md.importer.tqdm") as mock_tqdm,
+        patch("tqdm.tqdm") as mock_tqdm,
     ):
         import_supernote_directory_core(
             directory, output, config, force=force, progress=progress
@@ -168,8 +184,8 @@ def test_create_notebook_context():
         api_key="mock-key"
     )
 
-    with patch("sn2md.importer.image_to_text") as mock_image_to_text, \
-         patch("sn2md.importer.convert_binary_to_image") as mock_convert_image:
+    with patch("sn2md.ai_utils.image_to_text") as mock_image_to_text, \
+         patch("sn2md.importers.note.convert_binary_to_image") as mock_convert_image:
         mock_image_to_text.return_value = "Test Title"
 
         context = create_notebook_context(mock_notebook, config, "gpt-4")
@@ -212,7 +228,9 @@ def test_verify_metadata_file(temp_dir):
 
     with patch("sn2md.importer.check_metadata_file") as mock_check_metadata:
         verify_metadata_file(config, output, filename)
-        mock_check_metadata.assert_called_once_with(os.path.join(output, "test"))
+        mock_check_metadata.assert_called_once_with(
+            os.path.join(output, "test"), allow_unchanged_input=False, member=None
+        )
 
 
 def test_verify_metadata_file_nested_path(temp_dir):
@@ -242,7 +260,9 @@ def test_verify_metadata_file_nested_path(temp_dir):
 
     with patch("sn2md.importer.check_metadata_file") as mock_check_metadata:
         verify_metadata_file(config, output, filename)
-        mock_check_metadata.assert_called_once_with(expected_path)
+        mock_check_metadata.assert_called_once_with(
+            expected_path, allow_unchanged_input=False, member=None
+        )
 
 
 @pytest.mark.parametrize("progress", [True, False])
@@ -257,7 +277,7 @@ def test_import_supernote_directory_core(temp_dir, progress):
 
     with (
         patch("sn2md.importer.import_supernote_file_core") as mock_import_file,
-        patch("sn2md.importer.tqdm") as mock_tqdm,
+        patch("tqdm.tqdm") as mock_tqdm,
     ):
         mock_tqdm.return_value = [note_file]
         import_supernote_directory_core(
@@ -273,3 +293,441 @@ def test_import_supernote_directory_core(temp_dir, progress):
             None,
         )
         assert mock_tqdm.called == progress
+
+
+def test_import_supernote_directory_core_verifies_once(temp_dir):
+    output = os.path.join(temp_dir, "output")
+    with open(os.path.join(temp_dir, "test.note"), "w") as f:
+        f.write("test content")
+
+    with (
+        patch("sn2md.importer.verify_metadata_file") as mock_verify,
+        patch("sn2md.importer.open_journal", side_effect=ValueError("stop")) as mock_journal,
+    ):
+        import_supernote_directory_core(temp_dir, output, Config())
+
+    mock_journal.assert_called_once()
+    # Checked when scheduled, not again when converted:
+    mock_verify.assert_called_once()
+
+
+def test_process_pages_resumes_from_journal(temp_dir):
+    journal = PageJournal(os.path.join(temp_dir, "journal.jsonl"), "hash")
+    journal.record(0, "markdown0")
+
+    with patch("sn2md.ai_utils.image_to_markdown") as mock_image_to_md:
+        mock_image_to_md.return_value = "markdown1"
+        result = process_pages(["page0.png", "page1.png"], Config(), "model", False, journal)
+
+    assert result == "\nmarkdown0\nmarkdown1"
+    mock_image_to_md.assert_called_once()
+    assert mock_image_to_md.call_args[0][0] == "page1.png"
+    assert mock_image_to_md.call_args[0][1] == "\nmarkdown0"
+    assert journal.pages() == {0: "markdown0", 1: "markdown1"}
+
+
+@pytest.mark.parametrize(
+    "resume, complete, expected",
+    [
+        (True, False, {0: "markdown0"}),
+        (False, False, {}),
+        (True, True, {}),
+    ],
+)
+def test_open_journal(temp_dir, resume, complete, expected):
+    filename = os.path.join(temp_dir, "test.note")
+    with open(filename, "w") as f:
+        _ = f.write("test content")
+
+    journal = open_journal(temp_dir, filename, resume)
+    journal.record(0, "markdown0")
+    if complete:
+        journal.complete()
+
+    assert open_journal(temp_dir, filename, resume).pages() == expected
+    assert open_journal(temp_dir, filename, resume, partial=True).pages() == expected
+
+
+def test_process_pages_selected_pages(temp_dir):
+    journal = PageJournal(os.path.join(temp_dir, "journal.jsonl"), "old-hash")
+    for number in range(3):
+        journal.record(number, f"markdown{number}", f"page{number}.png")
+    journal = PageJournal(journal.path, "new-hash")
+
+    with patch("sn2md.ai_utils.image_to_markdown") as mock_image_to_md:
+        mock_image_to_md.return_value = "fixed1"
+        result = process_pages(["page1.png"], Config(), "model", False, journal, [1])
+
+    assert result == "\nmarkdown0\nfixed1\nmarkdown2"
+    assert mock_image_to_md.call_args[0][1] == "\nmarkdown0"
+    assert journal.pages() == {1: "fixed1"}
+
+
+def test_import_supernote_file_core_selected_pages(temp_dir):
+    filename = os.path.join(temp_dir, "test.pdf")
+    output = os.path.join(temp_dir, "output")
+    with open(filename, "w") as f:
+        _ = f.write("test content")
+
+    def extract_images(file_name, output_path, pages=None):
+        # Extractors name pages after the directory they're rendered in:
+        pngs = []
+        for number in range(3) if pages is None else pages:
+            png = os.path.join(output_path, f"{os.path.basename(output_path)}_{number}.png")
+            with open(png, "w") as f:
+                _ = f.write(f"image{number}")
+            pngs.append(png)
+        return pngs
+
+    mock_extractor = Mock()
+    mock_extractor.extract_images.side_effect = extract_images
+    mock_extractor.get_notebook.return_value = None
+    mock_extractor.get_llm_image.side_effect = lambda png: png
+    config = Config(
+        template="{{llm_output}}|{% for image in images %}{{image.name}},{% endfor %}"
+    )
+
+    with patch("sn2md.ai_utils.image_to_markdown") as mock_image_to_md:
+        mock_image_to_md.side_effect = ["markdown0", "markdown1", "markdown2", "fixed1"]
+        import_supernote_file_core(mock_extractor, filename, output, config)
+        import_supernote_file_core(mock_extractor, filename, output, config, pages=[1])
+
+    with open(os.path.join(output, "test", "test.md")) as f:
+        assert f.read() == "\nmarkdown0\nfixed1\nmarkdown2|test_0.png,test_1.png,test_2.png,"
+    with open(os.path.join(output, "test", "test_0.png")) as f:
+        assert f.read() == "image0"
+    assert mock_image_to_md.call_count == 4
+
+
+def test_import_supernote_file_core_resumed_images(temp_dir):
+    filename = os.path.join(temp_dir, "test.pdf")
+    output = os.path.join(temp_dir, "output")
+    with open(filename, "w") as f:
+        _ = f.write("test content")
+
+    def extract_images(file_name, output_path, pages=None):
+        pngs = []
+        for number in range(3):
+            png = os.path.join(output_path, f"{os.path.basename(output_path)}_{number}.png")
+            with open(png, "w") as f:
+                _ = f.write(f"image{number}")
+            pngs.append(png)
+        return pngs
+
+    mock_extractor = Mock()
+    mock_extractor.extract_images.side_effect = extract_images
+    mock_extractor.get_notebook.return_value = None
+    mock_extractor.get_llm_image.side_effect = lambda png: png
+    config = Config(
+        template="{{llm_output}}|{% for image in images %}{{image.name}},{% endfor %}"
+    )
+    output_path = os.path.join(output, "test")
+    os.makedirs(output_path)
+    # A page converted by an interrupted run that named images differently:
+    with open(os.path.join(output_path, "0123abcd_0.png"), "w") as f:
+        _ = f.write("old image")
+    PageJournal(os.path.join(output_path, JOURNAL_FILE), compute_hash(filename)).record(
+        0, "markdown0", "0123abcd_0.png"
+    )
+
+    with patch("sn2md.ai_utils.image_to_markdown") as mock_image_to_md:
+        mock_image_to_md.side_effect = ["markdown1", TimeoutError("too slow")]
+        with pytest.raises(TimeoutError):
+            import_supernote_file_core(mock_extractor, filename, output, config)
+        mock_image_to_md.side_effect = ["markdown2"]
+        import_supernote_file_core(mock_extractor, filename, output, config)
+
+    with open(os.path.join(output_path, "test.md")) as f:
+        assert f.read() == "\nmarkdown0\nmarkdown1\nmarkdown2|test_0.png,test_1.png,test_2.png,"
+    assert sorted(name for name in os.listdir(output_path) if name.endswith(".png")) == [
+        "test_0.png",
+        "test_1.png",
+        "test_2.png",
+    ]
+
+
+def test_process_pages_batches():
+    pngs = [f"page{number}.png" for number in range(5)]
+    with (
+        patch("sn2md.ai_utils.images_to_markdown") as mock_images_to_md,
+        patch("sn2md.ai_utils.image_to_markdown") as mock_image_to_md,
+    ):
+        mock_images_to_md.side_effect = [["m0", "m1"], None]
+        mock_image_to_md.side_effect = ["m2", "m3", "m4"]
+        result = process_pages(pngs, Config(pages_per_request=2), "model", True)
+
+    assert result == "\nm0\nm1\nm2\nm3\nm4"
+    assert [c.args[0] for c in mock_images_to_md.call_args_list] == [
+        ["page0.png", "page1.png"],
+        ["page2.png", "page3.png"],
+    ]
+    assert mock_images_to_md.call_args_list[1].args[1] == "\nm0\nm1"
+    # the second batch couldn't be split, and the last page is on its own:
+    assert [c.args[0] for c in mock_image_to_md.call_args_list] == [
+        "page2.png",
+        "page3.png",
+        "page4.png",
+    ]
+    assert mock_image_to_md.call_args_list[1].args[1] == "\nm0\nm1\nm2"
+
+
+def test_batches_are_consecutive_pages():
+    pages = [(1, "a"), (2, "b"), (3, "c"), (7, "d"), (8, "e")]
+    assert [[n for n, _ in batch] for batch in _batches(pages, 2)] == [[1, 2], [3], [7, 8]]
+
+
+def test_import_supernote_file_core_stream(temp_dir):
+    from PIL import Image
+
+    filename = os.path.join(temp_dir, "test.png")
+    output = os.path.join(temp_dir, "output")
+    with open(filename, "w") as f:
+        _ = f.write("test content")
+
+    provisional_path = os.path.join(output, "test", "test.partial.md")
+    provisional_contents = []
+    responses = {
+        ("page0.png", "model"): "",
+        ("page0.png", "strong"): "a" * 300,
+        ("page1.png", "model"): "b" * 300,
+    }
+
+    def image_to_markdown(page, context, api_key, model, prompt, crop_padding, on_chunk, policy, **kwargs):
+        with open(provisional_path) as f:
+            provisional_contents.append(f.read())
+        markdown = responses[(os.path.basename(page), model)]
+        on_chunk(markdown)
+        return markdown
+
+    mock_extractor = Mock()
+    mock_extractor.get_notebook.return_value = None
+    mock_extractor.get_llm_image.side_effect = lambda png: png
+    mock_extractor.get_ink_image.side_effect = lambda png: png
+    config = Config(
+        template="{{llm_output}}", stream=True, model="model", escalation_models=["strong"]
+    )
+
+    pages = []
+    for number in range(2):
+        image = Image.new("L", (100, 100), 255)
+        image.paste(0, (0, 0, 100, 10))
+        pages.append(os.path.join(temp_dir, f"page{number}.png"))
+        image.save(pages[-1])
+
+    with (
+        patch("sn2md.ai_utils.image_to_markdown", side_effect=image_to_markdown),
+        patch("sn2md.importer.generate_images") as mock_generate_images,
+    ):
+        mock_generate_images.return_value.__enter__.return_value = pages
+        import_supernote_file_core(mock_extractor, filename, output, config, progress=True)
+
+    # Each page is written once, after its last attempt:
+    assert provisional_contents == ["", "", "\n" + "a" * 300]
+    assert not os.path.exists(provisional_path)
+    with open(os.path.join(output, "test", "test.md")) as f:
+        assert f.read() == "\n" + "a" * 300 + "\n" + "b" * 300
+    assert not os.path.exists(os.path.join(output, "test", "test.md.tmp"))
+
+
+def test_import_supernote_file_core_stream_failure(temp_dir):
+    filename = os.path.join(temp_dir, "test.png")
+    output = os.path.join(temp_dir, "output")
+    open(filename, "w").close()
+    mock_extractor = Mock()
+    mock_extractor.get_llm_image.side_effect = lambda png: png
+
+    with (
+        patch("sn2md.ai_utils.image_to_markdown", side_effect=TimeoutError("too slow")),
+        patch("sn2md.importer.generate_images") as mock_generate_images,
+    ):
+        mock_generate_images.return_value.__enter__.return_value = ["page0.png"]
+        with pytest.raises(TimeoutError):
+            import_supernote_file_core(mock_extractor, filename, output, Config(stream=True))
+
+    assert not os.path.exists(os.path.join(output, "test", "test.partial.md"))
+
+
+def test_import_supernote_file_core_image_store(temp_dir):
+    output = os.path.join(temp_dir, "output")
+    mock_extractor = Mock()
+    mock_extractor.get_notebook.return_value = None
+    mock_extractor.get_llm_image.side_effect = lambda png: png
+    config = Config(
+        template="{% for image in images %}{{ image.hash }} {{ image.store_path }}\n{% endfor %}",
+        image_store="assets",
+    )
+
+    for name in ["first", "second"]:
+        filename = os.path.join(temp_dir, f"{name}.png")
+        with open(filename, "w") as f:
+            _ = f.write(name)
+        page = os.path.join(temp_dir, f"{name}_page.png")
+        with open(page, "w") as f:
+            _ = f.write("a blank page")
+
+        with (
+            patch("sn2md.ai_utils.image_to_markdown", return_value="markdown"),
+            patch("sn2md.importer.generate_images") as mock_generate_images,
+        ):
+            mock_generate_images.return_value.__enter__.return_value = [page]
+            import_supernote_file_core(mock_extractor, filename, output, config)
+
+    first = os.path.join(output, "first", "first_page.png")
+    second = os.path.join(output, "second", "second_page.png")
+    assert os.path.samefile(first, second)
+    stored = os.listdir(os.path.join(output, "assets"))
+    assert len(stored) == 1
+    [asset] = os.listdir(os.path.join(output, "assets", stored[0]))
+    assert os.path.samefile(first, os.path.join(output, "assets", stored[0], asset))
+
+    with open(os.path.join(output, "first", "first.md")) as f:
+        digest, store_path = f.read().split()
+    assert asset == digest + ".png"
+    assert store_path == os.path.join(output, "assets", digest[:2], asset)
+
+
+def test_process_pages_escalates(temp_dir):
+    from PIL import Image, ImageDraw
+
+    from sn2md.stats import RunStats
+
+    pngs = []
+    for number in range(3):
+        image = Image.new("L", (100, 100), 255)
+        ImageDraw.Draw(image).rectangle((0, 0, 9, 99), fill=0)
+        pngs.append(os.path.join(temp_dir, f"page{number}.png"))
+        image.save(pngs[-1])
+
+    responses = {
+        ("page0.png", "mini"): "a" * 300,
+        ("page1.png", "mini"): "",
+        ("page1.png", "medium"): "I'm sorry, I can't read that.",
+        ("page1.png", "large"): "b" * 300,
+        ("page2.png", "mini"): "$x = " + "c" * 300,
+        ("page2.png", "medium"): "c" * 300,
+    }
+
+    def image_to_markdown(page, context, api_key, model, *args, **kwargs):
+        return responses[(os.path.basename(page), model)]
+
+    stats = RunStats()
+    config = Config(escalation_models=["medium", "large"])
+    with patch("sn2md.ai_utils.image_to_markdown", side_effect=image_to_markdown):
+        result = process_pages(pngs, config, "mini", False, stats=stats)
+
+    assert result == "\n" + "a" * 300 + "\n" + "b" * 300 + "\n" + "c" * 300
+    assert stats.page_models == {0: "mini", 1: "large", 2: "medium"}
+    assert stats.escalations == {"empty": 1, "refusal": 1, "latex": 1}
+
+
+def test_process_pages_deadline(temp_dir):
+    journal = PageJournal(os.path.join(temp_dir, "journal.jsonl"), "hash")
+
+    def slow_image_to_markdown(page, *args, **kwargs):
+        time.sleep(0.2)
+        return f"markdown of {page}"
+
+    with patch("sn2md.ai_utils.image_to_markdown", side_effect=slow_image_to_markdown):
+        with pytest.raises(TimeoutError):
+            process_pages(
+                ["page0.png", "page1.png"],
+                Config(),
+                "model",
+                False,
+                journal,
+                deadline=Deadline(0.1),
+            )
+
+    # The page that completed is kept, for the next run to resume from:
+    assert journal.pages() == {0: "markdown of page0.png"}
+
+
+def test_import_supernote_file_core_timeout(temp_dir):
+    filename = os.path.join(temp_dir, "test.png")
+    output = os.path.join(temp_dir, "output")
+    open(filename, "w").close()
+
+    mock_extractor = Mock()
+    mock_extractor.extract_images.side_effect = lambda *args: time.sleep(0.2) or []
+    config = Config(template="{{llm_output}}", file_timeout=0.1)
+
+    with pytest.raises(TimeoutError):
+        import_supernote_file_core(mock_extractor, filename, output, config)
+    # The images are removed, and no output is written:
+    assert os.listdir(output) == ["test"]
+    assert not os.path.exists(os.path.join(output, "test", "test.md"))
+
+
+def test_import_supernote_directory_core_run_timeout(temp_dir, caplog):
+    for name in ["a.png", "b.png", "c.png"]:
+        open(os.path.join(temp_dir, name), "w").close()
+    output = os.path.join(temp_dir, "output")
+    converted = []
+
+    def import_file(image_extractor, filename, *args, deadline=None, **kwargs):
+        converted.append(os.path.basename(filename))
+        time.sleep(0.2)
+        raise TimeoutError("file timeout")
+
+    with patch("sn2md.importer.import_supernote_file_core", side_effect=import_file):
+        import_supernote_directory_core(
+            temp_dir, output, Config(run_timeout=0.3)
+        )
+
+    # A file that times out doesn't stop the run, the run timeout does:
+    assert converted == ["a.png", "b.png"]
+    assert "Stopped converting" in caplog.text
+    assert "1 files are left for the next run" in caplog.text
+
+
+def test_process_pages_dense_pages_in_bands(temp_dir):
+    from PIL import Image
+
+    from sn2md.stats import RunStats
+
+    pngs = []
+    for number, ink_rows in enumerate([10, 90]):
+        image = Image.new("L", (100, 100), 255)
+        image.paste(0, (0, 0, 100, ink_rows))
+        pngs.append(os.path.join(temp_dir, f"page{number}.png"))
+        image.save(pngs[-1])
+
+    stats = RunStats()
+    config = Config(tile_min_ink=50, tile_bands=2)
+    with (
+        patch("sn2md.ai_utils.image_to_markdown", return_value="sparse") as mock_image,
+        patch("sn2md.ai_utils.bands_to_markdown", return_value="dense") as mock_bands,
+    ):
+        result = process_pages(pngs, config, "model", False, stats=stats)
+
+    assert result == "\nsparse\ndense"
+    assert mock_image.call_args[0][0] == pngs[0]
+    assert mock_bands.call_args[0][0] == pngs[1]
+    assert mock_bands.call_args[0][5:7] == (2, 0.1)
+    assert stats.tiled_pages == 1
+    assert "1 pages in bands" in stats.summary()
+
+
+def test_process_pages_measures_ink_without_background(temp_dir):
+    from PIL import Image
+
+    # The page (sent to the LLM) is covered by its template; its ink isn't:
+    page = os.path.join(temp_dir, "page.png")
+    Image.new("L", (100, 100), 0).save(page)
+    ink = os.path.join(temp_dir, "ink.png")
+    image = Image.new("L", (100, 100), 255)
+    image.paste(0, (0, 0, 100, 10))
+    image.save(ink)
+
+    config = Config(tile_min_ink=50, escalation_models=["strong"])
+    with (
+        patch("sn2md.ai_utils.image_to_markdown", return_value="a" * 300) as mock_image,
+        patch("sn2md.ai_utils.bands_to_markdown") as mock_bands,
+    ):
+        result = process_pages([page], config, "model", False, ink_pngs=[ink])
+
+    assert result == "\n" + "a" * 300
+    # Sent whole, and not escalated for too little text for its ink:
+    mock_bands.assert_not_called()
+    assert mock_image.call_count == 1
+    assert mock_image.call_args[0][0] == page
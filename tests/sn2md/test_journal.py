@@ -0,0 +1,57 @@
+import pytest
+
+from sn2md.journal import PageJournal
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / ".sn2md.journal.jsonl")
+
+
+def test_record_and_pages(journal_path):
+    journal = PageJournal(journal_path, "hash1")
+    assert journal.pages() == {}
+
+    journal.record(0, "page 0")
+    journal.record(1, "page 1")
+
+    assert PageJournal(journal_path, "hash1").pages() == {0: "page 0", 1: "page 1"}
+    assert not journal.is_complete()
+
+
+def test_pages_ignores_other_source_hashes(journal_path):
+    PageJournal(journal_path, "hash1").record(0, "old page")
+
+    journal = PageJournal(journal_path, "hash2")
+    assert journal.pages() == {}
+
+
+def test_pages_ignores_truncated_lines(journal_path):
+    journal = PageJournal(journal_path, "hash1")
+    journal.record(0, "page 0")
+    with open(journal_path, "a") as f:
+        f.write('{"source_hash": "hash1", "pa')
+
+    assert journal.pages() == {0: "page 0"}
+
+
+def test_complete_and_reset(journal_path):
+    journal = PageJournal(journal_path, "hash1")
+    journal.record(0, "page 0")
+    journal.complete()
+    assert journal.is_complete()
+
+    journal.reset()
+    assert journal.pages() == {}
+    assert not journal.is_complete()
+    journal.reset()
+
+
+def test_recorded_images(journal_path):
+    PageJournal(journal_path, "old-hash").record(0, "old", "old_0.png")
+    journal = PageJournal(journal_path, "hash")
+    journal.record(0, "new", "new_0.png")
+    journal.record(1, "new")
+
+    assert journal.images(any_source=True) == {0: "new_0.png"}
+    assert journal.recorded_images() == {"old_0.png", "new_0.png"}
@@ -1,6 +1,7 @@
 import os
 import pytest
 import yaml
+from unittest.mock import patch
 from sn2md.metadata import check_metadata_file, write_metadata_file
 from sn2md.types import ConversionMetadata
 
@@ -79,3 +80,45 @@ def test_check_metadata_file_missing(temp_files):
     # No metadata file exists
     result = check_metadata_file(temp_files["metadata_dir"])
     assert result is None
+
+
+def test_check_metadata_file_allow_unchanged_input(temp_files):
+    write_metadata_file(temp_files["source_file"], temp_files["output_file"])
+
+    metadata = check_metadata_file(temp_files["metadata_dir"], allow_unchanged_input=True)
+    assert metadata.input_file == temp_files["source_file"]
+
+    with open(temp_files["output_file"], "w") as f:
+        f.write("# Modified markdown")
+
+    with pytest.raises(ValueError, match="HAS been changed"):
+        check_metadata_file(temp_files["metadata_dir"], allow_unchanged_input=True)
+
+
+def test_check_metadata_file_unchanged_stat(temp_files):
+    # An old source file is recorded with its size and time, and isn't hashed
+    # again while they are unchanged:
+    os.utime(temp_files["source_file"], (1_000_000, 1_000_000))
+    write_metadata_file(temp_files["source_file"], temp_files["output_file"])
+    with open(os.path.join(temp_files["metadata_dir"], ".sn2md.metadata.yaml")) as f:
+        data = yaml.safe_load(f)
+    assert data["input_size"] == len("original content")
+    assert data["input_mtime_ns"] == 1_000_000 * 10**9
+
+    with patch("sn2md.metadata.compute_hash") as mock_hash:
+        with pytest.raises(ValueError, match="has NOT changed"):
+            check_metadata_file(temp_files["metadata_dir"])
+        mock_hash.assert_not_called()
+
+    # A touched, but unchanged, file is hashed:
+    os.utime(temp_files["source_file"], (2_000_000, 2_000_000))
+    with pytest.raises(ValueError, match="has NOT changed"):
+        check_metadata_file(temp_files["metadata_dir"])
+
+
+def test_write_metadata_file_recent_source(temp_files):
+    write_metadata_file(temp_files["source_file"], temp_files["output_file"])
+    with open(os.path.join(temp_files["metadata_dir"], ".sn2md.metadata.yaml")) as f:
+        data = yaml.safe_load(f)
+    assert data["input_size"] is None
+    assert data["input_mtime_ns"] is None
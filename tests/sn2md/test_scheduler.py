@@ -0,0 +1,136 @@
+import os
+from unittest.mock import patch
+
+import pytest
+
+from sn2md.importer import schedule_files
+from sn2md.metadata import write_metadata_file
+from sn2md.scheduler import SourceFile, order_files, scan_directory
+from sn2md.types import Config
+
+
+@pytest.fixture
+def source(tmp_path):
+    source = tmp_path / "source"
+    for name, size, mtime in [
+        ("old.note", 30, 1_000),
+        ("inbox/new.pdf", 20, 3_000),
+        ("archive/2020/big.png", 50, 2_000),
+        ("archive/2020/notes.txt", 1, 4_000),
+    ]:
+        path = source / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x" * size)
+        os.utime(path, (mtime, mtime))
+    os.symlink(source / "archive", source / "link")
+    return source
+
+
+def test_scan_directory(source):
+    files = sorted(scan_directory(str(source)), key=lambda f: f.rel_path)
+    assert [f.rel_path for f in files] == ["archive/2020/big.png", "inbox/new.pdf", "old.note"]
+    assert files[0] == SourceFile(str(source / "archive/2020/big.png"), "archive/2020/big.png", 2_000, 50)
+
+
+@pytest.mark.parametrize(
+    "order, priority, expected",
+    [
+        ("path", [], ["archive/2020/big.png", "inbox/new.pdf", "old.note"]),
+        ("newest", [], ["inbox/new.pdf", "archive/2020/big.png", "old.note"]),
+        ("smallest", [], ["inbox/new.pdf", "old.note", "archive/2020/big.png"]),
+        ("path", ["*.note"], ["old.note", "archive/2020/big.png", "inbox/new.pdf"]),
+        ("newest", ["archive/*", "*.note"], ["archive/2020/big.png", "old.note", "inbox/new.pdf"]),
+    ],
+)
+def test_order_files(source, order, priority, expected):
+    files = order_files(list(scan_directory(str(source))), order, priority)
+    assert [f.rel_path for f in files] == expected
+
+
+def test_schedule_files_skips_unchanged_files(source, tmp_path):
+    output = str(tmp_path / "output")
+    config = Config(directory_order="newest")
+    unchanged = str(source / "inbox/new.pdf")
+    os.makedirs(os.path.join(output, "new"))
+    output_file = os.path.join(output, "new", "new.md")
+    with open(output_file, "w") as f:
+        _ = f.write("markdown")
+    write_metadata_file(unchanged, output_file)
+
+    scheduled = [f.rel_path for f in schedule_files(str(source), output, config)]
+    assert scheduled == ["archive/2020/big.png", "old.note"]
+
+    # Unless forced, or converting selected pages:
+    assert len(schedule_files(str(source), output, config, force=True)) == 3
+    assert len(schedule_files(str(source), output, config, partial=True)) == 3
+    # The default order and config:
+    assert [f.rel_path for f in schedule_files(str(source), output, None)][0] == "archive/2020/big.png"
+
+
+def test_directory_order_is_validated():
+    with pytest.raises(ValueError):
+        Config(directory_order="random")
+
+
+@pytest.mark.parametrize(
+    "rel_path, is_dir, glob, expected",
+    [
+        ("a/b/c.note", False, "*.note", True),
+        ("a/b/c.note", False, "c.*", True),
+        ("a/b/c.note", False, "b/*", False),
+        ("a/b/c.note", False, "a/b/*", True),
+        ("a/b/c.note", False, "/a/*", True),
+        ("a/.git", True, ".git/", True),
+        ("a/.git", False, ".git/", False),
+        ("a/archive", True, "a/archive/", True),
+    ],
+)
+def test_matches(rel_path, is_dir, glob, expected):
+    from sn2md.scheduler import matches
+
+    assert matches(rel_path, is_dir, glob) == expected
+
+
+def scanned(directory, **kwargs) -> list[str]:
+    return sorted(f.rel_path for f in scan_directory(str(directory), **kwargs))
+
+
+def test_scan_directory_include_exclude(source):
+    assert scanned(source, include=["*.note", "inbox/*"]) == ["inbox/new.pdf", "old.note"]
+    assert scanned(source, exclude=["archive/"]) == ["inbox/new.pdf", "old.note"]
+    assert scanned(source, exclude=["*.pdf", "big.png"]) == ["old.note"]
+
+
+def test_scan_directory_prunes_excluded_directories(source, tmp_path):
+    output = source / "inbox" / "output"
+    output.mkdir()
+    (output / "page.png").write_text("page")
+    (source / ".git").mkdir()
+    (source / ".git" / "object.png").write_text("object")
+    (source / ".sn2mdignore").write_text("# version control\n.git/\n\n")
+    (source / "archive" / ".sn2mdignore").write_text("2020/\n")
+
+    scanned_dirs = []
+    scandir = os.scandir
+
+    def record_scandir(path):
+        scanned_dirs.append(os.path.relpath(path, source))
+        return scandir(path)
+
+    with patch("os.scandir", side_effect=record_scandir):
+        assert scanned(source, skip_dirs=[str(output), str(tmp_path / "missing")]) == [
+            "inbox/new.pdf",
+            "old.note",
+        ]
+    assert sorted(scanned_dirs) == [".", "archive", "inbox"]
+
+
+def test_schedule_files_skips_output_directory(source):
+    output = source / "output"
+    (output / "old").mkdir(parents=True)
+    (output / "old" / "old_0.png").write_text("page")
+    assert [f.rel_path for f in schedule_files(str(source), str(output), None)] == [
+        "archive/2020/big.png",
+        "inbox/new.pdf",
+        "old.note",
+    ]
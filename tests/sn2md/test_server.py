@@ -0,0 +1,137 @@
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from unittest.mock import patch
+
+import pytest
+
+from sn2md.server import (
+    ConversionServer,
+    ConversionService,
+    Job,
+    read_token,
+    submit_job,
+    write_token,
+)
+from sn2md.types import Config
+
+
+TOKEN = "token"
+AUTHORIZATION = {"Authorization": f"Bearer {TOKEN}"}
+
+
+@pytest.fixture
+def server():
+    service = ConversionService(Config(), workers=2)
+    server = ConversionServer(service, "127.0.0.1", 0, TOKEN)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+    service.shutdown()
+
+
+def test_submit_file_job(server):
+    with patch("sn2md.server.import_supernote_file_core") as mock_core:
+        mock_core.return_value = "/out/test/test.md"
+        job = submit_job(server, Job(path="/in/test.pdf", output="/out", pages=[0, 2]), poll_interval=0.01, token=TOKEN)
+
+    assert job.status == "done"
+    assert job.output_file == "/out/test/test.md"
+    assert job.error is None
+    args, kwargs = mock_core.call_args
+    assert args[0].extractor.__class__.__name__ == "PDFExtractor"
+    assert args[1:3] == ("/in/test.pdf", "/out")
+    assert kwargs["pages"] == [0, 2]
+
+
+def test_submit_directory_job(server):
+    with patch("sn2md.server.import_supernote_directory_core") as mock_core:
+        job = submit_job(
+            server,
+            Job(path="/in", output="/out", directory=True, force=True, exclude=[".git/"]),
+            poll_interval=0.01,
+            token=TOKEN,
+        )
+
+    assert job.status == "done"
+    args, kwargs = mock_core.call_args
+    assert args[:4] == ("/in", "/out", mock_core.call_args[0][2], True)
+    assert args[2].exclude == [".git/"]
+    assert kwargs["resume"] is True
+
+
+def test_submit_job_failures(server):
+    job = submit_job(server, Job(path="/in/test.txt", output="/out"), poll_interval=0.01, token=TOKEN)
+    assert job.status == "failed"
+    assert job.error == "Unsupported file format"
+
+    with patch("sn2md.server.import_supernote_file_core", side_effect=RuntimeError("boom")):
+        job = submit_job(server, Job(path="/in/test.png", output="/out"), poll_interval=0.01, token=TOKEN)
+    assert job.status == "failed"
+    assert job.error == "RuntimeError: boom"
+
+
+def test_invalid_requests(server):
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(urllib.request.Request(f"{server}/jobs/unknown", headers=AUTHORIZATION))
+    assert e.value.code == 404
+
+    headers = {**AUTHORIZATION, "Content-Type": "application/json"}
+    request = urllib.request.Request(
+        f"{server}/jobs", data=json.dumps({"path": "x"}).encode(), headers=headers
+    )
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(request)
+    assert e.value.code == 400
+
+    request = urllib.request.Request(f"{server}/other", data=b"{}", headers=headers)
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(request)
+    assert e.value.code == 404
+
+
+def test_finished_jobs_are_forgotten():
+    service = ConversionService(Config(), workers=1)
+    with patch("sn2md.server.MAX_FINISHED_JOBS", 1):
+        service.jobs = {
+            str(i): Job(path="p", output="o", id=str(i), status="done") for i in range(3)
+        }
+        service._forget_finished_jobs()
+    assert list(service.jobs) == ["2"]
+    service.shutdown()
+
+
+@pytest.mark.parametrize(
+    "headers, code",
+    [
+        # A "simple" request, that web pages can send without a CORS preflight:
+        ({"Content-Type": "text/plain"}, 401),
+        ({"Content-Type": "application/json", "Authorization": "Bearer wrong"}, 401),
+        ({**AUTHORIZATION, "Content-Type": "text/plain"}, 415),
+    ],
+)
+def test_unauthorized_requests(server, headers, code):
+    data = json.dumps({"path": "/in/test.png", "output": "/out"}).encode()
+    request = urllib.request.Request(f"{server}/jobs", data=data, headers=headers)
+    with patch("sn2md.server.import_supernote_file_core") as mock_core:
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(request)
+    assert e.value.code == code
+    mock_core.assert_not_called()
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(f"{server}/jobs/unknown")
+    assert e.value.code == 401
+
+
+def test_token_file(tmp_path):
+    path = str(tmp_path / "config" / "server.token")
+    assert read_token(path) is None
+    token = write_token(path)
+    assert read_token(path) == token
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert write_token(path) != token
@@ -0,0 +1,42 @@
+import json
+import subprocess
+import sys
+
+# Backends and libraries that only conversions need (importing them is what
+# makes starting slow).
+HEAVY_MODULES = ["llm", "pymupdf", "fitz", "supernotelib", "tqdm", "numpy"]
+
+
+def loaded_modules(code: str) -> list[str]:
+    """Run `code` in a fresh interpreter, returning the heavy modules it imported."""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            code + f"\nimport json, sys; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def test_cli_import_is_light():
+    assert loaded_modules("import sn2md.cli") == []
+
+
+def test_skipped_file_does_not_load_backends():
+    code = """
+from unittest.mock import patch
+from sn2md.importer import get_extractor, import_supernote_file_core
+from sn2md.types import Config
+
+extractor = get_extractor("notes.note", Config())
+with patch("sn2md.importer.verify_metadata_file", side_effect=ValueError("unchanged")):
+    try:
+        import_supernote_file_core(extractor, "notes.note", "out", Config())
+    except ValueError:
+        pass
+"""
+    assert loaded_modules(code) == []
@@ -0,0 +1,48 @@
+import os
+from unittest.mock import patch
+
+from jinja2 import Environment
+
+from sn2md.importer import get_output_path
+from sn2md.templates import get_templates
+from sn2md.types import Config
+
+
+def test_templates_are_compiled_once(tmp_path):
+    config = Config(output_path_template="{{file_basename}}-out")
+    source = tmp_path / "notes.note"
+    source.write_text("")
+
+    get_templates(config)
+    with patch.object(Environment, "from_string", wraps=Environment.from_string) as compile_mock:
+        for _ in range(3):
+            path = get_output_path(config, "output", str(source))
+    assert path == os.path.join("output", "notes-out")
+    compile_mock.assert_not_called()
+
+    assert get_templates(Config(output_path_template="{{file_basename}}-out")) is get_templates(config)
+    assert get_templates(Config()) is not get_templates(config)
+
+
+def test_template_from_string():
+    templates = get_templates(Config(template="# {{ llm_output }}"))
+    assert templates.output is templates.output
+    assert templates.output.render(llm_output="notes") == "# notes"
+
+
+def test_template_file(tmp_path):
+    (tmp_path / "base.md").write_text("---\n---\n{% block body %}{% endblock %}")
+    template_file = tmp_path / "notes.md"
+    template_file.write_text('{% extends "base.md" %}{% block body %}{{ llm_output }}{% endblock %}')
+    cache = tmp_path / "cache"
+
+    config = Config(template_file=str(template_file), template_cache=str(cache))
+    templates = get_templates(config)
+    assert templates.output.render(llm_output="notes") == "---\n---\nnotes"
+    # Compiled templates are cached:
+    assert len(os.listdir(cache)) == 2
+
+    # Changes to the file are picked up:
+    template_file.write_text("changed {{ llm_output }}")
+    os.utime(template_file, (0, 0))
+    assert get_templates(config).output.render(llm_output="notes") == "changed notes"
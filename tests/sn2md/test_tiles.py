@@ -0,0 +1,51 @@
+from io import BytesIO
+
+from PIL import Image
+import pytest
+
+from sn2md.images import png_bytes
+from sn2md.tiles import is_dense, merge_bands, split_bands
+
+
+def page(ink_rows: int = 0) -> bytes:
+    image = Image.new("L", (100, 300), 255)
+    image.paste(0, (0, 0, 100, ink_rows))
+    return png_bytes(image)
+
+
+def test_is_dense(tmp_path):
+    assert is_dense(page(150), 50)
+    assert not is_dense(page(120), 50)
+    path = tmp_path / "page.png"
+    path.write_bytes(page(150))
+    assert is_dense(str(path), 50)
+
+
+def test_split_bands():
+    bands = [Image.open(BytesIO(band)) for band in split_bands(page(), 3, 0.2)]
+    # Each band overlaps its neighbours by 10% of a band's height:
+    assert [band.size for band in bands] == [(100, 110), (100, 120), (100, 110)]
+
+
+def test_split_bands_cropped():
+    image = Image.new("L", (100, 300), 255)
+    image.paste(0, (20, 100, 80, 200))
+    bands = split_bands(png_bytes(image), 2, 0, crop_padding=0)
+    assert [Image.open(BytesIO(band)).size for band in bands] == [(60, 50), (60, 50)]
+
+
+@pytest.mark.parametrize(
+    "markdowns, expected",
+    [
+        (["one\ntwo", "three\nfour"], "one\ntwo\nthree\nfour"),
+        # Lines of the overlap are kept once:
+        (["one\ntwo\nthree", "two\nthree\nfour"], "one\ntwo\nthree\nfour"),
+        (["# Title\n\none", "one\n", "\none\ntwo"], "# Title\n\none\ntwo"),
+        # Lines transcribed a little differently are still the same line:
+        (["a long line of text.", "A long line of text\nnext"], "a long line of text.\nnext"),
+        # Blank lines at the edges of bands are left out:
+        (["one\n\n", "\n\ntwo", ""], "one\ntwo"),
+    ],
+)
+def test_merge_bands(markdowns, expected):
+    assert merge_bands(markdowns) == expected
@@ -0,0 +1,217 @@
+import multiprocessing
+import sqlite3
+import time
+from contextlib import closing
+from unittest.mock import patch
+
+import pytest
+
+from sn2md.importer import import_supernote_queue_core
+from sn2md.types import Config
+from sn2md.workqueue import MAX_ATTEMPTS, WorkQueue
+
+
+@pytest.fixture
+def source(tmp_path):
+    source = tmp_path / "source"
+    (source / "sub").mkdir(parents=True)
+    for name in ["a.note", "b.pdf", "sub/c.png"]:
+        (source / name).write_text(name)
+    (source / "ignored.txt").write_text("ignored")
+    return source
+
+
+def test_add_is_keyed_by_content(tmp_path, source):
+    queue = WorkQueue(str(tmp_path / "queue.db"))
+    assert queue.add(str(source), ["a.note", "b.pdf"]) == 2
+    assert queue.add(str(source), ["a.note", "b.pdf"]) == 0
+
+    (source / "a.note").write_text("changed")
+    assert queue.add(str(source), ["a.note", "b.pdf"]) == 1
+    assert queue.counts() == {"pending": 3}
+
+
+def test_add_hashes_changed_files_only(tmp_path, source):
+    queue = WorkQueue(str(tmp_path / "queue.db"))
+    queue.add(str(source), ["a.note", "b.pdf"])
+
+    (source / "a.note").write_text("a changed")
+    with patch("sn2md.workqueue.compute_hash", return_value="new hash") as mock_hash:
+        assert queue.add(str(source), ["a.note", "b.pdf"]) == 1
+    # The unchanged file (same size and modification time) isn't hashed:
+    mock_hash.assert_called_once_with(str(source / "a.note"))
+
+
+def test_existing_queue_is_migrated(tmp_path, source):
+    path = str(tmp_path / "queue.db")
+    with closing(sqlite3.connect(path)) as db:
+        db.execute(
+            "CREATE TABLE files (path TEXT NOT NULL, source_hash TEXT NOT NULL,"
+            " status TEXT NOT NULL DEFAULT 'pending', worker TEXT, lease_expires REAL,"
+            " attempts INTEGER NOT NULL DEFAULT 0, error TEXT,"
+            " PRIMARY KEY (path, source_hash))"
+        )
+        db.commit()
+
+    queue = WorkQueue(path)
+    assert queue.add(str(source), ["b.pdf", "a.note"]) == 2
+    # Files are claimed in the order they were added:
+    assert queue.claim().path == "b.pdf"
+
+
+def test_claim_and_complete(tmp_path, source):
+    queue = WorkQueue(str(tmp_path / "queue.db"), worker="w1")
+    queue.add(str(source), ["b.pdf", "a.note"])
+
+    # Files are claimed in the order they were added:
+    first, second = queue.claim(), queue.claim()
+    assert (first.path, second.path) == ("b.pdf", "a.note")
+    assert first.worker == "w1"
+    assert queue.claim() is None
+
+    assert queue.complete(first)
+    assert queue.skip(second, "unchanged")
+    assert queue.counts() == {"done": 1, "skipped": 1}
+    assert queue.claim() is None
+
+
+def test_expired_lease_is_reclaimed(tmp_path, source):
+    db = str(tmp_path / "queue.db")
+    dead = WorkQueue(db, worker="dead", lease_seconds=0.05)
+    alive = WorkQueue(db, worker="alive")
+    dead.add(str(source), ["a.note"])
+
+    lease = dead.claim()
+    assert alive.claim() is None
+    time.sleep(0.1)
+
+    reclaimed = alive.claim()
+    assert reclaimed.path == "a.note"
+    assert reclaimed.worker == "alive"
+    assert not dead.renew(lease)
+    assert not dead.complete(lease)
+    assert alive.complete(reclaimed)
+
+
+def test_heartbeat_keeps_the_lease(tmp_path, source):
+    db = str(tmp_path / "queue.db")
+    worker = WorkQueue(db, worker="w1", lease_seconds=0.15)
+    other = WorkQueue(db, worker="w2")
+    worker.add(str(source), ["a.note"])
+
+    lease = worker.claim()
+    with worker.heartbeat(lease) as lost:
+        time.sleep(0.4)
+        assert other.claim() is None
+    assert not lost.is_set()
+    assert worker.complete(lease)
+
+
+def test_heartbeat_reports_a_lost_lease(tmp_path, source):
+    worker = WorkQueue(str(tmp_path / "queue.db"), worker="w1", lease_seconds=0.15)
+    worker.add(str(source), ["a.note"])
+
+    lease = worker.claim()
+    with patch.object(worker, "renew", return_value=False):
+        with worker.heartbeat(lease) as lost:
+            assert lost.wait(1)
+
+
+def test_release_retries_then_fails(tmp_path, source):
+    queue = WorkQueue(str(tmp_path / "queue.db"))
+    queue.add(str(source), ["a.note"])
+
+    for _ in range(MAX_ATTEMPTS - 1):
+        assert queue.release(queue.claim(), "boom")
+        assert queue.counts() == {"pending": 1}
+    assert queue.release(queue.claim(), "boom")
+    assert queue.counts() == {"failed": 1}
+    assert queue.claim() is None
+
+
+def test_expired_leases_fail_after_max_attempts(tmp_path, source):
+    queue = WorkQueue(str(tmp_path / "queue.db"), lease_seconds=0.01)
+    queue.add(str(source), ["a.note"])
+    for _ in range(MAX_ATTEMPTS):
+        assert queue.claim() is not None
+        time.sleep(0.02)
+    assert queue.claim() is None
+    assert queue.counts() == {"failed": 1}
+
+
+def claim_all(db: str, log: str) -> None:
+    queue = WorkQueue(db)
+    while (lease := queue.claim()) is not None:
+        with open(log, "a") as f:
+            f.write(f"{lease.path}\n")
+        time.sleep(0.01)
+        assert queue.complete(lease)
+
+
+def test_files_are_claimed_once_by_concurrent_workers(tmp_path):
+    db, log = str(tmp_path / "queue.db"), str(tmp_path / "claims.log")
+    source = tmp_path / "source"
+    source.mkdir()
+    paths = [f"{i:02}.pdf" for i in range(40)]
+    for path in paths:
+        (source / path).write_text(path)
+    WorkQueue(db).add(str(source), paths)
+
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=claim_all, args=(db, log)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+        assert worker.exitcode == 0
+
+    with open(log) as f:
+        assert sorted(f.read().split()) == paths
+    assert WorkQueue(db).counts() == {"done": 40}
+
+
+def test_import_supernote_queue_core(tmp_path, source):
+    queue = WorkQueue(str(tmp_path / "queue.db"))
+    with patch("sn2md.importer.import_supernote_file_core") as mock_import_file:
+        mock_import_file.side_effect = [None, ValueError("has NOT changed"), None]
+        import_supernote_queue_core(str(source), "out", Config(), queue)
+
+    converted = [call.args[1] for call in mock_import_file.call_args_list]
+    assert converted == [str(source / "a.note"), str(source / "b.pdf"), str(source / "sub/c.png")]
+    assert queue.counts() == {"done": 2, "skipped": 1}
+
+    # Nothing is converted again, until a file changes:
+    (source / "b.pdf").write_text("changed")
+    with patch("sn2md.importer.import_supernote_file_core") as mock_import_file:
+        import_supernote_queue_core(str(source), "out", Config(), queue)
+    assert [call.args[1] for call in mock_import_file.call_args_list] == [str(source / "b.pdf")]
+
+
+def test_import_supernote_queue_core_stops_on_lost_lease(tmp_path, source, caplog):
+    queue = WorkQueue(str(tmp_path / "queue.db"), worker="w1", lease_seconds=0.15)
+    queue.add(str(source), ["a.note"])
+
+    def import_file(*args, deadline, **kwargs):
+        # Converting pages, until the deadline says to stop:
+        for _ in range(100):
+            deadline.check()
+            time.sleep(0.05)
+
+    with (
+        patch("sn2md.importer.schedule_files", return_value=[]),
+        patch.object(queue, "renew", return_value=False),
+        patch("sn2md.importer.import_supernote_file_core", side_effect=import_file),
+    ):
+        start = time.monotonic()
+        import_supernote_queue_core(str(source), "out", Config(), queue)
+
+    assert time.monotonic() - start < 2
+    assert "its lease was lost" in caplog.text
+
+
+def test_import_supernote_queue_core_releases_on_error(tmp_path, source):
+    queue = WorkQueue(str(tmp_path / "queue.db"))
+    with patch("sn2md.importer.import_supernote_file_core", side_effect=RuntimeError("boom")):
+        with pytest.raises(RuntimeError):
+            import_supernote_queue_core(str(source), "out", Config(), queue)
+    assert queue.counts() == {"pending": 3}